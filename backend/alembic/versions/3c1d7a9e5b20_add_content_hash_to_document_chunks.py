@@ -0,0 +1,27 @@
+"""add_content_hash_to_document_chunks
+
+Revision ID: 3c1d7a9e5b20
+Revises: ef2a4fe0b4b9
+Create Date: 2025-06-02 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c1d7a9e5b20'
+down_revision: Union[str, None] = 'ef2a4fe0b4b9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Existing chunks keep NULL; they are simply re-embedded the next time their document is updated
+    op.add_column('document_chunks', sa.Column('content_hash', sa.String(length=64), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('document_chunks', 'content_hash')
@@ -0,0 +1,38 @@
+"""add_markdown_conversion_cache
+
+Revision ID: 8b4e2f6a1d37
+Revises: 3c1d7a9e5b20
+Create Date: 2025-06-04 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b4e2f6a1d37'
+down_revision: Union[str, None] = '3c1d7a9e5b20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('documents', sa.Column('conversion_key', sa.String(length=64), nullable=True))
+    # Whole-file cache lookups filter on (file_hash, conversion_key) across all projects
+    op.create_index('ix_documents_file_hash_conversion_key', 'documents', ['file_hash', 'conversion_key'])
+    op.create_table(
+        'markdown_piece_cache',
+        sa.Column('piece_key', sa.String(length=64), nullable=False),
+        sa.Column('markdown', sa.Text(), nullable=False),
+        sa.Column('model', sa.String(length=255), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('piece_key')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('markdown_piece_cache')
+    op.drop_index('ix_documents_file_hash_conversion_key', table_name='documents')
+    op.drop_column('documents', 'conversion_key')
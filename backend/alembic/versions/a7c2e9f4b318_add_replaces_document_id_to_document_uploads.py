@@ -0,0 +1,26 @@
+"""add_replaces_document_id_to_document_uploads
+
+Revision ID: a7c2e9f4b318
+Revises: f2d9b4c6e187
+Create Date: 2025-06-15 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7c2e9f4b318'
+down_revision: Union[str, None] = 'f2d9b4c6e187'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('document_uploads', sa.Column('replaces_document_id', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('document_uploads', 'replaces_document_id')
@@ -0,0 +1,40 @@
+"""make_document_file_size_not_null
+
+Revision ID: c4e8b1d6f903
+Revises: a7c2e9f4b318
+Create Date: 2025-06-16 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4e8b1d6f903'
+down_revision: Union[str, None] = 'a7c2e9f4b318'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (project_id, file_size, id): keyset pagination of the project document listings by size
+INDEXES = [
+    ('ix_documents_project_id_file_size', 'documents', ['project_id', 'file_size', 'id']),
+    ('ix_document_uploads_project_id_file_size', 'document_uploads', ['project_id', 'file_size', 'id']),
+]
+
+
+def upgrade() -> None:
+    # Documents without a recorded size sort as empty files, as the listing did with COALESCE(file_size, 0)
+    op.execute("UPDATE documents SET file_size = 0 WHERE file_size IS NULL")
+    op.alter_column('documents', 'file_size', existing_type=sa.Integer(), nullable=False)
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
+    op.alter_column('documents', 'file_size', existing_type=sa.Integer(), nullable=True)
@@ -0,0 +1,26 @@
+"""add_stage_to_document_uploads
+
+Revision ID: c7f3a1e9d254
+Revises: 8b4e2f6a1d37
+Create Date: 2025-06-06 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c7f3a1e9d254'
+down_revision: Union[str, None] = '8b4e2f6a1d37'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('document_uploads', sa.Column('stage', sa.String(length=50), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('document_uploads', 'stage')
@@ -0,0 +1,58 @@
+"""add_hot_path_indexes
+
+Revision ID: d4b8e6f2a913
+Revises: c7f3a1e9d254
+Create Date: 2025-06-10 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4b8e6f2a913'
+down_revision: Union[str, None] = 'c7f3a1e9d254'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# users.email (unique constraint) and chat_project.chat_id (leading primary key column) are already indexed
+INDEXES = [
+    ('ix_chats_user_id_updated_at', 'chats', ['user_id', 'updated_at']),
+    ('ix_messages_chat_id_created_at', 'messages', ['chat_id', 'created_at']),
+    ('ix_chat_project_project_id', 'chat_project', ['project_id']),
+    ('ix_documents_project_id_file_hash', 'documents', ['project_id', 'file_hash']),
+    ('ix_document_uploads_project_id', 'document_uploads', ['project_id']),
+    ('ix_document_chunks_document_id', 'document_chunks', ['document_id']),
+    ('ix_project_permissions_user_id_project_id', 'project_permissions', ['user_id', 'project_id']),
+]
+
+
+def upgrade() -> None:
+    # Rewrites document_chunks once; jsonb is stored parsed, so containment queries can use a GIN index
+    op.alter_column(
+        'document_chunks', 'chunk_metadata',
+        type_=postgresql.JSONB(), existing_type=sa.JSON(), postgresql_using='chunk_metadata::jsonb'
+    )
+    # Built concurrently, outside the migration transaction, so live tables stay writable meanwhile
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True, if_not_exists=True)
+        op.create_index(
+            'ix_document_chunks_chunk_metadata', 'document_chunks', ['chunk_metadata'],
+            postgresql_using='gin', postgresql_ops={'chunk_metadata': 'jsonb_path_ops'},
+            postgresql_concurrently=True, if_not_exists=True
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_document_chunks_chunk_metadata', table_name='document_chunks', postgresql_concurrently=True, if_exists=True)
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
+    op.alter_column(
+        'document_chunks', 'chunk_metadata',
+        type_=sa.JSON(), existing_type=postgresql.JSONB(), postgresql_using='chunk_metadata::json'
+    )
@@ -0,0 +1,54 @@
+"""notify_document_upload_status
+
+Revision ID: e5c1a7b3d820
+Revises: d4b8e6f2a913
+Create Date: 2025-06-12 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5c1a7b3d820'
+down_revision: Union[str, None] = 'd4b8e6f2a913'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Channel name is app.services.upload_events.UPLOAD_STATUS_CHANNEL. Notifications are sent on commit only,
+# so listeners never see a transition that is rolled back. The error message is cut to stay well below
+# the 8000 byte payload limit of NOTIFY.
+NOTIFY_FUNCTION = """
+CREATE OR REPLACE FUNCTION notify_document_upload_status() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD.status IS NOT DISTINCT FROM NEW.status AND OLD.stage IS NOT DISTINCT FROM NEW.stage
+       AND OLD.document_id IS NOT DISTINCT FROM NEW.document_id THEN
+        RETURN NEW;
+    END IF;
+    PERFORM pg_notify('document_upload_status', json_build_object(
+        'upload_id', NEW.id,
+        'project_id', NEW.project_id,
+        'file_name', NEW.file_name,
+        'upload_status', NEW.status,
+        'upload_stage', NEW.stage,
+        'upload_error', left(NEW.error_message, 1000),
+        'document_id', NEW.document_id
+    )::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+
+def upgrade() -> None:
+    op.execute(NOTIFY_FUNCTION)
+    op.execute(
+        "CREATE TRIGGER document_uploads_notify_status AFTER INSERT OR UPDATE ON document_uploads "
+        "FOR EACH ROW EXECUTE FUNCTION notify_document_upload_status()"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS document_uploads_notify_status ON document_uploads")
+    op.execute("DROP FUNCTION IF EXISTS notify_document_upload_status()")
@@ -0,0 +1,40 @@
+"""add_document_listing_indexes
+
+Revision ID: f2d9b4c6e187
+Revises: e5c1a7b3d820
+Create Date: 2025-06-14 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2d9b4c6e187'
+down_revision: Union[str, None] = 'e5c1a7b3d820'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (project_id, sort column, id): keyset pagination of the project document listings per sort order
+INDEXES = [
+    ('ix_documents_project_id_created_at', 'documents', ['project_id', 'created_at', 'id']),
+    ('ix_documents_project_id_file_name', 'documents', ['project_id', 'file_name', 'id']),
+    ('ix_document_uploads_project_id_created_at', 'document_uploads', ['project_id', 'created_at', 'id']),
+    ('ix_document_uploads_project_id_file_name', 'document_uploads', ['project_id', 'file_name', 'id']),
+]
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True, if_not_exists=True)
+        # Superseded by the project_id prefix of ix_document_uploads_project_id_created_at
+        op.drop_index('ix_document_uploads_project_id', table_name='document_uploads', postgresql_concurrently=True, if_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_document_uploads_project_id', 'document_uploads', ['project_id'], postgresql_concurrently=True, if_not_exists=True)
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
@@ -2,11 +2,13 @@ from exceptiongroup import catch
 from fastapi import APIRouter, Depends, HTTPException, status, Response
 from fastapi.responses import JSONResponse
 
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session 
 
 from app.dtos.authDTO import LoginResponse, LoginRequest
 from app.services.permission import PermissionService, getPermissionService
-from db.database import get_db_session
+from db.database import get_async_db_session
 from app.core import security
 from app.core.api_reponse import api_response
 from app.dtos.userDTO import UserCreate, UserResponse
@@ -16,18 +18,29 @@ from app.models.models import User
 router = APIRouter()
 
 @router.post("/login", response_model=LoginResponse)
-async def login(*, db: Session = Depends(get_db_session), permissionService: PermissionService = Depends(getPermissionService), login: LoginRequest):
+async def login(*, db: AsyncSession = Depends(get_async_db_session), permissionService: PermissionService = Depends(getPermissionService), login: LoginRequest):
     # Check if the user exists
-    user = db.query(User).filter(User.email == login.email).first()
+    user = await db.scalar(select(User).where(User.email == login.email))
     if not user:
+        security.password_metrics["login_failed"] += 1
         raise HTTPException(status_code=400, detail="Invalid email or password")
 
-    # Verify the password
-    if not security.verifyPassword(login.password, user.hashed_password):
+    # Verify the password (in the password pool, not on the event loop)
+    if not await security.verify_password_async(login.password, user.hashed_password):
+        security.password_metrics["login_failed"] += 1
         raise HTTPException(status_code=400, detail="Invalid email or password")
+    security.password_metrics["login_succeeded"] += 1
+
+    # Upgrade the hash to the configured cost factor while the plain password is at hand
+    if security.password_needs_rehash(user.hashed_password):
+        new_hash = await security.hash_password_async(login.password)
+        # updated_at is kept: it dates permission changes, which a rehash is not
+        await db.execute(update(User).where(User.id == user.id).values(hashed_password=new_hash, updated_at=User.updated_at))
+        await db.commit()
+        security.password_metrics["rehashed"] += 1
     
     # Get user scopes
-    scopes = permissionService.getUserScopes(user.id)
+    scopes = await permissionService.getUserScopes(user.id)
 
     # Generate a JWT token
     access_token = security.createAccessToken(data={"sub": user.email, "scopes": scopes})
@@ -58,25 +71,25 @@ async def logout():
     return response
 
 @router.post("/register", response_model=UserResponse)
-async def register(*,  db: Session = Depends(get_db_session), userCreate: UserCreate):
+async def register(*,  db: AsyncSession = Depends(get_async_db_session), userCreate: UserCreate):
 
     # Check if the user already exists
-    existing_user = db.query(User).filter(User.email == userCreate.email).first()
+    existing_user = await db.scalar(select(User).where(User.email == userCreate.email))
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     # Create a new user
     new_user = User(
         email=userCreate.email,
         username=userCreate.username,
-        hashed_password=security.create_hashed_password(userCreate.password),  # Ensure to hash the password in a real application
+        hashed_password=await security.hash_password_async(userCreate.password),  # Ensure to hash the password in a real application
         is_active=True,
         is_superuser=False,
     )
 
     # Add the new user to the database
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
 
     return new_user
     
@@ -61,7 +61,7 @@ async def get_user_chats(
     current_user: User = Depends(get_current_user),
     chat_service: ChatService = Depends(get_chat_service)
 ):
-    chats = chat_service.get_chats_for_user(user_id=current_user.id)
+    chats = await chat_service.get_chats_for_user(user_id=current_user.id)
     return chats
 
 @router.post("/", response_model=ChatResponse, status_code=status.HTTP_201_CREATED)
@@ -70,7 +70,7 @@ async def create_new_chat(
     current_user: User = Depends(get_current_user),
     chat_service: ChatService = Depends(get_chat_service)
 ):
-    chat = chat_service.create_chat_session(user_id=current_user.id, chat_create_dto=chat_create_dto)
+    chat = await chat_service.create_chat_session(user_id=current_user.id, chat_create_dto=chat_create_dto)
     return chat
 
 @router.get("/{chat_id}", response_model=ChatResponse)
@@ -79,7 +79,7 @@ async def get_specific_chat(
     current_user: User = Depends(get_current_user),
     chat_service: ChatService = Depends(get_chat_service)
 ):
-    chat = chat_service.get_chat_by_id(chat_id=chat_id, user_id=current_user.id)
+    chat = await chat_service.get_chat_by_id(chat_id=chat_id, user_id=current_user.id)
     if not chat:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chat not found or access denied.")
     return chat
@@ -108,6 +108,7 @@ async def send_message_to_chat_streamed(
 
     async def event_generator():
         yield f"data: {json.dumps({'type': 'user_message_saved', 'message': user_message_response.model_dump(mode='json')})}\n\n"
+        stream_end = {'type': 'stream_end'}
         
         try:
             async for item in chat_service.process_and_stream_assistant_response(
@@ -121,6 +122,8 @@ async def send_message_to_chat_streamed(
                     yield f"data: {json.dumps({'type': 'assistant_message_saved', 'message': item.model_dump(mode='json')})}\n\n"
                 elif isinstance(item, dict) and item.get("type") == "citation_payload": # Handle new citation payload
                     yield f"data: {json.dumps(item)}\n\n" # item is already a dict {"type": "citation_payload", "data": "..."}
+                elif isinstance(item, dict) and item.get("type") == "stage_timings": # Only with TRACING_STAGE_TIMINGS
+                    stream_end.update(stage_timings=item["data"], trace_id=item["trace_id"])
                 # Ensure other dict types (like potential errors from LLMService not caught yet) are handled or logged
                 elif isinstance(item, dict):
                      logger.warning(f"Received unhandled dictionary item in stream for chat {chat_id}: {item}")
@@ -129,7 +132,7 @@ async def send_message_to_chat_streamed(
                          yield f"data: {json.dumps(item)}\n\n"
 
 
-            yield f"data: {json.dumps({'type': 'stream_end'})}\n\n"
+            yield f"data: {json.dumps(stream_end)}\n\n"
         except HTTPException as e:
              yield f"data: {json.dumps({'type': 'error', 'detail': e.detail, 'status_code': e.status_code})}\n\n"
              yield f"data: {json.dumps({'type': 'stream_end'})}\n\n"
@@ -137,5 +140,8 @@ async def send_message_to_chat_streamed(
             logger.error(f"Error during assistant response streaming for chat {chat_id}: {e}", exc_info=True)
             yield f"data: {json.dumps({'type': 'error', 'detail': 'An unexpected error occurred while generating the response.'})}\n\n"
             yield f"data: {json.dumps({'type': 'stream_end'})}\n\n"
+        finally:
+            # The session dependency has already exited when the body streams; return the connection it checked out again
+            await chat_service.db.close()
 
     return StreamingResponse(event_generator(), media_type="text/event-stream")
\ No newline at end of file
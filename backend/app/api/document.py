@@ -1,18 +1,24 @@
-from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile, status, Query
+from fastapi import APIRouter, Depends, File, Form, HTTPException, Request, Response, UploadFile, status, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List, Dict
+from typing import List, Dict, Literal, Optional
+import asyncio
+import json
 import hashlib # For hashing string content
 import os # For temp file operations
 import shutil # For temp file operations
-import boto3
 from datetime import UTC, datetime # For timestamps
-from urllib.parse import urlparse
 
 from app.dtos.documentDTO import (
     DocumentResponse, 
     DocumentUploadResult, 
     ProcessingStatusResponse,
     DocumentWithStatusResponse,
+    DocumentCountResponse,
+    DocumentStatusCountResponse,
     DocumentUploadStringRequest # --- IMPORT NEW DTO ---
 )
 from app.dtos.qdrantDTO import SearchQueryRequest, SearchResponse, SearchResultItem
@@ -26,9 +32,13 @@ from app.services.document import (
     create_temp_file_path  # Utility for temp files
 )
 from app.services.qdrant_service import QdrantService, get_qdrant_service
+from app.services.file_download import stored_file_response
+from app.services.markdown_conversion import read_stored_markdown
+from app.services.storage import get_storage
 from app.services.permission import require_permission
 from app.services.rabbitmq import RabbitMQService, get_rabbitmq_service # For direct use in test endpoint
-from db.database import get_db_session
+from app.services.upload_events import upload_status_broadcaster
+from db.database import AsyncSessionLocal, get_async_db_session
 from app.core.security import get_current_user
 from app.models.models import Project, User, Document, DocumentUpload # Import DocumentUpload
 from app.config.config import getConfig # For RabbitMQ queue name
@@ -47,13 +57,15 @@ logger = logging.getLogger(__name__)  # Create a proper logger instance
 async def upload_documents(
     files: List[UploadFile] = File(...),
     project_id: int = Form(...),
+    replace_existing: bool = Form(False, description="Each file replaces the project's document with the same file name."),
     current_user: User = Depends(get_current_user),
     document_service: DocumentService = Depends(get_document_service),
 ):
     return await document_service.upload_documents(
         files=files,
         project_id=project_id,
-        user_id=current_user.id
+        user_id=current_user.id,
+        replace_existing=replace_existing
     )
 
 # --- NEW TEST ENDPOINT ---
@@ -68,7 +80,7 @@ async def upload_documents(
 async def test_upload_document_string(
     request_data: DocumentUploadStringRequest,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db_session), # Direct DB access
+    db: AsyncSession = Depends(get_async_db_session), # Direct DB access
     rabbitmq_service: RabbitMQService = Depends(get_rabbitmq_service), # Direct RabbitMQ access
     app_config: dict = Depends(getConfig) # To get queue name
 ):
@@ -103,10 +115,10 @@ async def test_upload_document_string(
 
         file_hash = hashlib.sha256(content_bytes).hexdigest()
 
-        existing_document = db.query(Document).filter(
+        existing_document = await db.scalar(select(Document).where(
             Document.project_id == project_id,
             Document.file_hash == file_hash
-        ).first()
+        ).limit(1))
 
         if existing_document:
             file_result["status"] = "exists"
@@ -141,11 +153,13 @@ async def test_upload_document_string(
         )
         
         db.add(document_upload)
-        db.commit()
-        db.refresh(document_upload)
+        await db.commit()
+        await db.refresh(document_upload)
 
         message_body = {"document_upload_id": document_upload.id}
-        published = rabbitmq_service.publish_message(
+        # Blocking publish (waits for the broker's confirm): keep it off the event loop
+        published = await run_in_threadpool(
+            rabbitmq_service.publish_message,
             queue_name=app_config.RABBITMQ_DOCUMENT_QUEUE, # Use config for queue name
             message=message_body
         )
@@ -157,7 +171,7 @@ async def test_upload_document_string(
         else:
             document_upload.status = "error"
             document_upload.error_message = "Failed to queue string content for processing."
-            db.commit() # Save error status
+            await db.commit() # Save error status
             file_result["status"] = "error"
             file_result["upload_id"] = document_upload.id
             file_result["error"] = "Failed to queue for processing."
@@ -169,7 +183,7 @@ async def test_upload_document_string(
         raise
     except Exception as e:
         logger.error(f"Unexpected error during string upload of file '{file_name}': {e}", exc_info=True)
-        db.rollback() # Rollback DB changes
+        await db.rollback() # Rollback DB changes
         file_result["error"] = f"Unexpected server error: {e}"
         # Clean up temp file if created and error occurred before MQ publishing logic
         if 'temp_file_path' in locals() and os.path.exists(temp_file_path) and file_result["status"] == "error":
@@ -212,12 +226,12 @@ async def get_upload_statuses(
 )
 async def get_document(
     document_id: int,
-    db: Session = Depends(get_db_session),
+    db: AsyncSession = Depends(get_async_db_session),
     current_user: User = Depends(get_current_user)
 ):
     # @require_permission("view_project" with project_id from document)
     # This requires fetching the document first, then checking permission.
-    document = db.query(Document).filter(Document.id == document_id).first()
+    document = await db.get(Document, document_id)
     if not document:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Document not found")
     
@@ -242,60 +256,170 @@ async def get_document(
     return document
 
 
+DocumentSort = Literal["created_at", "file_name", "file_size"]
+SortOrder = Literal["asc", "desc"]
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+_config = getConfig()
+LIMIT_DESCRIPTION = (
+    "Page size. Without a limit or cursor the whole listing is returned in one response; "
+    f"with only a cursor, pages hold {_config.DOCUMENT_PAGE_SIZE} rows."
+)
+
+
+def _page_limit(limit: Optional[int], cursor: Optional[str]) -> Optional[int]:
+    # Callers that do not paginate (no limit, no cursor) keep getting the full listing
+    if limit is None and cursor is not None:
+        return _config.DOCUMENT_PAGE_SIZE
+    return limit
+
+
 @router.get(
     "/project/{project_id}",
     response_model=List[DocumentResponse],
-    summary="Get all processed documents by project ID",
-    description="Retrieve all successfully processed documents belonging to a specific project."
+    summary="Get processed documents by project ID",
+    description="Retrieve the successfully processed documents belonging to a specific project, or one page of them with `limit`/`cursor`. "
+                f"When more follow, the {NEXT_CURSOR_HEADER} response header holds the `cursor` of the next page."
 )
 @require_permission("view_project", project_id_param="project_id")
 async def get_documents_by_project(
     project_id: int,
+    response: Response,
+    content_type: Optional[str] = Query(None, description="Only documents of this content type."),
+    name_prefix: Optional[str] = Query(None, max_length=255, description="Only documents whose file name starts with this."),
+    sort: DocumentSort = Query("created_at"),
+    order: SortOrder = Query("desc"),
+    cursor: Optional[str] = Query(None, description=f"Value of {NEXT_CURSOR_HEADER} from the previous page."),
+    limit: Optional[int] = Query(None, ge=1, le=_config.DOCUMENT_PAGE_MAX_SIZE, description=LIMIT_DESCRIPTION),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db_session)
+    document_service: DocumentService = Depends(get_document_service)
 ):
-    documents = db.query(Document).filter(Document.project_id == project_id).all()
+    documents, next_cursor = await document_service.get_documents(
+        project_id, content_type=content_type, name_prefix=name_prefix, sort=sort, order=order, cursor=cursor,
+        limit=_page_limit(limit, cursor)
+    )
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     return documents
 
 
+@router.get(
+    "/project/{project_id}/count",
+    response_model=DocumentCountResponse,
+    summary="Count processed documents by project ID",
+    description="Number of processed documents of a project matching the same filters as the listing."
+)
+@require_permission("view_project", project_id_param="project_id")
+async def count_documents_by_project(
+    project_id: int,
+    content_type: Optional[str] = Query(None),
+    name_prefix: Optional[str] = Query(None, max_length=255),
+    current_user: User = Depends(get_current_user),
+    document_service: DocumentService = Depends(get_document_service)
+):
+    total = await document_service.count_documents(project_id, content_type=content_type, name_prefix=name_prefix)
+    return DocumentCountResponse(total=total)
+
+
 @router.get(
     "/project/{project_id}/with-status",
     response_model=List[DocumentWithStatusResponse],
     summary="Get documents by project ID with their processing status",
-    description="Retrieve all document uploads for a project, showing their current processing status and links to processed documents if available."
+    description="Retrieve the document uploads for a project (or one page of them with `limit`/`cursor`), showing their current processing status and links to processed documents if available. "
+                f"When more follow, the {NEXT_CURSOR_HEADER} response header holds the `cursor` of the next page."
 )
 @require_permission(["view_project", "edit_project", "edit_document", "delete_document", "admin"], project_id_param="project_id")
 async def get_documents_with_status_by_project(
     project_id: int,
+    response: Response,
+    status_filter: Optional[List[str]] = Query(None, alias="status", description="Only uploads in one of these processing statuses."),
+    content_type: Optional[str] = Query(None, description="Only uploads of this content type."),
+    name_prefix: Optional[str] = Query(None, max_length=255, description="Only uploads whose file name starts with this."),
+    sort: DocumentSort = Query("created_at"),
+    order: SortOrder = Query("desc"),
+    cursor: Optional[str] = Query(None, description=f"Value of {NEXT_CURSOR_HEADER} from the previous page."),
+    limit: Optional[int] = Query(None, ge=1, le=_config.DOCUMENT_PAGE_MAX_SIZE, description=LIMIT_DESCRIPTION),
     current_user: User = Depends(get_current_user),
     document_service: DocumentService = Depends(get_document_service),
-    db: Session = Depends(get_db_session)
+    db: AsyncSession = Depends(get_async_db_session)
 ):
     # Check if project exists
-    project = db.query(Project).filter(Project.id == project_id).first()
+    project = await db.get(Project, project_id)
     if not project:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Project {project_id} not found")
     
     try:
-        docs_with_status_dicts = await document_service.get_documents_with_status(project_id)
-        
-        # Validate and convert to response models
-        response_list = []
-        for doc_dict in docs_with_status_dicts:
-            try:
-                response_list.append(DocumentWithStatusResponse.model_validate(doc_dict))
-            except Exception as e:
-                logger.error(f"Failed to validate document status response for document {doc_dict.get('id', 'unknown')}: {e}")
-                continue
-        
-        return response_list
-        
+        # Plain dicts; response_model validates them once on the way out
+        docs_with_status, next_cursor = await document_service.get_documents_with_status(
+            project_id, statuses=status_filter, content_type=content_type, name_prefix=name_prefix,
+            sort=sort, order=order, cursor=cursor, limit=_page_limit(limit, cursor)
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error retrieving documents with status for project {project_id}: {e}", exc_info=True)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, 
             detail="Failed to retrieve document status information"
         )
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return docs_with_status
+
+
+@router.get(
+    "/project/{project_id}/with-status/count",
+    response_model=DocumentStatusCountResponse,
+    summary="Count document uploads by project ID and processing status",
+    description="Number of document uploads of a project matching the same filters as the with-status listing, in total and per status."
+)
+@require_permission(["view_project", "edit_project", "edit_document", "delete_document", "admin"], project_id_param="project_id")
+async def count_documents_with_status_by_project(
+    project_id: int,
+    status_filter: Optional[List[str]] = Query(None, alias="status"),
+    content_type: Optional[str] = Query(None),
+    name_prefix: Optional[str] = Query(None, max_length=255),
+    current_user: User = Depends(get_current_user),
+    document_service: DocumentService = Depends(get_document_service)
+):
+    by_status = await document_service.count_documents_with_status(
+        project_id, statuses=status_filter, content_type=content_type, name_prefix=name_prefix
+    )
+    return DocumentStatusCountResponse(total=sum(by_status.values()), by_status=by_status)
+
+
+@router.get(
+    "/project/{project_id}/upload/events",
+    summary="Stream document processing status changes of a project",
+    description="Server-sent events: a snapshot of the project's in-flight uploads, then every status or stage "
+                "transition as it is committed. Replaces polling /upload/status."
+)
+@require_permission(["view_project", "edit_project", "edit_document", "delete_document", "admin"], project_id_param="project_id")
+async def stream_upload_statuses(
+    project_id: int,
+    upload_ids: Optional[List[int]] = Query(None, description="Only report these DocumentUpload IDs."),
+    current_user: User = Depends(get_current_user)
+):
+    keepalive_seconds = getConfig().UPLOAD_STATUS_KEEPALIVE_SECONDS
+    wanted = set(upload_ids) if upload_ids else None
+
+    async def event_generator():
+        # Subscribe before reading the snapshot so no transition falls between the two
+        with upload_status_broadcaster.subscribe(project_id) as events:
+            async with AsyncSessionLocal() as session:
+                snapshot = await DocumentProcessingService(db=session).get_active_upload_statuses(project_id)
+            if wanted is not None:
+                snapshot = [upload for upload in snapshot if upload["upload_id"] in wanted]
+            yield f"data: {json.dumps({'type': 'snapshot', 'uploads': snapshot})}\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(events.get(), timeout=keepalive_seconds)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if wanted is None or event.get("upload_id") in wanted:
+                    yield f"data: {json.dumps({'type': 'upload_status', 'upload': event})}\n\n"
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 
 @router.post(
@@ -308,16 +432,18 @@ async def search_document_chunks(
     request: SearchQueryRequest,
     current_user: User = Depends(get_current_user),
     qdrant_service: QdrantService = Depends(get_qdrant_service),
-    db: Session = Depends(get_db_session)
+    db: AsyncSession = Depends(get_async_db_session)
 ):
     if request.project_id:
-        project = db.query(Project).filter(Project.id == request.project_id).first()
+        project = await db.get(Project, request.project_id)
         if not project:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Project {request.project_id} not found.")
         # TODO: Add permission check: require_permission("view_project", project_id=request.project_id)
 
     try:
-        search_hits = qdrant_service.search_chunks(
+        # Embedding the query and the Qdrant call block: run them off the event loop
+        search_hits = await run_in_threadpool(
+            qdrant_service.search_chunks,
             query_text=request.query_text,
             project_id=request.project_id,
             limit=request.limit
@@ -344,8 +470,6 @@ async def search_document_chunks(
         logger.error(f"Unexpected error during Qdrant search: {e}", exc_info=True)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="An unexpected error occurred during search.")
 
-from fastapi.responses import FileResponse, StreamingResponse, Response
-from botocore.exceptions import ClientError # For S3 error handling
 
 @router.get(
     "/{document_id}/download",
@@ -354,11 +478,12 @@ from botocore.exceptions import ClientError # For S3 error handling
 )
 async def download_document_file(
     document_id: int,
-    db: Session = Depends(get_db_session),
+    request: Request,
+    db: AsyncSession = Depends(get_async_db_session),
     # current_user: User = Depends(get_current_user),
     app_config: dict = Depends(getConfig)
 ):
-    document = db.query(Document).filter(Document.id == document_id).first()
+    document = await db.get(Document, document_id)
     if not document:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Document not found")
 
@@ -368,70 +493,14 @@ async def download_document_file(
     media_type = document.content_type or 'application/octet-stream'
     download_filename = document.file_name or f"document_{document.id}"
 
-    if document.file_path.startswith("s3://"):
-        parsed_url = urlparse(document.file_path)
-        bucket_name = parsed_url.netloc
-        s3_key = parsed_url.path.lstrip("/")
-
-        endpoint_url = app_config.MINIO_ENDPOINT
-        access_key = app_config.MINIO_ACCESS_KEY
-        secret_key = app_config.MINIO_SECRET_KEY
-
-        if not all([endpoint_url, access_key, secret_key, bucket_name]):
-            logger.error(f"S3 storage not properly configured for downloading document {document.id}")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="S3 storage not properly configured"
-            )
-        
-        s3_client = boto3.client(
-            's3',
-            endpoint_url=endpoint_url,
-            aws_access_key_id=access_key,
-            aws_secret_access_key=secret_key,
-            region_name='us-east-1', 
-            config=boto3.session.Config(signature_version='s3v4')
-        )
-        try:
-            s3_object = s3_client.get_object(Bucket=bucket_name, Key=s3_key)
-            
-            # Read the entire content into memory for blob response
-            file_content = s3_object['Body'].read()
-            
-            return Response(
-                content=file_content,
-                media_type=media_type
-            )
-        except ClientError as e:
-            logger.error(f"Error retrieving document {document.id} (path: {document.file_path}) from S3: {e}", exc_info=True)
-            if e.response['Error']['Code'] == 'NoSuchKey':
-                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found in S3 storage.")
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to retrieve file from S3 storage.")
-        except Exception as e:
-            logger.error(f"Unexpected error retrieving document {document.id} from S3: {e}", exc_info=True)
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Unexpected error retrieving file from S3.")
-
-    else: # Assuming local file path
-        if not os.path.exists(document.file_path):
-            logger.error(f"Local document file not found for document {document.id} at path: {document.file_path}")
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found at the specified local path.")
-        
-        try:
-            with open(document.file_path, 'rb') as f:
-                file_content = f.read()
-            
-            return Response(
-                content=file_content,
-                media_type=media_type
-            )
-        except Exception as e:
-            logger.error(f"Error reading local file for document {document.id}: {e}", exc_info=True)
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to read local file.")
-import os
-import json
-import boto3
-from fastapi.responses import PlainTextResponse
-from urllib.parse import urlparse
+    # Streamed in chunks (or redirected to a presigned URL); the file hash is a strong content ETag
+    return await run_in_threadpool(
+        stored_file_response,
+        request, document.file_path, media_type, download_filename,
+        storage=get_storage(),
+        etag=f'"{document.file_hash}"' if document.file_hash else None,
+        presigned_url_expiry=app_config.DOWNLOAD_PRESIGNED_URL_EXPIRY
+    )
 
 @router.get(
     "/{document_id}/markdown",
@@ -441,12 +510,14 @@ from urllib.parse import urlparse
 )
 async def get_document_markdown(
     document_id: int,
-    db: Session = Depends(get_db_session),
+    request: Request,
+    format: str = Query("json", description='"json" for {"content": ...}, "raw" to stream the Markdown file (supports Range and ETag)'),
+    db: AsyncSession = Depends(get_async_db_session),
     current_user: User = Depends(get_current_user),
     app_config: dict = Depends(getConfig)
 ):
     # First get the document
-    document = db.query(Document).filter(Document.id == document_id).first()
+    document = await db.get(Document, document_id)
     if not document:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Document not found")
     
@@ -464,61 +535,29 @@ async def get_document_markdown(
             status_code=status.HTTP_404_NOT_FOUND, 
             detail="Markdown content not available for this document"
         )
-    
+
+    if format == "raw":
+        markdown_name = f"{os.path.splitext(document.file_name or f'document_{document.id}')[0]}.md"
+        return await run_in_threadpool(
+            stored_file_response,
+            request, document.markdown_s3_link, "text/markdown; charset=utf-8", markdown_name,
+            storage=get_storage(), disposition="inline"
+        )
+
     # Get markdown content from S3 or local file depending on the link format
-    markdown_content = ""
-    if document.markdown_s3_link.startswith("s3://"):
-        # Parse S3 URL
-        parsed_url = urlparse(document.markdown_s3_link)
-        bucket_name = parsed_url.netloc
-        s3_key = parsed_url.path.lstrip("/")
-        
-        # Create S3 client
-        endpoint_url = app_config.MINIO_ENDPOINT
-        access_key = app_config.MINIO_ACCESS_KEY
-        secret_key = app_config.MINIO_SECRET_KEY
-        
-        if not all([endpoint_url, access_key, secret_key, bucket_name]):
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="S3 storage not properly configured"
-            )
-            
-        s3_client = boto3.client(
-            's3',
-            endpoint_url=endpoint_url,
-            aws_access_key_id=access_key,
-            aws_secret_access_key=secret_key,
-            region_name='us-east-1', 
-            config=boto3.session.Config(signature_version='s3v4')
+    try:
+        markdown_content = await run_in_threadpool(read_stored_markdown, get_storage(), document.markdown_s3_link)
+    except FileNotFoundError:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Markdown file not found at the specified location"
+        )
+    except Exception as e:
+        logger.error(f"Error retrieving markdown content: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to retrieve markdown content: {str(e)}"
         )
-        
-        try:
-            response = s3_client.get_object(Bucket=bucket_name, Key=s3_key)
-            markdown_content = response['Body'].read().decode('utf-8')
-        except Exception as e:
-            logger.error(f"Error retrieving markdown content from S3: {e}")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Failed to retrieve markdown content: {str(e)}"
-            )
-    else:
-        # Assuming it's a local file path
-        if not os.path.exists(document.markdown_s3_link):
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Markdown file not found at the specified location"
-            )
-        
-        try:
-            with open(document.markdown_s3_link, 'r', encoding='utf-8') as f:
-                markdown_content = f.read()
-        except Exception as e:
-            logger.error(f"Error reading local markdown file: {e}")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Failed to read markdown content: {str(e)}"
-            )
     
     # Ensure we're returning a string type
     return {
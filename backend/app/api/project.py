@@ -7,7 +7,7 @@ from app.dtos.projectDTO import CreateProjectRequest, ProjectResponse, UpdatePro
 from app.dtos.userDTO import UserResponse
 from app.models.models import Project, ProjectPermission
 from db.database import get_db_session
-from app.core.security import get_current_user
+from app.core.security import get_current_user, invalidate_user_principals
 from app.models.models import User
 
 router = APIRouter()
@@ -32,6 +32,7 @@ def create_project(
         permission_id=8 # admin role?
     )
     db.add(project_permission)
+    invalidate_user_principals(db, [current_user.id])
     db.commit()
     db.refresh(new_project)
 
@@ -87,7 +88,9 @@ def delete_project(project_id: int, db: Session = Depends(get_db_session)):
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
 
+    member_ids = db.query(ProjectPermission.user_id).filter(ProjectPermission.project_id == project_id).distinct().all()
     db.query(ProjectPermission).filter(ProjectPermission.project_id == project_id).delete()
+    invalidate_user_principals(db, [member_id for member_id, in member_ids])
     db.commit()
 
     db.delete(project)
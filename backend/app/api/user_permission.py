@@ -7,7 +7,7 @@ from app.core.api_reponse import api_response
 from app.models.models import User, ProjectPermission, Permission, Project
 from app.dtos.userDTO import UserPermissionDTO, UserProjectPermissionResponse, AddUserToProjectRequest, BatchUserAssignment
 from db.database import get_db_session
-from app.core.security import get_current_user
+from app.core.security import get_current_user, invalidate_user_principals
 from app.services.permission import (
     PermissionService, 
     getPermissionService, 
@@ -83,6 +83,7 @@ async def add_user_to_project(
             )
             db.add(project_permission)
     
+    invalidate_user_principals(db, [user.id])
     db.commit()
     
     # Return the user's permissions for the project
@@ -162,6 +163,7 @@ async def assign_users_to_project_batch(
             "permissions": [p.name for p in permissions]
         })
 
+    invalidate_user_principals(db, [response["user_id"] for response in responses])
     db.commit()
     return {"project_id": project_id, "assigned": responses}
 
@@ -290,6 +292,7 @@ async def update_user_permissions(
         )
         db.add(project_permission)
     
+    invalidate_user_principals(db, [user_id])
     db.commit()
     
     # Return the updated permissions
@@ -359,6 +362,7 @@ async def remove_user_from_project(
         ProjectPermission.user_id == user_id
     ).delete()
     
+    invalidate_user_principals(db, [user_id])
     db.commit()
     
     if result == 0:
@@ -11,6 +11,13 @@ class Config:
     SECRET_KEY = os.environ.get("SECRET_KEY", "dev-key-change-in-production")
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=1)
     JWT_REFRESH_TOKEN_EXPIRES = timedelta(days=30)
+    # Authenticated users are cached per token (subject + issue time). Permission changes drop the entries
+    # of this process at once; other processes pick them up within the TTL
+    PRINCIPAL_CACHE_TTL_SECONDS: int = int(os.environ.get("PRINCIPAL_CACHE_TTL_SECONDS", 60)) # 0 disables the cache
+    PRINCIPAL_CACHE_MAX_SIZE: int = int(os.environ.get("PRINCIPAL_CACHE_MAX_SIZE", 10000))
+    # bcrypt runs in a dedicated thread pool so login storms do not block the event loop
+    PASSWORD_HASH_WORKERS: int = int(os.environ.get("PASSWORD_HASH_WORKERS", 4)) # Concurrent hash/verify calls per process
+    BCRYPT_ROUNDS: int = int(os.environ.get("BCRYPT_ROUNDS", 12)) # Changing it rehashes each password at its next login
     UPLOAD_FOLDER = os.environ.get("UPLOAD_FOLDER", "/tmp/uploads") # This might be superseded by TEMP_DIR logic
     MAX_CONTENT_LENGTH = 50 * 1024 * 1024  # 50 MB max upload
 
@@ -23,12 +30,37 @@ class Config:
     POSTGRES_DB = os.environ.get("POSTGRES_DB", "app_db")
 
     SQLALCHEMY_DATABASE_URI = f"postgresql+psycopg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
+    # Connection pool of the async engine used by API handlers (the sync engine opens a connection per session)
+    DB_POOL_SIZE: int = int(os.environ.get("DB_POOL_SIZE", 10))
+    DB_MAX_OVERFLOW: int = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+    DB_POOL_TIMEOUT: int = int(os.environ.get("DB_POOL_TIMEOUT", 30)) # Seconds to wait for a free connection
     
     # MinIO configuration
     MINIO_ENDPOINT = os.environ.get("MINIO_ENDPOINT", "http://localhost:9000") # Adjusted default for Docker
     MINIO_ACCESS_KEY = os.environ.get("MINIO_ACCESS_KEY", "anhyeuem")
     MINIO_SECRET_KEY = os.environ.get("MINIO_SECRET_KEY", "anhyeuem")
     MINIO_BUCKET_NAME = os.environ.get("MINIO_BUCKET_NAME", "documents")
+    # "s3" stores files in MINIO_BUCKET_NAME (local storage if MinIO is not configured), "local" under LOCAL_STORAGE_ROOT
+    STORAGE_BACKEND: str = os.environ.get("STORAGE_BACKEND", "s3")
+    LOCAL_STORAGE_ROOT: str = os.environ.get("LOCAL_STORAGE_ROOT", os.path.join(os.getcwd(), "permanent_storage"))
+    # One S3 client per process; its pool is shared by request threads and transfer workers
+    S3_MAX_POOL_CONNECTIONS: int = int(os.environ.get("S3_MAX_POOL_CONNECTIONS", 32))
+    S3_CONNECT_TIMEOUT: int = int(os.environ.get("S3_CONNECT_TIMEOUT", 5)) # Seconds
+    S3_READ_TIMEOUT: int = int(os.environ.get("S3_READ_TIMEOUT", 60)) # Seconds
+    S3_MAX_ATTEMPTS: int = int(os.environ.get("S3_MAX_ATTEMPTS", 3))
+    S3_MULTIPART_THRESHOLD: int = int(os.environ.get("S3_MULTIPART_THRESHOLD", 8 * 1024 * 1024)) # Files above this are transferred in parallel parts
+    S3_MULTIPART_CHUNKSIZE: int = int(os.environ.get("S3_MULTIPART_CHUNKSIZE", 8 * 1024 * 1024))
+    S3_TRANSFER_MAX_CONCURRENCY: int = int(os.environ.get("S3_TRANSFER_MAX_CONCURRENCY", 8))
+    # Uploads are streamed to "s3" (the storage above, under a staging prefix, so API and consumer share no disk) or "local" (TEMP_DIR)
+    UPLOAD_STAGING: str = os.environ.get("UPLOAD_STAGING", "s3")
+    UPLOAD_STAGING_PREFIX: str = os.environ.get("UPLOAD_STAGING_PREFIX", "uploads/")
+    # >0 redirects downloads of S3 files to presigned URLs valid this many seconds (MINIO_ENDPOINT must be reachable by clients)
+    DOWNLOAD_PRESIGNED_URL_EXPIRY: int = int(os.environ.get("DOWNLOAD_PRESIGNED_URL_EXPIRY", 0))
+    UPLOAD_CONCURRENCY: int = int(os.environ.get("UPLOAD_CONCURRENCY", 8)) # Files of one upload request staged at the same time
+    UPLOAD_PART_SIZE: int = int(os.environ.get("UPLOAD_PART_SIZE", 8 * 1024 * 1024)) # Multipart part size; S3 requires at least 5 MB
+    DOCUMENT_PAGE_SIZE: int = int(os.environ.get("DOCUMENT_PAGE_SIZE", 500)) # Page of the project document listings when a cursor is given without a limit
+    DOCUMENT_PAGE_MAX_SIZE: int = int(os.environ.get("DOCUMENT_PAGE_MAX_SIZE", 1000))
+    UPLOAD_STATUS_KEEPALIVE_SECONDS: int = int(os.environ.get("UPLOAD_STATUS_KEEPALIVE_SECONDS", 15)) # Comment lines keeping idle status streams open through proxies
     
     # RabbitMQ configuration (as in your original file)
     RABBITMQ_HOST = os.environ.get("RABBITMQ_HOST", "localhost")
@@ -38,6 +70,19 @@ class Config:
     RABBITMQ_VHOST = os.environ.get("RABBITMQ_VHOST", "/")
     RABBITMQ_DOCUMENT_QUEUE = os.environ.get("RABBITMQ_DOCUMENT_QUEUE", "document_processing")
     RABBITMQ_CHUNK_QUEUE = os.environ.get("RABBITMQ_CHUNK_QUEUE", "document_chunking")
+    # Failed document messages are retried through TTL delay queues with exponential backoff, then dead-lettered
+    RABBITMQ_MAX_ATTEMPTS = int(os.environ.get("RABBITMQ_MAX_ATTEMPTS", 5)) # Including the first delivery
+    RABBITMQ_RETRY_BASE_DELAY_MS = int(os.environ.get("RABBITMQ_RETRY_BASE_DELAY_MS", 10000)) # Delay before the 2nd attempt, doubled each time
+    RABBITMQ_RETRY_MAX_DELAY_MS = int(os.environ.get("RABBITMQ_RETRY_MAX_DELAY_MS", 600000))
+
+    # --- Metrics ---
+    CONSUMER_METRICS_PORT: int = int(os.environ.get("CONSUMER_METRICS_PORT", 9101)) # Prometheus exporter of the consumer; 0 disables it
+    QUEUE_DEPTH_SAMPLE_SECONDS: int = int(os.environ.get("QUEUE_DEPTH_SAMPLE_SECONDS", 15)) # 0 disables queue depth sampling
+
+    # --- Tracing (OpenTelemetry) ---
+    TRACING_EXPORTER: str = os.environ.get("TRACING_EXPORTER", "none").lower() # none, console or file (JSON lines)
+    TRACING_FILE_PATH: str = os.environ.get("TRACING_FILE_PATH", "traces.jsonl")
+    TRACING_STAGE_TIMINGS: bool = os.environ.get("TRACING_STAGE_TIMINGS", "false").lower() == "true" # Stage durations in the chat SSE stream_end event
 
     # --- Qdrant Configuration ---
     QDRANT_HOST: str = os.environ.get("QDRANT_HOST", "localhost")
@@ -50,6 +95,16 @@ class Config:
     # Dimension for all-MiniLM-L6-v2 is 384. If you change model, update this.
     EMBEDDING_DIMENSION: int = int(os.environ.get("EMBEDDING_DIMENSION", 384))
 
+    # --- Chunking Configuration ---
+    # "tokens" measures chunks with the embedding model's tokenizer so every chunk fits its input window;
+    # "chars" keeps the legacy character-based sizes.
+    CHUNK_LENGTH_UNIT: str = os.environ.get("CHUNK_LENGTH_UNIT", "tokens").lower()
+    CHUNK_MAX_TOKENS: int = int(os.environ.get("CHUNK_MAX_TOKENS", 0)) # 0 = embedding model's max_seq_length minus special tokens
+    CHUNK_OVERLAP_TOKENS: int = int(os.environ.get("CHUNK_OVERLAP_TOKENS", 16))
+    CHUNK_MAX_CHARS: int = int(os.environ.get("CHUNK_MAX_CHARS", 1000))
+    CHUNK_OVERLAP_CHARS: int = int(os.environ.get("CHUNK_OVERLAP_CHARS", 50))
+    CHUNKING_MAX_WORKERS: int = int(os.environ.get("CHUNKING_MAX_WORKERS", 0)) # Processes for bulk chunking; 0 = CPU count
+
         # --- LLM Chat Provider Configuration ---
     CHAT_PROVIDER: str = os.environ.get("CHAT_PROVIDER", "gemini").lower() 
 
@@ -72,6 +127,10 @@ class Config:
     LLM_DEFAULT_TEMPERATURE: float = float(os.environ.get("LLM_DEFAULT_TEMPERATURE", 0.7))
     LLM_DEFAULT_MAX_TOKENS: int = int(os.environ.get("LLM_DEFAULT_MAX_TOKENS", 1500))
     LLM_INPUT_CHUNK_MAX_WORDS: int = int(os.environ.get("LLM_INPUT_CHUNK_MAX_WORDS", 2000)) # Maximum words per chunk for LLM input processing.
+    # When the consumer refines MarkItDown output with the LLM: "auto" (per content type and quality heuristics), "always" or "never"
+    MARKDOWN_REFINEMENT_POLICY: str = os.environ.get("MARKDOWN_REFINEMENT_POLICY", "auto").lower()
+    PDF_CONVERSION_MAX_WORKERS: int = int(os.environ.get("PDF_CONVERSION_MAX_WORKERS", 0)) # Processes extracting PDF pages; 0 = CPU count
+    PDF_PAGES_PER_RANGE: int = int(os.environ.get("PDF_PAGES_PER_RANGE", 8)) # Pages extracted per process-pool task
 
 class DevelopmentConfig(Config):
     DEBUG = True
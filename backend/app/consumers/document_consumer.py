@@ -1,94 +1,248 @@
 import asyncio
+import hashlib
 import json
 import logging
 import os
-import re # Added import
-import shutil
 import sys
+import tempfile
 import time # For retries
-from datetime import UTC, datetime
-from typing import Optional
+from collections import deque
+from datetime import UTC, datetime, timedelta
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
 
-import boto3
 from qdrant_client import models as qdrant_models
+from sqlalchemy import and_, delete, exists, or_
 from sqlalchemy.orm import Session
 
 from app.config.config import getConfig
 from app.models.models import Document, DocumentUpload, DocumentChunk # DocumentChunk for type hinting
 from db.database import SessionLocal # Use SessionLocal to create new sessions
-from app.services.chunking import chunk_markdown, save_chunks_to_database
+from app.services.chunking import (
+    chunk_markdown, chunk_markdown_batch, save_chunks_to_database, save_chunk_updates_to_database,
+    make_token_length_function, page_marker
+)
+from app.services.storage import Storage, init_storage
 from app.services.qdrant_service import QdrantService # Import, don't use get_qdrant_service directly in global scope
-from app.services.rabbitmq import RabbitMQService # For type hinting, actual instance created locally
-from markitdown import MarkItDown # Assuming this is the correct import
+from app.services.rabbitmq import (
+    RabbitMQService, declare_retry_topology, message_attempt, message_max_attempts, publish_dead_letter, publish_retry,
+    retry_delays_ms, retry_queue_name
+)
+from app.core.metrics import INGESTION_STAGE_SECONDS, QUEUE_DEPTH, start_metrics_exporter
+from app.core.tracing import configure_tracing, extract_trace_context, shutdown_tracing, stage_span
+from app.consumers.retry_policy import TRANSIENT_LLM_ERRORS, PermanentProcessingError, is_retryable_error
+from markitdown import FileConversionException, MarkItDown, UnsupportedFormatException
 from app.llm_providers.prompt_factory import ChatPromptFactory # Added for Markdown conversion
 from app.llm_providers.llm_factory import LLMFactory # Added for LLM client
-from app.llm_providers.utils import clean_markdown_response # Added for cleaning LLM responses
+from app.services.markdown_conversion import (
+    conversion_cache_key, find_cached_markdown_link, read_stored_markdown, refine_markdown_with_llm, refine_sections_with_llm
+)
+from app.services.conversion_policy import POLICY_AUTO, POLICY_NEVER, REFINE_NONE, REFINE_SECTIONS, plan_refinement
+from app.services.pdf_conversion import PDF_CONTENT_TYPE, iter_pdf_pages
 
 # Configure logging for the consumer
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# S3 Client Initialization (similar to services, but scoped to consumer needs)
-def _create_s3_client_for_consumer(config_obj):
+# Ingestion stages recorded on DocumentUpload.stage, in order. A failed upload that is requeued
+# resumes after the last completed stage instead of starting over.
+STAGE_DOCUMENT_CREATED = "document_created"
+STAGE_FILE_STORED = "file_stored"
+STAGE_MARKDOWN_STORED = "markdown_stored"
+STAGE_CHUNKS_SAVED = "chunks_saved"
+STAGE_VECTORS_UPSERTED = "vectors_upserted"
+INGESTION_STAGES = [STAGE_DOCUMENT_CREATED, STAGE_FILE_STORED, STAGE_MARKDOWN_STORED, STAGE_CHUNKS_SAVED, STAGE_VECTORS_UPSERTED]
+
+def _stage_reached(doc_upload: DocumentUpload, stage: str) -> bool:
+    return doc_upload.stage in INGESTION_STAGES and INGESTION_STAGES.index(doc_upload.stage) >= INGESTION_STAGES.index(stage)
+
+def _build_chunking_kwargs(config_obj, qdrant_service_instance: QdrantService) -> dict:
+    """
+    Resolves chunk_markdown size arguments from config.
+    In token mode chunks are measured with the embedding model's tokenizer and capped at
+    the model's input window, so `encode` never silently truncates a chunk.
+    Falls back to character sizes if the tokenizer is unavailable.
+    """
+    char_kwargs = {"max_chunk_size": config_obj.CHUNK_MAX_CHARS, "chunk_overlap": config_obj.CHUNK_OVERLAP_CHARS}
+    if config_obj.CHUNK_LENGTH_UNIT != "tokens":
+        return char_kwargs
+
+    embedding_model = qdrant_service_instance.embedding_model
+    tokenizer = getattr(embedding_model, "tokenizer", None)
+    if tokenizer is None:
+        logger.warning("Embedding tokenizer not available. Falling back to character-based chunk sizes.")
+        return char_kwargs
+
+    window = embedding_model.max_seq_length - tokenizer.num_special_tokens_to_add()
+    max_tokens = min(config_obj.CHUNK_MAX_TOKENS, window) if config_obj.CHUNK_MAX_TOKENS > 0 else window
+    logger.info(f"Chunking by embedding tokens: max {max_tokens} tokens, overlap {config_obj.CHUNK_OVERLAP_TOKENS} tokens.")
+    return {
+        "max_chunk_size": max_tokens,
+        "chunk_overlap": config_obj.CHUNK_OVERLAP_TOKENS,
+        "length_function": make_token_length_function(tokenizer),
+    }
+
+def _store_original_file(storage: Storage, project_id: int, file_hash: str, file_name: str, content_type: str, source_path: str) -> str:
+    """
+    Copies a source file to permanent storage and returns its path. An upload staged in S3 by the API
+    is copied server-side, without passing through the consumer.
+    """
+    return storage.copy(source_path, f"project_{project_id}/{file_hash}/{file_name}", content_type)
+
+def _markdown_key(doc_upload: DocumentUpload) -> str:
+    return f"markdowns/project_{doc_upload.project_id}/{doc_upload.file_hash}/{doc_upload.file_hash}.md"
+
+def _copy_cached_markdown(storage: Storage, cached_markdown_link: str, doc_upload: DocumentUpload) -> Optional[str]:
+    """
+    Copies another document's converted Markdown to this upload's own key, so deleting or replacing
+    either document never removes the other's Markdown. Returns None if the cached object is gone.
+    """
+    markdown_key = _markdown_key(doc_upload)
+    if cached_markdown_link == storage.path_for(markdown_key):
+        return cached_markdown_link # A document of the same project and file, already at this key
     try:
-        endpoint_url = config_obj.MINIO_ENDPOINT
-        access_key = config_obj.MINIO_ACCESS_KEY
-        secret_key = config_obj.MINIO_SECRET_KEY
-        bucket_name = config_obj.MINIO_BUCKET_NAME
-
-        if not all([endpoint_url, access_key, secret_key, bucket_name]):
-            logger.warning("MinIO not fully configured for consumer. S3 operations will fail.")
-            return None, None
-            
-        s3_client = boto3.client(
-            's3', endpoint_url=endpoint_url,
-            aws_access_key_id=access_key, aws_secret_access_key=secret_key,
-            region_name='us-east-1', config=boto3.session.Config(signature_version='s3v4')
-        )
-        # Ensure bucket exists (optional, could rely on prior creation)
+        return storage.copy(cached_markdown_link, markdown_key, 'text/markdown')
+    except FileNotFoundError:
+        logger.warning(f"Cached markdown {cached_markdown_link} no longer exists; converting {doc_upload.file_name} again.")
+        return None
+
+def _restore_temp_file(storage: Storage, stored_path: str, temp_file_path: str) -> None:
+    """Recreates an upload's temp file from its permanent copy (see _store_original_file)."""
+    if not stored_path:
+        raise FileNotFoundError(f"Temporary file {temp_file_path} not found and no stored copy is available.")
+    storage.download_file(stored_path, temp_file_path)
+    logger.info(f"Restored temporary file {temp_file_path} from {stored_path}")
+
+def _local_work_path(doc_upload: DocumentUpload) -> str:
+    """Local file the converter reads: the temp file itself, or a download location for uploads staged in S3."""
+    if not doc_upload.temp_path.startswith("s3://"):
+        return doc_upload.temp_path
+    ext = os.path.splitext(doc_upload.file_name or "")[1]
+    return os.path.join(tempfile.gettempdir(), "document_consumer", f"upload_{doc_upload.id}{ext}")
+
+def _remove_staged_upload(storage: Storage, doc_upload: DocumentUpload, work_path: str) -> None:
+    """Removes the staged upload (local temp file or S3 staging object) and the local working copy."""
+    for path in {doc_upload.temp_path, work_path}:
         try:
-            s3_client.head_bucket(Bucket=bucket_name)
-        except Exception:
-            logger.info(f"S3 Bucket '{bucket_name}' not found by consumer, attempting to create.")
-            s3_client.create_bucket(Bucket=bucket_name)
-        return s3_client, bucket_name
-    except Exception as e:
-        logger.error(f"Error initializing S3 client for consumer: {e}")
-        return None, None
+            if path.startswith("s3://") or os.path.exists(path):
+                storage.delete(path)
+                logger.info(f"Removed staged upload {path}")
+        except Exception as e:
+            logger.warning(f"Could not remove temporary file {path}: {e}")
+
+def _chunk_payload(document_record: Document, chunk_data: dict) -> dict:
+    return {
+        "text": chunk_data["text"], "document_id": document_record.id,
+        "project_id": document_record.project_id, "file_name": document_record.file_name,
+        "chunk_metadata": chunk_data["metadata"], "db_chunk_id": chunk_data["metadata"].get("chunk_id")
+    }
+
+def _upsert_chunk_vectors(document_record: Document, text_chunks: list, qdrant_service_instance: QdrantService) -> None:
+    """Embeds chunks and upserts them to Qdrant, using each chunk_id as the point ID."""
+    qdrant_points = []
+    chunk_texts_for_embedding = [chunk['text'] for chunk in text_chunks]
+    if not chunk_texts_for_embedding:
+        return
+    embeddings = qdrant_service_instance.get_embeddings(chunk_texts_for_embedding)
 
-def split_by_sentence(text, max_words=2000):
-    # Split text into sentences (basic rule-based approach)
-    sentences = re.findall(r'[^.!?]+[.!?]?', text.strip())
-    
-    chunks = []
-    current_chunk = []
-    current_word_count = 0
+    for i, chunk_data in enumerate(text_chunks):
+        qdrant_point_id = chunk_data["metadata"].get("chunk_id")
+        if not qdrant_point_id:
+            logger.error(f"Missing chunk_id in metadata for chunk {i} of document {document_record.id}.")
+            continue
 
-    for sentence in sentences:
-        sentence = sentence.strip()
-        if not sentence: # Skip empty sentences
+        qdrant_points.append(qdrant_models.PointStruct(
+            id=qdrant_point_id, vector=embeddings[i], payload=_chunk_payload(document_record, chunk_data)
+        ))
+
+    if qdrant_points:
+        qdrant_service_instance.upsert_chunks(points=qdrant_points)
+        logger.info(f"Upserted {len(qdrant_points)} vectors to Qdrant for document {document_record.id}")
+
+def _find_previous_version(db_session: Session, document_record: Document, doc_upload: Optional[DocumentUpload]) -> Optional[Document]:
+    """The document the upload explicitly replaces (DocumentUpload.replaces_document_id), if it is still in the project."""
+    if doc_upload is None or not doc_upload.replaces_document_id:
+        return None
+    return db_session.query(Document).filter(
+        Document.id == doc_upload.replaces_document_id,
+        Document.project_id == document_record.project_id,
+        Document.id != document_record.id
+    ).first()
+
+def _delete_stored_objects(db_session: Session, storage: Optional[Storage], paths: List[Optional[str]]) -> None:
+    """Deletes a superseded or discarded document's stored original and Markdown, unless another document still links them."""
+    if storage is None:
+        return
+    for path in {path for path in paths if path}:
+        if db_session.query(exists().where(or_(Document.file_path == path, Document.markdown_s3_link == path))).scalar():
             continue
-        word_count = len(sentence.split())
+        try:
+            storage.delete(path)
+            logger.info(f"Deleted stored object {path}")
+        except Exception as e:
+            logger.warning(f"Could not delete stored object {path}: {e}")
 
-        if current_word_count + word_count > max_words and current_chunk: # Ensure current_chunk is not empty before appending
-            chunks.append(' '.join(current_chunk))
-            current_chunk = [sentence]
-            current_word_count = word_count
-        elif current_word_count + word_count <= max_words: # Only add if it fits
-            current_chunk.append(sentence)
-            current_word_count += word_count
-        else: # Sentence itself is too long, add it as its own chunk
-            if current_chunk: # Append previous chunk first
-                 chunks.append(' '.join(current_chunk))
-            chunks.append(sentence)
-            current_chunk = []
-            current_word_count = 0
+def _index_chunks(
+    db_session: Session, document_record: Document, text_chunks: list, qdrant_service_instance: QdrantService,
+    doc_upload: Optional[DocumentUpload] = None, storage: Optional[Storage] = None
+) -> None:
+    """
+    Saves a document's chunks to PostgreSQL, then embeds them and upserts the vectors to Qdrant.
+
+    If the upload replaces an existing document (replaces_document_id), only chunks whose content
+    hash is new are embedded; unchanged chunks keep their rows and vectors (payload refreshed) and
+    chunks missing from the new version are deleted from both stores, as are the replaced document's
+    remaining points and its stored original and Markdown.
+    If the document already has chunk rows, an earlier attempt failed after saving them: the rows are
+    matched to `text_chunks` by content hash and every vector is rewritten, which is safe to repeat.
+    `doc_upload.stage` is set to chunks_saved in the same transaction as the rows.
+    """
+    if doc_upload is not None:
+        doc_upload.stage = STAGE_CHUNKS_SAVED # Flushed by the save functions' commit
+
+    if db_session.query(exists().where(DocumentChunk.document_id == document_record.id)).scalar():
+        new_chunks, reused_chunks, removed_chunk_ids = save_chunk_updates_to_database(
+            db=db_session, chunks=text_chunks, previous_document_id=document_record.id,
+            document_id=document_record.id, project_id=document_record.project_id,
+            file_name=document_record.file_name, file_hash=document_record.file_hash
+        )
+        logger.info(f"Resuming indexing of document {document_record.id}: rewriting {len(text_chunks)} vectors")
+        _upsert_chunk_vectors(document_record, text_chunks, qdrant_service_instance)
+        qdrant_service_instance.delete_points(removed_chunk_ids)
+        if doc_upload is not None and doc_upload.replaces_document_id:
+            # Points of the replaced document that the interrupted attempt had not deleted yet
+            qdrant_service_instance.delete_document_points(doc_upload.replaces_document_id)
+        return
 
+    previous_document = _find_previous_version(db_session, document_record, doc_upload)
+    if previous_document is None:
+        saved_chunk_db_ids = save_chunks_to_database(
+            db=db_session, chunks=text_chunks, document_id=document_record.id,
+            project_id=document_record.project_id, file_name=document_record.file_name,
+            file_hash=document_record.file_hash
+        )
+        logger.info(f"Saved {len(saved_chunk_db_ids)} chunks to database for document {document_record.id}")
+        _upsert_chunk_vectors(document_record, text_chunks, qdrant_service_instance)
+        return
 
-    if current_chunk:
-        chunks.append(' '.join(current_chunk))
+    previous_document_id = previous_document.id
+    previous_paths = [previous_document.file_path, previous_document.markdown_s3_link]
+    new_chunks, reused_chunks, removed_chunk_ids = save_chunk_updates_to_database(
+        db=db_session, chunks=text_chunks, previous_document_id=previous_document_id,
+        document_id=document_record.id, project_id=document_record.project_id,
+        file_name=document_record.file_name, file_hash=document_record.file_hash
+    )
+    logger.info(
+        f"Document {document_record.id} replaces document {previous_document_id} ({document_record.file_name}): "
+        f"{len(new_chunks)} new, {len(reused_chunks)} unchanged, {len(removed_chunk_ids)} removed chunks"
+    )
 
-    return chunks
+    _upsert_chunk_vectors(document_record, new_chunks, qdrant_service_instance)
+    qdrant_service_instance.set_payloads({
+        chunk_data["metadata"]["chunk_id"]: _chunk_payload(document_record, chunk_data) for chunk_data in reused_chunks
+    })
+    qdrant_service_instance.delete_points(removed_chunk_ids)
+    qdrant_service_instance.delete_document_points(previous_document_id)
+    _delete_stored_objects(db_session, storage, previous_paths)
 
 async def _update_upload_status(db_session: Session, upload_id: int, status: str, error_message: Optional[str] = None, document_id: Optional[int] = None):
     """Safely updates DocumentUpload status and associated document_id if provided."""
@@ -107,8 +261,188 @@ async def _update_upload_status(db_session: Session, upload_id: int, status: str
         db_session.rollback()
         logger.error(f"Failed to update status for DocumentUpload {upload_id}: {e}", exc_info=True)
 
+async def _handle_failure(
+    ch, method, properties, body, db_session: Session, upload_id: Optional[int], error: Exception,
+    error_detail: str, document_id: Optional[int] = None
+):
+    """
+    Schedules another attempt of a failed message through the retry queues, or dead-letters it when the
+    error is permanent or the message has used all its attempts. The message is acked once republished.
+    """
+    queue_name = getConfig().RABBITMQ_DOCUMENT_QUEUE
+    if is_retryable_error(error) and message_attempt(properties) < message_max_attempts(properties):
+        delay_ms = publish_retry(ch, queue_name, body, properties, error_detail)
+        if upload_id:
+            await _update_upload_status(db_session, upload_id, "retrying", f"{error_detail} (retrying in {delay_ms // 1000}s)", document_id=document_id)
+    else:
+        publish_dead_letter(ch, queue_name, body, properties, error_detail)
+        if upload_id:
+            await _update_upload_status(db_session, upload_id, "error", error_detail, document_id=document_id)
+    ch.basic_ack(delivery_tag=method.delivery_tag)
+
+
+async def _convert_pdf_by_pages(
+    db_session: Session, doc_upload: DocumentUpload, temp_file_path: str,
+    to_markdown_prompt_str: str, conversion_model: str, refinement_policy: str
+) -> Optional[Tuple[str, bool]]:
+    """
+    Converts a PDF page by page: pages are extracted in a process pool and each page is refined
+    with the LLM as soon as it is extracted. Every page is prefixed with a page marker so chunks
+    carry their page numbers. Returns None if the PDF has no extractable text.
+    """
+    app_config = getConfig()
+    client = None
+    parts = []
+    has_text = False
+    conversion_complete = True
+    async for page_number, page_text in iter_pdf_pages(
+        temp_file_path, app_config.PDF_CONVERSION_MAX_WORKERS or None, app_config.PDF_PAGES_PER_RANGE
+    ):
+        page_markdown = page_text.strip()
+        if page_markdown:
+            has_text = True
+            # pdfminer text has no Markdown structure, which plan_refinement always refines in full
+            if refinement_policy != POLICY_NEVER:
+                if client is None:
+                    client, _ = LLMFactory.create_async_client('gemini')
+                refined_markdown, page_complete = await refine_markdown_with_llm(
+                    db_session, page_markdown, client, conversion_model, to_markdown_prompt_str,
+                    f"{doc_upload.file_name} (page {page_number})"
+                )
+                conversion_complete = conversion_complete and page_complete
+                page_markdown = refined_markdown.strip() or page_markdown
+        parts.append(page_marker(page_number) + page_markdown + "\n\n")
+
+    if not has_text:
+        return None
+    logger.info(f"Converted {len(parts)} PDF pages of {doc_upload.file_name}.")
+    return "".join(parts), conversion_complete
+
+async def _convert_whole_document(
+    db_session: Session, doc_upload: DocumentUpload, temp_file_path: str,
+    to_markdown_prompt_str: str, conversion_model: str, refinement_policy: str
+) -> Tuple[str, bool]:
+    """
+    Converts a file with MarkItDown, then refines the result with the LLM as decided by
+    plan_refinement: not at all, only low-quality sections, or in full.
+    """
+    # Step 1: Convert with MarkItDown
+    logger.info(f"Attempting MarkItDown conversion for {doc_upload.file_name}.")
+    md_converter = MarkItDown(enable_plugins=False) # Consider if plugins are needed
+    try:
+        conversion_result = md_converter.convert(temp_file_path)
+    except (UnsupportedFormatException, FileConversionException) as e:
+        # The same file fails the same way on every attempt: dead-letter it right away
+        raise PermanentProcessingError(f"MarkItDown cannot convert {doc_upload.file_name}: {e}") from e
+
+    if conversion_result and conversion_result.markdown and conversion_result.markdown.strip():
+        markdown_from_markitdown = conversion_result.markdown
+        logger.info(f"MarkItDown successfully converted {doc_upload.file_name} to initial markdown.")
+    else:
+        # If MarkItDown fails or returns empty, we might still try LLM with raw content if possible,
+        # or handle as an error. For now, let's log and proceed, LLM might still work with raw.
+        logger.warning(f"MarkItDown conversion failed or produced empty markdown for {doc_upload.file_name}.")
+        markdown_from_markitdown = "" # Ensure it's an empty string
+
+    # Step 2: Refine with LLM
+    # The LLM will now try to refine the MarkItDown output, or convert raw if MarkItDown failed.
+    # Determine content for LLM: MarkItDown output if available, otherwise raw file content.
+    content_for_llm = markdown_from_markitdown
+    if not content_for_llm.strip(): # If MarkItDown output was empty, try to read raw file content
+        logger.info(f"MarkItDown output was empty for {doc_upload.file_name}. Reading raw file content for LLM.")
+        try:
+            with open(temp_file_path, 'rb') as f:
+                raw_bytes = f.read()
+            try:
+                raw_content_for_llm = raw_bytes.decode('utf-8')
+            except UnicodeDecodeError:
+                logger.warning(f"UTF-8 decoding failed for {doc_upload.file_name} (LLM fallback). Trying latin-1.")
+                try:
+                    raw_content_for_llm = raw_bytes.decode('latin-1')
+                except UnicodeDecodeError:
+                    logger.error(f"Could not decode file content for {doc_upload.file_name} (LLM fallback) with utf-8 or latin-1.")
+                    raw_content_for_llm = ""
+            content_for_llm = raw_content_for_llm
+        except Exception as e_read:
+            logger.error(f"Error reading raw file content for LLM fallback for {doc_upload.file_name}: {e_read}")
+            content_for_llm = "" # Ensure it's empty if read fails
+
+    markdown_content = ""
+    conversion_complete = False
+    plan = plan_refinement(doc_upload.content_type, markdown_from_markitdown, refinement_policy)
+    logger.info(f"Refinement plan for {doc_upload.file_name}: {plan.mode} ({plan.reason}).")
+
+    if plan.mode == REFINE_NONE:
+        markdown_content = markdown_from_markitdown
+        conversion_complete = True
+    elif plan.mode == REFINE_SECTIONS:
+        logger.info(f"Refining {len(plan.refine_indices)} of {len(plan.sections)} sections of {doc_upload.file_name} with LLM.")
+        client, _ = LLMFactory.create_async_client('gemini')
+        markdown_content, conversion_complete = await refine_sections_with_llm(
+            db_session, plan.sections, plan.refine_indices, client, conversion_model, to_markdown_prompt_str, doc_upload.file_name
+        )
+    elif content_for_llm.strip():
+        logger.info(f"Attempting LLM refinement/conversion for {doc_upload.file_name}.")
+        client, _ = LLMFactory.create_async_client('gemini')
+        refined_markdown, conversion_complete = await refine_markdown_with_llm(
+            db_session, content_for_llm, client, conversion_model, to_markdown_prompt_str, doc_upload.file_name
+        )
+
+        if refined_markdown:
+            markdown_content = refined_markdown
+            logger.info(f"LLM successfully refined/converted content for {doc_upload.file_name} to markdown.")
+        else:
+            logger.warning(f"LLM failed to process any chunks for {doc_upload.file_name}. Using MarkItDown output if available.")
+            markdown_content = markdown_from_markitdown # Fallback to MarkItDown's direct output
+    else:
+        logger.warning(f"No content available (neither from MarkItDown nor raw file) for LLM processing for {doc_upload.file_name}. Markdown will be empty.")
+
+    return markdown_content, conversion_complete
+
+async def _convert_to_markdown(
+    db_session: Session, doc_upload: DocumentUpload, document_record: Document, temp_file_path: str,
+    to_markdown_prompt_str: str, conversion_model: str, conversion_key: str, storage: Storage,
+    refinement_policy: str = POLICY_AUTO
+) -> str:
+    """
+    Converts an uploaded file to Markdown and stores the result. PDFs are converted page by page
+    (falling back to MarkItDown on the whole file); other files go through _convert_whole_document.
+    A conversion where every piece succeeded is tagged with `conversion_key` so later uploads of the
+    same file can reuse it.
+    """
+    pdf_result = None
+    if doc_upload.content_type == PDF_CONTENT_TYPE:
+        try:
+            pdf_result = await _convert_pdf_by_pages(
+                db_session, doc_upload, temp_file_path, to_markdown_prompt_str, conversion_model, refinement_policy
+            )
+            if pdf_result is None:
+                logger.info(f"No page text extracted from {doc_upload.file_name}. Converting the whole file instead.")
+        except TRANSIENT_LLM_ERRORS:
+            raise # Retry the message rather than converting the whole file with the same unavailable LLM
+        except Exception as e:
+            logger.warning(f"Page-by-page PDF conversion failed for {doc_upload.file_name}: {e}. Converting the whole file instead.")
+
+    if pdf_result is not None:
+        markdown_content, conversion_complete = pdf_result
+    else:
+        markdown_content, conversion_complete = await _convert_whole_document(
+            db_session, doc_upload, temp_file_path, to_markdown_prompt_str, conversion_model, refinement_policy
+        )
 
-async def process_message_callback(ch, method, properties, body, qdrant_service_instance: QdrantService, s3_client, s3_bucket_name, app_config):
+    # Save the refined markdown to storage (S3, or local disk if S3 is not configured)
+    if markdown_content.strip():
+        document_record.markdown_s3_link = storage.save_bytes(markdown_content.encode('utf-8'), _markdown_key(doc_upload), 'text/markdown')
+        logger.info(f"Markdown for document {document_record.id} saved to {document_record.markdown_s3_link}")
+        if conversion_complete:
+            document_record.conversion_key = conversion_key
+        doc_upload.stage = STAGE_MARKDOWN_STORED # Committed together with the link
+        db_session.commit()
+
+    return markdown_content
+
+
+async def process_message_callback(ch, method, properties, body, qdrant_service_instance: QdrantService, storage: Storage, app_config, chunking_kwargs: Optional[dict] = None):
     """
     Callback function to process a message from RabbitMQ.
     Contains the core document processing pipeline.
@@ -127,181 +461,113 @@ async def process_message_callback(ch, method, properties, body, qdrant_service_
             ch.basic_ack(delivery_tag=method.delivery_tag) # Acknowledge to remove from queue
             return
 
-        await _update_upload_status(db, upload_id, "processing")
-
         doc_upload = db.query(DocumentUpload).filter(DocumentUpload.id == upload_id).first()
         if not doc_upload:
             logger.error(f"DocumentUpload record {upload_id} not found. Discarding message.")
-            await _update_upload_status(db, upload_id, "error", "Upload record not found during processing.")
             ch.basic_ack(delivery_tag=method.delivery_tag)
             return
 
+        if doc_upload.status == "completed":
+            # Redelivered or requeued twice; processing is idempotent but there is nothing left to do
+            logger.info(f"DocumentUpload {upload_id} already completed. Acknowledging message.")
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+            return
+
+        doc_upload.error_message = None # Clear the error of a previous failed attempt
+        await _update_upload_status(db, upload_id, "processing")
+        processing_started = time.perf_counter()
+
         logger.info(f"Starting processing for DocumentUpload {upload_id}, file: {doc_upload.file_name}")
 
-        # 1. Create Document record
-        document_record = Document(
-            file_path="", # Placeholder, updated after S3/local save
-            file_name=doc_upload.file_name,
-            file_size=doc_upload.file_size,
-            content_type=doc_upload.content_type,
-            file_hash=doc_upload.file_hash,
-            project_id=doc_upload.project_id,
-            uploaded_by=doc_upload.user_id,
-            created_at=datetime.now(UTC),
-            updated_at=datetime.now(UTC)
-        )
-        db.add(document_record)
-        db.commit()
-        db.refresh(document_record)
-        # Link DocumentUpload to the new Document record
-        await _update_upload_status(db, upload_id, "processing", document_id=document_record.id)
-        logger.info(f"Created Document record {document_record.id} for upload {upload_id}")
+        # 1. Create Document record, or pick up the one of an interrupted attempt
+        document_record = None
+        if doc_upload.document_id:
+            document_record = db.query(Document).filter(Document.id == doc_upload.document_id).first()
+        if document_record:
+            logger.info(f"Resuming DocumentUpload {upload_id} with Document {document_record.id} after stage '{doc_upload.stage}'")
+        else:
+            document_record = Document(
+                file_path="", # Placeholder, updated after S3/local save
+                file_name=doc_upload.file_name,
+                file_size=doc_upload.file_size,
+                content_type=doc_upload.content_type,
+                file_hash=doc_upload.file_hash,
+                project_id=doc_upload.project_id,
+                uploaded_by=doc_upload.user_id,
+                created_at=datetime.now(UTC),
+                updated_at=datetime.now(UTC)
+            )
+            db.add(document_record)
+            db.commit()
+            db.refresh(document_record)
+            # Link DocumentUpload to the new Document record
+            doc_upload.stage = STAGE_DOCUMENT_CREATED
+            await _update_upload_status(db, upload_id, "processing", document_id=document_record.id)
+            logger.info(f"Created Document record {document_record.id} for upload {upload_id}")
 
         # 2. Store file (S3 or local)
-        temp_file_path = doc_upload.temp_path
-        if not os.path.exists(temp_file_path):
-            raise FileNotFoundError(f"Temporary file {temp_file_path} not found for upload {upload_id}.")
-
-        if s3_client and s3_bucket_name:
-            s3_path = f"project_{doc_upload.project_id}/{doc_upload.file_hash}/{doc_upload.file_name}"
-            with open(temp_file_path, "rb") as f:
-                s3_client.upload_fileobj(
-                    f, s3_bucket_name, s3_path,
-                    ExtraArgs={"ContentType": doc_upload.content_type}
-                )
-            document_record.file_path = f"s3://{s3_bucket_name}/{s3_path}"
-            logger.info(f"File for upload {upload_id} uploaded to S3: {document_record.file_path}")
+        # Uploads staged in S3 are converted from a local download of the stored original
+        temp_file_path = _local_work_path(doc_upload)
+        if _stage_reached(doc_upload, STAGE_FILE_STORED) and document_record.file_path:
+            logger.info(f"File for upload {upload_id} already stored at: {document_record.file_path}")
         else:
-            perm_dir = os.path.join(os.getcwd(), "permanent_storage", f"project_{doc_upload.project_id}", doc_upload.file_hash)
-            os.makedirs(perm_dir, exist_ok=True)
-            perm_path = os.path.join(perm_dir, doc_upload.file_name)
-            shutil.copy2(temp_file_path, perm_path)
-            document_record.file_path = perm_path
-            logger.info(f"File for upload {upload_id} saved locally: {document_record.file_path}")
-        db.commit()
+            if not doc_upload.temp_path.startswith("s3://") and not os.path.exists(temp_file_path):
+                raise FileNotFoundError(f"Temporary file {temp_file_path} not found for upload {upload_id}.")
+
+            with INGESTION_STAGE_SECONDS.labels("store_file").time(), stage_span("ingest.store_file"):
+                document_record.file_path = _store_original_file(
+                    storage, doc_upload.project_id, doc_upload.file_hash,
+                    doc_upload.file_name, doc_upload.content_type, doc_upload.temp_path
+                )
+            doc_upload.stage = STAGE_FILE_STORED
+            logger.info(f"File for upload {upload_id} stored at: {document_record.file_path}")
+            db.commit()
 
         # 3. Convert document to Markdown
         markdown_content = ""
         try:
-            # Step 1: Convert with MarkItDown
-            logger.info(f"Attempting MarkItDown conversion for {doc_upload.file_name}.")
-            md_converter = MarkItDown(enable_plugins=False) # Consider if plugins are needed
-            conversion_result = md_converter.convert(temp_file_path)
-
-            if conversion_result and conversion_result.markdown and conversion_result.markdown.strip():
-                markdown_from_markitdown = conversion_result.markdown
-                logger.info(f"MarkItDown successfully converted {doc_upload.file_name} to initial markdown.")
+            if _stage_reached(doc_upload, STAGE_MARKDOWN_STORED) and document_record.markdown_s3_link:
+                # Converted by an interrupted attempt; never pay for the conversion twice
+                markdown_content = read_stored_markdown(storage, document_record.markdown_s3_link)
+                logger.info(f"Reusing markdown stored by a previous attempt at {document_record.markdown_s3_link}")
             else:
-                # If MarkItDown fails or returns empty, we might still try LLM with raw content if possible,
-                # or handle as an error. For now, let's log and proceed, LLM might still work with raw.
-                logger.warning(f"MarkItDown conversion failed or produced empty markdown for {doc_upload.file_name}.")
-                markdown_from_markitdown = "" # Ensure it's an empty string
-
-            # Step 2: Refine with LLM
-            # The LLM will now try to refine the MarkItDown output, or convert raw if MarkItDown failed.
-            # Determine content for LLM: MarkItDown output if available, otherwise raw file content.
-            
-            content_for_llm = markdown_from_markitdown
-            if not content_for_llm.strip(): # If MarkItDown output was empty, try to read raw file content
-                logger.info(f"MarkItDown output was empty for {doc_upload.file_name}. Reading raw file content for LLM.")
-                try:
-                    with open(temp_file_path, 'rb') as f:
-                        raw_bytes = f.read()
-                    try:
-                        raw_content_for_llm = raw_bytes.decode('utf-8')
-                    except UnicodeDecodeError:
-                        logger.warning(f"UTF-8 decoding failed for {doc_upload.file_name} (LLM fallback). Trying latin-1.")
-                        try:
-                            raw_content_for_llm = raw_bytes.decode('latin-1')
-                        except UnicodeDecodeError:
-                            logger.error(f"Could not decode file content for {doc_upload.file_name} (LLM fallback) with utf-8 or latin-1.")
-                            raw_content_for_llm = ""
-                    content_for_llm = raw_content_for_llm
-                except Exception as e_read:
-                    logger.error(f"Error reading raw file content for LLM fallback for {doc_upload.file_name}: {e_read}")
-                    content_for_llm = "" # Ensure it's empty if read fails
-
-            final_markdown_content = ""
-            if content_for_llm.strip():
-                logger.info(f"Attempting LLM refinement/conversion for {doc_upload.file_name}.")
                 to_markdown_prompt_str = ChatPromptFactory.to_markdown_prompt()
-                client, model = LLMFactory.create_async_client('gemini')
-                
-                content_chunks = split_by_sentence(content_for_llm) # Split content
-                processed_chunks = []
-
-                for chunk_index, chunk in enumerate(content_chunks):
-                    if not chunk.strip():
-                        continue
-                    logger.info(f"Processing chunk {chunk_index + 1}/{len(content_chunks)} for {doc_upload.file_name}")
-                    completion_kwargs = {
-                        "messages": [
-                            {"role": "user", "content": chunk},
-                            {"role": "developer", "content": to_markdown_prompt_str}
-                        ],
-                        "temperature": 0.5,
-                        "model": model,
-                    }
-                    
-                    try:
-                        response = await client.chat.completions.create(**completion_kwargs)
-                        if response and response.choices and response.choices[0].message and response.choices[0].message.content:
-                            raw_content = response.choices[0].message.content
-                            cleaned_content = clean_markdown_response(raw_content)
-                            processed_chunks.append(cleaned_content)
-                            logger.info(f"LLM successfully processed chunk {chunk_index + 1} for {doc_upload.file_name}.")
-                        else:
-                            logger.warning(f"LLM failed to process chunk {chunk_index + 1} for {doc_upload.file_name} or returned empty. Skipping this chunk.")
-                    except Exception as e_llm_chunk:
-                        logger.error(f"Error processing chunk {chunk_index + 1} with LLM for {doc_upload.file_name}: {e_llm_chunk}")
-                        # Optionally, decide if you want to append the original chunk or skip
-                        # For now, skipping if LLM fails for a chunk.
-
-                if processed_chunks:
-                    final_markdown_content = "\\n\\n".join(processed_chunks) # Join processed chunks
-                    logger.info(f"LLM successfully refined/converted content for {doc_upload.file_name} to markdown from {len(content_chunks)} chunks.")
-                else:
-                    logger.warning(f"LLM failed to process any chunks for {doc_upload.file_name}. Using MarkItDown output if available.")
-                    final_markdown_content = markdown_from_markitdown # Fallback to MarkItDown's direct output
-            else:
-                logger.warning(f"No content available (neither from MarkItDown nor raw file) for LLM processing for {doc_upload.file_name}. Markdown will be empty.")
-                final_markdown_content = "" # Ensure it's empty
-
-            markdown_content = final_markdown_content # Assign to the variable used later
-
-            # Save the refined markdown to S3 (or local storage if S3 is not configured)
-            if markdown_content.strip():
-                markdown_file_name = f"{doc_upload.file_hash}.md"
-                if s3_client and s3_bucket_name:
-                    # Define a specific path for markdown files in S3
-                    markdown_s3_path = f"markdowns/project_{doc_upload.project_id}/{doc_upload.file_hash}/{markdown_file_name}"
-                    s3_client.put_object(
-                        Bucket=s3_bucket_name,
-                        Key=markdown_s3_path,
-                        Body=markdown_content.encode('utf-8'),
-                        ContentType='text/markdown'
-                    )
-                    document_record.markdown_s3_link = f"s3://{s3_bucket_name}/{markdown_s3_path}"
-                    logger.info(f"Markdown for document {document_record.id} saved to S3: {document_record.markdown_s3_link}")
+                conversion_model = app_config.GEMINI_MODEL
+                refinement_policy = app_config.MARKDOWN_REFINEMENT_POLICY
+                conversion_key = conversion_cache_key(doc_upload.file_hash, to_markdown_prompt_str, conversion_model, refinement_policy)
+                cached_markdown_link = find_cached_markdown_link(db, doc_upload.file_hash, conversion_key)
+                markdown_link = None
+                if cached_markdown_link:
+                    # The same file was already converted (possibly in another project) with the same
+                    # converter, prompt and model: reuse its stored Markdown instead of paying the LLM again
+                    markdown_link = _copy_cached_markdown(storage, cached_markdown_link, doc_upload)
+
+                if markdown_link:
+                    markdown_content = read_stored_markdown(storage, markdown_link)
+                    document_record.markdown_s3_link = markdown_link
+                    document_record.conversion_key = conversion_key
+                    doc_upload.stage = STAGE_MARKDOWN_STORED
+                    db.commit()
+                    logger.info(f"Reused cached markdown conversion {cached_markdown_link} for {doc_upload.file_name}.")
                 else:
-                    # Define a specific path for markdown files in local storage
-                    perm_markdown_dir = os.path.join(os.getcwd(), "permanent_storage", "markdowns", f"project_{doc_upload.project_id}", doc_upload.file_hash)
-                    os.makedirs(perm_markdown_dir, exist_ok=True)
-                    perm_markdown_path = os.path.join(perm_markdown_dir, markdown_file_name)
-                    with open(perm_markdown_path, "w", encoding="utf-8") as md_file:
-                        md_file.write(markdown_content)
-                    document_record.markdown_s3_link = perm_markdown_path
-                    logger.info(f"Markdown for document {document_record.id} saved locally: {document_record.markdown_s3_link}")
-                db.commit()
-            
+                    if not os.path.exists(temp_file_path):
+                        # Staged in S3, or resumed after the temp file was cleaned up: convert from the stored original
+                        _restore_temp_file(storage, document_record.file_path, temp_file_path)
+                    with INGESTION_STAGE_SECONDS.labels("convert_markdown").time(), stage_span("ingest.convert_markdown"):
+                        markdown_content = await _convert_to_markdown(
+                            db, doc_upload, document_record, temp_file_path, to_markdown_prompt_str,
+                            conversion_model, conversion_key, storage, refinement_policy
+                        )
+
             logger.info(f"Successfully processed markdown conversion for {doc_upload.file_name} for upload {upload_id}")
             
         except Exception as e:
             db.rollback()  # Rollback any potential partial commit
             logger.error(f"Error during markdown conversion or saving for upload {upload_id}: {e}", exc_info=True)
-            await _update_upload_status(db, upload_id, "error", f"Markdown conversion/saving failed: {e}", document_id=document_record.id)
-            ch.basic_ack(delivery_tag=method.delivery_tag)
-            db.close()
+            await _handle_failure(
+                ch, method, properties, body, db, upload_id, e,
+                f"Markdown conversion/saving failed: {e}", document_id=document_record.id
+            )
             return  # Stop further processing for this message
 
         if not markdown_content.strip():
@@ -309,86 +575,251 @@ async def process_message_callback(ch, method, properties, body, qdrant_service_
             await _update_upload_status(db, upload_id, "completed", "Document converted to empty markdown.", document_id=document_record.id)
         else:
             # 4. Chunk Markdown
-            text_chunks = chunk_markdown(
-                markdown_text=markdown_content,
-                source_document=str(document_record.id) 
-            )
+            with INGESTION_STAGE_SECONDS.labels("chunk").time(), stage_span("ingest.chunk"):
+                text_chunks = chunk_markdown(
+                    markdown_text=markdown_content,
+                    source_document=str(document_record.id),
+                    **(chunking_kwargs or {})
+                )
             logger.info(f"Generated {len(text_chunks)} chunks for document {document_record.id}")
 
             if not text_chunks:
                 logger.warning(f"No text chunks generated for document {document_record.id}.")
                 await _update_upload_status(db, upload_id, "completed", "No chunks generated from markdown.", document_id=document_record.id)
             else:
-                # 5. Save chunks to PostgreSQL
-                saved_chunk_db_ids = save_chunks_to_database(
-                    db=db, chunks=text_chunks, document_id=document_record.id,
-                    project_id=document_record.project_id, file_name=document_record.file_name,
-                    file_hash=document_record.file_hash
-                )
-                logger.info(f"Saved {len(saved_chunk_db_ids)} chunks to database for document {document_record.id}")
-
-                # 6. Generate embeddings and save to Qdrant
-                qdrant_points = []
-                chunk_texts_for_embedding = [chunk['text'] for chunk in text_chunks]
-                if chunk_texts_for_embedding:
-                    embeddings = qdrant_service_instance.get_embeddings(chunk_texts_for_embedding)
-                    
-                    for i, chunk_data in enumerate(text_chunks):
-                        qdrant_point_id = chunk_data["metadata"].get("chunk_id")
-                        if not qdrant_point_id:
-                            logger.error(f"Missing chunk_id in metadata for chunk {i} of document {document_record.id}.")
-                            continue
-                        
-                        payload = {
-                            "text": chunk_data["text"], "document_id": document_record.id,
-                            "project_id": document_record.project_id, "file_name": document_record.file_name,
-                            "chunk_metadata": chunk_data["metadata"], "db_chunk_id": qdrant_point_id
-                        }
-                        qdrant_points.append(qdrant_models.PointStruct(
-                            id=qdrant_point_id, vector=embeddings[i], payload=payload
-                        ))
-                    
-                    if qdrant_points:
-                        qdrant_service_instance.upsert_chunks(points=qdrant_points)
-                        logger.info(f"Upserted {len(qdrant_points)} vectors to Qdrant for document {document_record.id}")
+                # 5. Save chunks to PostgreSQL, 6. generate embeddings and save to Qdrant
+                with INGESTION_STAGE_SECONDS.labels("index").time(), stage_span("ingest.index", **{"ingest.chunks": len(text_chunks)}):
+                    _index_chunks(db, document_record, text_chunks, qdrant_service_instance, doc_upload=doc_upload, storage=storage)
 
+                doc_upload.stage = STAGE_VECTORS_UPSERTED
                 await _update_upload_status(db, upload_id, "completed", document_id=document_record.id)
                 logger.info(f"Successfully completed processing for DocumentUpload {upload_id}, Document {document_record.id}")
 
-        # 7. Clean up temporary file
-        if os.path.exists(temp_file_path):
-            try:
-                os.remove(temp_file_path)
-                logger.info(f"Cleaned up temporary file: {temp_file_path}")
-            except Exception as e:
-                logger.warning(f"Could not remove temporary file {temp_file_path}: {e}")
+        # 7. Clean up the staged upload
+        _remove_staged_upload(storage, doc_upload, temp_file_path)
+        INGESTION_STAGE_SECONDS.labels("total").observe(time.perf_counter() - processing_started)
         
         ch.basic_ack(delivery_tag=method.delivery_tag)
 
     except FileNotFoundError as e:
+        db.rollback() # Discard a half-done stage; its checkpoint was not committed
         logger.error(f"FileNotFoundError in processing for upload {upload_id}: {e}", exc_info=True)
-        if upload_id: await _update_upload_status(db, upload_id, "error", str(e))
-        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False) # Do not requeue on file not found
+        await _handle_failure(ch, method, properties, body, db, upload_id, e, str(e)) # Dead-lettered: not retryable
     except Exception as e:
+        db.rollback()
         logger.error(f"Error processing message for upload {upload_id}: {e}", exc_info=True)
         error_detail = f"Processing pipeline failure: {type(e).__name__} - {str(e)}"
-        if upload_id: await _update_upload_status(db, upload_id, "error", error_detail)
-        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False) # Requeue strategy depends on error type
+        await _handle_failure(ch, method, properties, body, db, upload_id, e, error_detail)
     finally:
         if db:
             db.close()
+        # The message's event loop ends with this coroutine: close the LLM clients opened in it
+        await LLMFactory.close_loop_clients()
+
+def _discard_unindexed_document(
+    db_session: Session, storage: Storage, qdrant_service_instance: QdrantService, document_record: Document
+) -> None:
+    """
+    Removes a bulk-ingested document whose indexing did not finish (its rows, any vectors already
+    upserted and its stored file), so the next bulk run ingests the file again instead of skipping it.
+    """
+    document_id, stored_path = document_record.id, document_record.file_path
+    try:
+        db_session.rollback()
+        db_session.execute(delete(DocumentChunk).where(DocumentChunk.document_id == document_id))
+        db_session.delete(document_record) # Through the session, so its identity map forgets the row too
+        db_session.commit()
+        qdrant_service_instance.delete_document_points(document_id)
+    except Exception as e:
+        db_session.rollback()
+        logger.error(f"Could not discard unindexed document {document_id}: {e}", exc_info=True)
+        return
+    _delete_stored_objects(db_session, storage, [stored_path])
+    logger.info(f"Discarded unindexed document {document_id}; its file will be ingested again by the next run")
+
+def bulk_ingest_markdown_files(
+    file_paths: List[str],
+    project_id: int,
+    user_id: int,
+    max_workers: Optional[int] = None,
+) -> Dict[str, int]:
+    """
+    Bulk-imports Markdown/text files that are already Markdown, bypassing RabbitMQ and LLM conversion.
+
+    Files are read, hashed, deduplicated against the project and stored like regular uploads one at a
+    time, as chunk_markdown_batch's process pool takes them. Chunk lists stream back in file order, so
+    each document is saved, embedded and upserted while later ones are still being chunked. A document
+    whose chunking or indexing fails is removed again, so a later run retries its file.
+    Returns counts of ingested, skipped (already present) and failed files.
+    """
+    app_config = getConfig()
+    qdrant_service_instance = QdrantService(settings=app_config)
+    if not qdrant_service_instance.client or not qdrant_service_instance.embedding_model:
+        raise RuntimeError("Qdrant service or embedding model failed to initialize.")
+    storage = init_storage()
+
+    chunking_kwargs = _build_chunking_kwargs(app_config, qdrant_service_instance)
+    # Workers rebuild the token length function from the tokenizer name; closures cannot be pickled
+    tokenizer_name = app_config.EMBEDDING_MODEL_NAME if chunking_kwargs.pop("length_function", None) else None
+    workers = max_workers or app_config.CHUNKING_MAX_WORKERS or None
+
+    counts = {"ingested": 0, "skipped": 0, "failed": 0}
+    db: Session = SessionLocal()
+    registered: Deque[Document] = deque() # Registered documents whose chunks have not been indexed yet
+
+    def documents_for_chunking() -> Iterator[Tuple[str, str]]:
+        # Each file is read and registered only when the process pool asks for more work,
+        # so at most a few documents per worker are held in memory
+        for file_path in file_paths:
+            try:
+                with open(file_path, "rb") as f:
+                    raw_bytes = f.read()
+                file_hash = hashlib.sha256(raw_bytes).hexdigest()
+                if db.query(Document.id).filter(Document.project_id == project_id, Document.file_hash == file_hash).first():
+                    logger.info(f"Skipping {file_path}: already ingested into project {project_id}.")
+                    counts["skipped"] += 1
+                    continue
+
+                file_name = os.path.basename(file_path)
+                content_type = "text/markdown" if file_name.lower().endswith(".md") else "text/plain"
+                now = datetime.now(UTC)
+                document_record = Document(
+                    file_path=_store_original_file(storage, project_id, file_hash, file_name, content_type, file_path),
+                    file_name=file_name, file_size=len(raw_bytes), content_type=content_type,
+                    file_hash=file_hash, project_id=project_id, uploaded_by=user_id,
+                    created_at=now, updated_at=now
+                )
+                # The source already is the Markdown, so it doubles as the converted copy
+                document_record.markdown_s3_link = document_record.file_path
+                db.add(document_record)
+                db.commit()
+                markdown = raw_bytes.decode("utf-8", errors="replace")
+            except Exception as e:
+                db.rollback()
+                logger.error(f"Failed to register {file_path} for bulk ingest: {e}", exc_info=True)
+                counts["failed"] += 1
+                continue
+            registered.append(document_record)
+            yield markdown, str(document_record.id)
+
+    try:
+        # Chunk in parallel, indexing each document as soon as its chunks arrive (in file order)
+        try:
+            chunk_lists = chunk_markdown_batch(
+                documents_for_chunking(), max_workers=workers, tokenizer_name=tokenizer_name, **chunking_kwargs
+            )
+            for text_chunks in chunk_lists:
+                document_record = registered[0]
+                try:
+                    if text_chunks:
+                        _index_chunks(db, document_record, text_chunks, qdrant_service_instance)
+                    registered.popleft()
+                    counts["ingested"] += 1
+                except Exception as e:
+                    logger.error(f"Failed to index document {document_record.id} ({document_record.file_name}): {e}", exc_info=True)
+                    _discard_unindexed_document(db, storage, qdrant_service_instance, registered.popleft())
+                    counts["failed"] += 1
+        except Exception as e:
+            # The batch cannot go on (e.g. a chunking worker crashed); later files are not attempted
+            logger.error(f"Chunking failed during bulk ingest into project {project_id}: {e}", exc_info=True)
+        # Documents registered but never indexed would be skipped as duplicates by the next run
+        while registered:
+            _discard_unindexed_document(db, storage, qdrant_service_instance, registered.popleft())
+            counts["failed"] += 1
+    finally:
+        db.close()
+
+    logger.info(f"Bulk ingest into project {project_id} finished: {counts}")
+    return counts
+
+def requeue_failed_uploads(
+    upload_ids: Optional[List[int]] = None,
+    project_id: Optional[int] = None,
+    stale_minutes: Optional[int] = None,
+    dry_run: bool = False
+) -> List[int]:
+    """
+    Publishes failed uploads to the document queue again; the consumer resumes each one after its
+    last completed stage. Selects uploads in "error" status (optionally only `upload_ids` or one
+    project) and, with `stale_minutes`, uploads stuck in "processing" that long (consumer killed
+    mid-job). Returns the IDs that were (or, with dry_run, would be) requeued.
+    """
+    app_config = getConfig()
+    db: Session = SessionLocal()
+    requeued: List[int] = []
+    try:
+        query = db.query(DocumentUpload)
+        if upload_ids:
+            query = query.filter(DocumentUpload.id.in_(upload_ids))
+        if project_id is not None:
+            query = query.filter(DocumentUpload.project_id == project_id)
+        status_filter = DocumentUpload.status == "error"
+        if stale_minutes is not None:
+            stale_before = datetime.now(UTC) - timedelta(minutes=stale_minutes)
+            status_filter = or_(status_filter, and_(DocumentUpload.status == "processing", DocumentUpload.updated_at < stale_before))
+        uploads = query.filter(status_filter).order_by(DocumentUpload.id).all()
+
+        if dry_run:
+            for upload in uploads:
+                logger.info(f"Would requeue DocumentUpload {upload.id} ({upload.file_name}), status '{upload.status}', stage '{upload.stage}'")
+            return [upload.id for upload in uploads]
+
+        rabbitmq_service = RabbitMQService()
+        try:
+            for upload in uploads:
+                previous_status, previous_error = upload.status, upload.error_message
+                upload.status = "queued"
+                upload.error_message = None
+                upload.updated_at = datetime.now(UTC)
+                db.commit()
+                if rabbitmq_service.publish_message(
+                    queue_name=app_config.RABBITMQ_DOCUMENT_QUEUE, message={"document_upload_id": upload.id}
+                ):
+                    requeued.append(upload.id)
+                    logger.info(f"Requeued DocumentUpload {upload.id} ({upload.file_name}), resuming after stage '{upload.stage}'")
+                else:
+                    upload.status, upload.error_message = previous_status, previous_error
+                    db.commit()
+                    logger.error(f"Failed to publish DocumentUpload {upload.id}; left in status '{previous_status}'.")
+        finally:
+            rabbitmq_service.close_connection()
+    finally:
+        db.close()
+
+    logger.info(f"Requeued {len(requeued)} of {len(uploads)} uploads.")
+    return requeued
+
+def _sample_queue_depths(channel, queue_names: List[str]) -> None:
+    """Sets QUEUE_DEPTH from passive declares; the queues are all declared by start_consumer beforehand."""
+    for name in queue_names:
+        try:
+            QUEUE_DEPTH.labels(name).set(channel.queue_declare(queue=name, passive=True).method.message_count)
+        except Exception as e:
+            logger.warning(f"Could not sample depth of queue '{name}': {e}")
+
+def _schedule_queue_depth_sampling(connection, channel, queue_names: List[str], interval_seconds: int) -> None:
+    # pika is single-threaded: sample from the connection's own timer rather than from the exporter thread
+    def sample():
+        _sample_queue_depths(channel, queue_names)
+        connection.call_later(interval_seconds, sample)
+    sample()
 
 def start_consumer():
     app_config = getConfig()
+    start_metrics_exporter(app_config.CONSUMER_METRICS_PORT)
+    configure_tracing("rag-document-consumer")
     
     # Initialize services needed by the consumer
     qdrant_service_instance = QdrantService(settings=app_config)
-    s3_client, s3_bucket_name = _create_s3_client_for_consumer(app_config)
+    storage = init_storage()
 
     if not qdrant_service_instance.client or not qdrant_service_instance.embedding_model:
         logger.critical("Qdrant service or embedding model failed to initialize. Consumer cannot start.")
         return
 
+    # Built once so the tokenizer's per-line token-count cache is shared across messages
+    chunking_kwargs = _build_chunking_kwargs(app_config, qdrant_service_instance)
+
     # Initialize RabbitMQService connection
     # The RabbitMQService class itself handles connection and channel setup
     # We need to pass a lambda that captures the initialized services
@@ -399,16 +830,29 @@ def start_consumer():
 
     queue_name = app_config.RABBITMQ_DOCUMENT_QUEUE
     consumer_rabbitmq_service.channel.queue_declare(queue=queue_name, durable=True)
+    declare_retry_topology(consumer_rabbitmq_service.channel, queue_name, app_config)
     
     # Create a partial function or lambda for the callback
-    # This ensures qdrant_service, s3_client, etc. are available in the callback's scope
+    # This ensures qdrant_service, storage, etc. are available in the callback's scope
     # Note: pika's `basic_consume` callback is not async directly.
     # The `process_message_callback` is async, so it needs to be run in an event loop.
     # This part is tricky with pika's blocking nature.
     # A common pattern is to run asyncio.run within the synchronous pika callback.
 
     def sync_callback_wrapper(ch, method, properties, body):
-        asyncio.run(process_message_callback(ch, method, properties, body, qdrant_service_instance, s3_client, s3_bucket_name, app_config))
+        # Continues the trace of the upload request that published the message (kept across retries)
+        trace_context = extract_trace_context(getattr(properties, "headers", None))
+        with stage_span("ingest.document", parent=trace_context, **{"messaging.attempt": message_attempt(properties)}):
+            asyncio.run(process_message_callback(ch, method, properties, body, qdrant_service_instance, storage, app_config, chunking_kwargs))
+
+    if app_config.QUEUE_DEPTH_SAMPLE_SECONDS > 0:
+        monitored_queues = [queue_name, f"{queue_name}.dead"] + [
+            retry_queue_name(queue_name, delay_ms) for delay_ms in sorted(set(retry_delays_ms(app_config)))
+        ]
+        _schedule_queue_depth_sampling(
+            consumer_rabbitmq_service.connection, consumer_rabbitmq_service.channel,
+            monitored_queues, app_config.QUEUE_DEPTH_SAMPLE_SECONDS
+        )
 
     consumer_rabbitmq_service.channel.basic_qos(prefetch_count=1) # Process one message at a time
     consumer_rabbitmq_service.channel.basic_consume(
@@ -428,6 +872,7 @@ def start_consumer():
         if consumer_rabbitmq_service.connection and not consumer_rabbitmq_service.connection.is_closed:
             consumer_rabbitmq_service.connection.close()
         logger.info("RabbitMQ connection closed.")
+        shutdown_tracing()
 
 if __name__ == "__main__":
     # This allows running the consumer directly for testing,
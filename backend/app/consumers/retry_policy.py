@@ -0,0 +1,58 @@
+import json
+
+import botocore.exceptions
+import openai
+from qdrant_client.http.exceptions import ResponseHandlingException
+from sqlalchemy.exc import DBAPIError, OperationalError
+
+
+class PermanentProcessingError(Exception):
+    """Raised for failures that no retry can fix (unreadable file, invalid message)."""
+
+
+# Transient failures of the LLM API (APITimeoutError is an APIConnectionError). The Markdown conversion
+# re-raises them instead of skipping the piece, so the whole message is retried.
+TRANSIENT_LLM_ERRORS = (
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+# Failures that retrying the same message cannot fix
+PERMANENT_ERRORS = (
+    PermanentProcessingError,
+    FileNotFoundError,
+    json.JSONDecodeError,
+    UnicodeDecodeError,
+    ValueError,
+    openai.BadRequestError,
+    openai.AuthenticationError,
+    openai.PermissionDeniedError,
+    openai.NotFoundError,
+)
+
+# Transient failures of the database, object storage, Qdrant or the LLM API
+RETRYABLE_ERRORS = (
+    ConnectionError,
+    TimeoutError,
+    OperationalError,
+    botocore.exceptions.EndpointConnectionError,
+    botocore.exceptions.ConnectionClosedError,
+    botocore.exceptions.ReadTimeoutError,
+    ResponseHandlingException,
+    *TRANSIENT_LLM_ERRORS,
+)
+
+
+def is_retryable_error(exc: BaseException) -> bool:
+    """
+    Whether a failed message is worth another attempt. Known transient errors are retried and known
+    permanent ones are dead-lettered right away; anything else is retried, bounded by the max attempts.
+    """
+    if isinstance(exc, RETRYABLE_ERRORS):
+        return True
+    if isinstance(exc, DBAPIError):
+        return exc.connection_invalidated
+    if isinstance(exc, PERMANENT_ERRORS):
+        return False
+    return True
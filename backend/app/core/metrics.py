@@ -0,0 +1,133 @@
+import logging
+import time
+from typing import Any, Iterable, Optional
+
+from prometheus_client import REGISTRY, Gauge, Histogram, start_http_server
+from prometheus_client.core import CounterMetricFamily
+
+logger = logging.getLogger(__name__)
+
+# Both the API (/metrics) and the consumer (exporter on CONSUMER_METRICS_PORT) record into the default
+# registry of their own process. Metrics a process never touches are simply exported empty.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120, 300)
+INGESTION_BUCKETS = (0.1, 0.5, 1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 131072)
+
+EMBEDDING_SECONDS = Histogram(
+    "rag_embedding_seconds", "Time to embed one batch of texts", buckets=LATENCY_BUCKETS
+)
+EMBEDDING_BATCH_SIZE = Histogram(
+    "rag_embedding_batch_size", "Texts per embedding batch", buckets=BATCH_SIZE_BUCKETS
+)
+QDRANT_SECONDS = Histogram(
+    "rag_qdrant_request_seconds", "Duration of Qdrant requests", ["operation"], buckets=LATENCY_BUCKETS
+)
+# LLM call_type label: "decision" (needs RAG?), "enrichment" (query rewrite), "answer" (streamed chat reply),
+# "markdown" (document conversion in the consumer)
+LLM_TIME_TO_FIRST_TOKEN_SECONDS = Histogram(
+    "rag_llm_time_to_first_token_seconds", "Time from request to the first streamed token (streaming calls only)",
+    ["call_type", "model"], buckets=LLM_BUCKETS
+)
+LLM_DURATION_SECONDS = Histogram(
+    "rag_llm_request_seconds", "Total duration of LLM calls", ["call_type", "model", "outcome"], buckets=LLM_BUCKETS
+)
+LLM_TOKENS = Histogram(
+    "rag_llm_tokens", "Tokens per LLM call as reported by the provider", ["call_type", "model", "kind"], buckets=TOKEN_BUCKETS
+)
+DB_POOL_WAIT_SECONDS = Histogram(
+    "rag_db_pool_wait_seconds", "Time to get a connection from the async engine's pool (includes connecting)",
+    buckets=LATENCY_BUCKETS
+)
+DB_POOL_CONNECTIONS = Gauge(
+    "rag_db_pool_connections", "Connections of the async engine's pool", ["state"]
+)
+INGESTION_STAGE_SECONDS = Histogram(
+    "rag_ingestion_stage_seconds", "Duration of each document ingestion stage", ["stage"], buckets=INGESTION_BUCKETS
+)
+QUEUE_DEPTH = Gauge(
+    "rag_queue_messages", "Messages ready in a RabbitMQ queue, sampled by the consumer", ["queue"]
+)
+
+
+def observe_llm_usage(call_type: str, model: str, usage: Any) -> None:
+    """Records prompt and completion tokens from a usage dict (stream) or an OpenAI usage object."""
+    if not usage:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        count = usage.get(kind) if isinstance(usage, dict) else getattr(usage, kind, None)
+        if count:
+            LLM_TOKENS.labels(call_type, model, kind.removesuffix("_tokens")).observe(count)
+
+
+async def timed_completion(client, call_type: str, **completion_kwargs):
+    """Awaits a non-streaming chat completion, recording its duration, outcome and token usage."""
+    model = completion_kwargs.get("model", "")
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        completion = await client.chat.completions.create(**completion_kwargs)
+        outcome = "ok"
+    finally:
+        LLM_DURATION_SECONDS.labels(call_type, model, outcome).observe(time.perf_counter() - started)
+    observe_llm_usage(call_type, model, getattr(completion, "usage", None))
+    return completion
+
+
+def track_pool(pool) -> None:
+    """Exports the checked-out and idle connection counts of a QueuePool, read at scrape time."""
+    DB_POOL_CONNECTIONS.labels("checked_out").set_function(pool.checkedout)
+    DB_POOL_CONNECTIONS.labels("idle").set_function(pool.checkedin)
+
+
+class CounterCollector:
+    """
+    Exports the process-wide Counter objects the services already keep (rabbitmq.retry_metrics,
+    security.password_metrics) at scrape time, so their call sites stay untouched.
+    """
+
+    def collect(self) -> Iterable:
+        from app.core.security import password_metrics
+        from app.services.rabbitmq import retry_metrics
+
+        retries = CounterMetricFamily("rag_message_retries", "Failed document messages by queue and outcome", labels=["queue", "outcome"])
+        for (queue, outcome), count in sorted(retry_metrics.items()):
+            retries.add_metric([queue, outcome], count)
+        yield retries
+
+        logins = CounterMetricFamily("rag_logins", "Login attempts by outcome", labels=["outcome"])
+        for outcome in ("succeeded", "failed"):
+            logins.add_metric([outcome], password_metrics[f"login_{outcome}"])
+        yield logins
+        yield CounterMetricFamily("rag_password_rehashes", "Password hashes upgraded to the current bcrypt cost at login",
+                                  value=password_metrics["rehashed"])
+
+        for operation in ("hash", "verify"):
+            calls = password_metrics[f"{operation}_calls"]
+            yield CounterMetricFamily(f"rag_password_{operation}", f"bcrypt {operation} calls", value=calls)
+            yield CounterMetricFamily(
+                f"rag_password_{operation}_seconds", f"Total seconds spent in bcrypt {operation}",
+                value=password_metrics[f"{operation}_seconds"]
+            )
+
+
+_counter_collector: Optional[CounterCollector] = None
+
+
+def register_counter_collector() -> None:
+    global _counter_collector
+    if _counter_collector is None:
+        _counter_collector = CounterCollector()
+        REGISTRY.register(_counter_collector)
+
+
+def start_metrics_exporter(port: int) -> bool:
+    """Serves the default registry over HTTP from a daemon thread (consumer and scripts). Port 0 disables it."""
+    if port <= 0:
+        return False
+    register_counter_collector()
+    start_http_server(port)
+    logger.info(f"Prometheus metrics exporter listening on port {port}")
+    return True
@@ -0,0 +1,74 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import TYPE_CHECKING, Callable, Hashable, Optional
+
+if TYPE_CHECKING:
+    from app.services.permission import ScopeSet
+
+
+@dataclass(frozen=True)
+class Principal:
+    """
+    The authenticated user of a request, detached from any DB session so it can be cached and shared.
+    Has the User columns endpoints read (id, email, is_superuser...) plus the token's scopes.
+    """
+    id: int
+    email: str
+    username: str
+    is_active: bool
+    is_superuser: bool
+    created_at: Optional[datetime]
+    updated_at: Optional[datetime]
+    issued_at: int # The token's iat (0 for tokens issued before it was added)
+    # The user's permissions per project, valid while the permission engine's version for the user
+    # is still `permission_version`
+    scopes: Optional["ScopeSet"] = None
+    permission_version: int = 0
+
+
+class PrincipalCache:
+    """Thread-safe LRU of principals with a TTL, keyed by (token subject, token issue time)."""
+
+    def __init__(self, max_size: int = 10000, ttl_seconds: float = 60, clock: Callable[[], float] = time.monotonic):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Principal]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, principal = entry
+            if expires_at <= self.clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return principal
+
+    def put(self, key: Hashable, principal: Principal) -> None:
+        if self.max_size <= 0 or self.ttl_seconds <= 0:
+            return # Cache disabled
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl_seconds, principal)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id: int) -> None:
+        """Drops every cached token of a user (deactivated, permissions changed)."""
+        with self._lock:
+            for key in [key for key, (_, principal) in self._entries.items() if principal.id == user_id]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -1,15 +1,24 @@
+import asyncio
 import bcrypt
+import time
 
 from app.config.config import getConfig
 
-from datetime import datetime, timedelta
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, UTC
+from typing import Iterable
 from jose import jwt, JWTError
 from fastapi import Depends, HTTPException, status, Cookie
 from fastapi.security import OAuth2PasswordBearer # Keep for login endpoint if still used there, or remove if not
+from sqlalchemy import event, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from db.database import get_db_session
+from db.database import get_async_db_session
+from app.core.principal_cache import Principal, PrincipalCache
 from app.models.models import User
+from app.services.permission import ScopeSet, permission_engine
 
 def create_hashed_password(password: str):
     """
@@ -18,7 +27,40 @@ def create_hashed_password(password: str):
     '''
  Postgres as my DDBB and his driver, or the DDBB system, encode always an already encoded string
  '''
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8') # decode the hash to prevent is encoded twice
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=getConfig().BCRYPT_ROUNDS)).decode('utf-8') # decode the hash to prevent is encoded twice
+
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """True if the hash was made with a cost factor other than BCRYPT_ROUNDS ("$2b$<rounds>$...")."""
+    try:
+        return int(hashed_password.split("$")[2]) != getConfig().BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+
+# Process-wide password hashing counters: "login_succeeded", "login_failed", "rehashed", and the calls
+# ("hash_calls", "verify_calls") and seconds spent in the pool, queueing included ("hash_seconds", "verify_seconds")
+password_metrics: Counter = Counter()
+
+# Bounds the CPU spent on bcrypt; extra calls queue here instead of blocking the event loop
+_password_executor = ThreadPoolExecutor(max_workers=getConfig().PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+
+
+async def _run_in_password_pool(kind: str, func, *args):
+    started = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_password_executor, func, *args)
+    finally:
+        password_metrics[f"{kind}_calls"] += 1
+        password_metrics[f"{kind}_seconds"] += time.perf_counter() - started
+
+
+async def hash_password_async(password: str) -> str:
+    return await _run_in_password_pool("hash", create_hashed_password, password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _run_in_password_pool("verify", verifyPassword, plain_password, hashed_password)
 
 
 def createAccessToken(data: dict, expires_delta: int = None):
@@ -30,7 +72,8 @@ def createAccessToken(data: dict, expires_delta: int = None):
         expire = datetime.now() + timedelta(days=expires_delta)
     else:
         expire = datetime.now() + timedelta(days=30)
-    to_encode.update({"exp": expire})
+    # iat keys the principal cache and tells whether the token's scopes predate a permission change
+    to_encode.update({"exp": expire, "iat": int(time.time())})
     encoded_jwt = jwt.encode(to_encode, getConfig().SECRET_KEY, algorithm="HS256")
     return encoded_jwt
 
@@ -45,14 +88,73 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login", auto_error=False
 
 ACCESS_TOKEN_COOKIE_NAME = "access_token"
 
-def get_current_user(
+principal_cache = PrincipalCache(
+    max_size=getConfig().PRINCIPAL_CACHE_MAX_SIZE,
+    ttl_seconds=getConfig().PRINCIPAL_CACHE_TTL_SECONDS
+)
+
+
+def _timestamp(value: datetime) -> float:
+    # DateTime columns are naive UTC
+    return (value if value.tzinfo else value.replace(tzinfo=UTC)).timestamp()
+
+
+async def _build_principal(user: User, payload: dict, db: AsyncSession) -> Principal:
+    issued_at = int(payload.get("iat") or 0)
+    token_scopes = payload.get("scopes")
+    permission_version = permission_engine.version(user.id)
+    # The token's scopes are only as fresh as the token: once the user's permissions changed after it
+    # was issued (invalidate_user_principals bumps updated_at), they are reloaded from the DB instead
+    if token_scopes is not None and issued_at and (user.updated_at is None or issued_at > _timestamp(user.updated_at)):
+        scopes = ScopeSet.from_scopes(token_scopes)
+    else:
+        scopes = await permission_engine.scope_set(db, user.id)
+    return Principal(
+        id=user.id,
+        email=user.email,
+        username=user.username,
+        is_active=user.is_active,
+        is_superuser=user.is_superuser,
+        created_at=user.created_at,
+        updated_at=user.updated_at,
+        issued_at=issued_at,
+        scopes=scopes,
+        permission_version=permission_version,
+    )
+
+
+def invalidate_user_principals(db: Session, user_ids: Iterable[int]):
+    """
+    Call when users are deactivated or their project permissions change, before committing.
+
+    Bumps the users' updated_at, so scopes embedded in tokens issued before now are no longer trusted
+    by any process, and drops their cached principals in this one once the transaction commits (not
+    before, or a concurrent request could cache the old permissions again). Other processes keep
+    serving their cached principal until its TTL (PRINCIPAL_CACHE_TTL_SECONDS) runs out.
+    """
+    user_ids = list(set(user_ids))
+    if not user_ids:
+        return
+    db.execute(update(User).where(User.id.in_(user_ids)).values(updated_at=datetime.now(UTC).replace(tzinfo=None)))
+
+    def drop_cached_principals(session):
+        for user_id in user_ids:
+            principal_cache.invalidate_user(user_id)
+
+    event.listen(db, "after_commit", drop_cached_principals, once=True)
+
+
+async def get_current_user(
     token_from_header: str = Depends(oauth2_scheme),
     access_token_cookie: str = Cookie(None, alias=ACCESS_TOKEN_COOKIE_NAME),
-    db: Session = Depends(get_db_session)
-):
+    db: AsyncSession = Depends(get_async_db_session)
+) -> Principal:
     """
     Verify JWT token and return the current user.
     Checks Authorization header first, then falls back to HTTP cookie.
+
+    The user is looked up once per token and cached for PRINCIPAL_CACHE_TTL_SECONDS, so most
+    requests decode the token without touching the database (the session is never connected).
     
     Args:
         token_from_header: JWT token from Authorization header (optional)
@@ -60,7 +162,7 @@ def get_current_user(
         db: Database session
         
     Returns:
-        User: The authenticated user
+        Principal: The authenticated user, with its project scopes
         
     Raises:
         HTTPException: If token is invalid or user doesn't exist from either source
@@ -90,13 +192,19 @@ def get_current_user(
             
     except JWTError: # Covers expired tokens, invalid signature, etc.
         raise credentials_exception
-        
+
+    cache_key = (email, payload.get("iat") or 0)
+    principal = principal_cache.get(cache_key)
+    if principal is not None:
+        return principal
+
     # Get user from database
-    user = db.query(User).filter(User.email == email).first()
+    user = await db.scalar(select(User).where(User.email == email))
     
     if user is None:
         # User from token not found in DB
         raise credentials_exception
-        
-    return user
 
+    principal = await _build_principal(user, payload, db)
+    principal_cache.put(cache_key, principal)
+    return principal
@@ -0,0 +1,111 @@
+import logging
+import sys
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional
+
+from opentelemetry import propagate, trace
+from opentelemetry.context import Context
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+
+from app.config.config import getConfig
+
+logger = logging.getLogger(__name__)
+
+TRACING_EXPORTERS = ("none", "console", "file")
+
+# Until configure_tracing installs a provider, the API hands out non-recording spans, so the
+# instrumentation costs next to nothing when tracing is off
+tracer = trace.get_tracer("rag")
+
+# Stage durations (ms) of the request being handled, when it asked for them; see collect_stage_timings
+_stage_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("stage_timings", default=None)
+
+
+def configure_tracing(service_name: str, exporter: Optional[str] = None, file_path: Optional[str] = None) -> bool:
+    """
+    Installs a tracer provider exporting finished spans as OpenTelemetry JSON, one span per line, to
+    stdout ("console") or appended to `file_path` ("file"). Returns False when tracing stays off.
+    """
+    config = getConfig()
+    exporter = (exporter or config.TRACING_EXPORTER).lower()
+    if exporter not in TRACING_EXPORTERS:
+        logger.warning(f"Unknown TRACING_EXPORTER '{exporter}'. Tracing disabled.")
+        return False
+    if exporter == "none":
+        return False
+
+    out = sys.stdout if exporter == "console" else open(file_path or config.TRACING_FILE_PATH, "a", buffering=1)
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    provider.add_span_processor(BatchSpanProcessor(
+        ConsoleSpanExporter(out=out, formatter=lambda span: span.to_json(indent=None) + "\n")
+    ))
+    trace.set_tracer_provider(provider)
+    logger.info(f"Tracing {service_name} to {'stdout' if exporter == 'console' else out.name}")
+    return True
+
+
+def shutdown_tracing() -> None:
+    """Flushes spans still buffered by the batch processor."""
+    provider = trace.get_tracer_provider()
+    if isinstance(provider, TracerProvider):
+        provider.shutdown()
+
+
+@contextmanager
+def stage_span(name: str, parent: Optional[Context] = None, **attributes: Any) -> Iterator[trace.Span]:
+    """
+    Span around one pipeline stage, current for its duration (so nested stages become its children).
+    Its duration is also added to the stage timings of the request, if it collects them.
+    Do not yield from an async generator inside it: use start_span for spans that cross yields.
+    """
+    started = time.perf_counter()
+    try:
+        with tracer.start_as_current_span(name, context=parent, attributes=attributes) as span:
+            yield span
+    finally:
+        timings = _stage_timings.get()
+        if timings is not None:
+            timings[name] = round(timings.get(name, 0.0) + (time.perf_counter() - started) * 1000, 1)
+
+
+def start_span(name: str, parent: Optional[Context] = None, start_time: Optional[int] = None, **attributes: Any) -> trace.Span:
+    """Span that is not made current; the caller ends it. For spans enclosing yields of a stream."""
+    return tracer.start_span(name, context=parent, attributes=attributes, start_time=start_time)
+
+
+def record_stage(name: str, milliseconds: float) -> None:
+    """Adds a stage measured without a span (e.g. time to first token) to the request's stage timings."""
+    timings = _stage_timings.get()
+    if timings is not None:
+        timings[name] = round(milliseconds, 1)
+
+
+def collect_stage_timings(timings: Optional[Dict[str, float]]) -> None:
+    """Makes stage_span and record_stage fill `timings` (None stops collecting) in the current context."""
+    _stage_timings.set(timings)
+
+
+def trace_id_hex(span: trace.Span) -> Optional[str]:
+    span_context = span.get_span_context()
+    return trace.format_trace_id(span_context.trace_id) if span_context.is_valid else None
+
+
+def inject_trace_headers(headers: Dict[str, Any], span: Optional[trace.Span] = None) -> Dict[str, Any]:
+    """Adds the W3C traceparent (and tracestate) of `span`, or the current span, to AMQP message headers."""
+    propagate.inject(headers, context=trace.set_span_in_context(span) if span is not None else None)
+    return headers
+
+
+def extract_trace_context(headers: Optional[Dict[str, Any]]) -> Context:
+    """Context of the trace a message was published in, from its headers (empty if it carries none)."""
+    carrier = {}
+    for key, value in (headers or {}).items():
+        if isinstance(value, bytes):
+            value = value.decode("utf-8", "replace")
+        if isinstance(value, str):
+            carrier[key] = value
+    return propagate.extract(carrier)
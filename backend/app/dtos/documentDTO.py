@@ -17,6 +17,7 @@ class DocumentUploadResponse(DocumentUploadBase):
     created_at: datetime
     updated_at: datetime
     error_message: Optional[str] = None
+    stage: Optional[str] = None # Last completed ingestion stage
     document_id: Optional[int] = None # ID of the processed Document record
 
     class Config:
@@ -54,6 +55,7 @@ class ProcessingStatusResponse(BaseModel): # Used for GET /upload/status
     file_name: str
     upload_status: str # Status from DocumentUpload
     upload_error: Optional[str] = None
+    upload_stage: Optional[str] = None # Last completed ingestion stage; a requeued upload resumes after it
     document_id: Optional[int] = None # If processing led to a Document record
 
 
@@ -76,6 +78,14 @@ class DocumentWithStatusResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class DocumentCountResponse(BaseModel): # Used for GET /project/{project_id}/count
+    total: int
+
+
+class DocumentStatusCountResponse(BaseModel): # Used for GET /project/{project_id}/with-status/count
+    total: int
+    by_status: Dict[str, int] # Uploads per processing status
+
 # --- NEW DTO for string upload test ---
 class DocumentUploadStringRequest(BaseModel):
     project_id: int
@@ -1,4 +1,6 @@
-from typing import Optional, Tuple, Any
+import asyncio
+import weakref
+from typing import Dict, Optional, Tuple, Any
 from openai import AsyncOpenAI
 import httpx # Still needed for general HTTP knowledge, though not directly for OpenAI client
 import logging
@@ -10,19 +12,42 @@ logger = logging.getLogger(__name__)
 
 # OllamaClient class is now REMOVED
 
+# Clients by event loop, then provider. A client's connection pool is reused across calls (no new TLS
+# handshake and SSL context per call), but its connections belong to the loop that opened them. Whoever
+# owns a loop closes its clients with close_loop_clients() before the loop finishes: the API at shutdown,
+# the consumer at the end of each message (each message runs in its own asyncio.run loop).
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, Tuple[AsyncOpenAI, str]]]" = weakref.WeakKeyDictionary()
+
 class LLMFactory:
     @staticmethod
     def create_async_client(
         provider: Optional[str] = None,
     ) -> Tuple[AsyncOpenAI, str]: # Now always returns AsyncOpenAI client
         """
-        Create an AsyncOpenAI client instance and model name based on the provider.
+        Returns the AsyncOpenAI client of the running event loop for the provider, and its model name.
         Supports "openai" and "gemini" (via OpenAI SDK compatibility).
         """
         app_config: Config = getConfig()
-        
         provider_to_use = provider or app_config.CHAT_PROVIDER
+        try:
+            loop_clients = _clients.setdefault(asyncio.get_running_loop(), {})
+        except RuntimeError: # Not called from a coroutine: nothing to share the client with
+            return LLMFactory._new_client(app_config, provider_to_use)
+        if provider_to_use not in loop_clients:
+            loop_clients[provider_to_use] = LLMFactory._new_client(app_config, provider_to_use)
+        return loop_clients[provider_to_use]
 
+    @staticmethod
+    async def close_loop_clients() -> None:
+        """
+        Closes the clients created in the running event loop, releasing their connections.
+        A later create_async_client call in the loop opens new ones.
+        """
+        for client, _ in _clients.pop(asyncio.get_running_loop(), {}).values():
+            await client.close()
+
+    @staticmethod
+    def _new_client(app_config: Config, provider_to_use: str) -> Tuple[AsyncOpenAI, str]:
         if provider_to_use == "openai":
             if not app_config.OPENAI_API_KEY:
                 raise ValueError("OPENAI_API_KEY not configured for CHAT_PROVIDER 'openai'.")
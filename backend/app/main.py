@@ -1,14 +1,22 @@
-from fastapi import APIRouter, FastAPI
+from fastapi import APIRouter, FastAPI, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 import sqlalchemy
 from app.core.api_reponse import api_response
 from app.core.exception_handler import register_error_handlers
 from app.api.api import main_router
+from app.core.metrics import register_counter_collector
+from app.core.tracing import configure_tracing, shutdown_tracing
+from app.llm_providers.llm_factory import LLMFactory
+from app.services.storage import init_storage
+from app.services.upload_events import upload_status_broadcaster
+from db.database import async_engine
 from fastapi.middleware.cors import CORSMiddleware
 
 app = FastAPI()
 db = sqlalchemy
 
 register_error_handlers(app)
+register_counter_collector()
 
 # Add CORS middleware
 app.add_middleware(
@@ -17,10 +25,29 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"], # Pagination cursor of the document listings
 )
 
 app.include_router(main_router, prefix="/api")
 
+@app.on_event("startup")
+def check_storage():
+    # Bucket check once per process instead of on every request
+    init_storage()
+    configure_tracing("rag-api")
+
+@app.on_event("shutdown")
+async def close_database_pool():
+    await upload_status_broadcaster.close()
+    await LLMFactory.close_loop_clients()
+    await async_engine.dispose()
+    shutdown_tracing()
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    # Per process: with several workers each one is scraped separately
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 @app.get("/api/health")
 async def health_check():
     return {
@@ -1,6 +1,7 @@
 from sqlalchemy import (
-    Column, Integer, String, Boolean, DateTime, ForeignKey, Text, BigInteger, JSON
+    Column, Integer, String, Boolean, DateTime, ForeignKey, Text, BigInteger, JSON, Index
 )
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship, declarative_base
 from datetime import UTC, datetime
 
@@ -58,6 +59,9 @@ class ApiKey(Base):
 # Chats Table
 class Chat(Base):
     __tablename__ = "chats"
+    __table_args__ = (
+        Index("ix_chats_user_id_updated_at", "user_id", "updated_at"), # A user's chats, most recent first
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     title = Column(String(255), nullable=False)
@@ -72,6 +76,9 @@ class Chat(Base):
 # Messages Table
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        Index("ix_messages_chat_id_created_at", "chat_id", "created_at"), # A chat's history, in order
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     chat_id = Column(Integer, ForeignKey("chats.id"), nullable=False)
@@ -85,6 +92,9 @@ class Message(Base):
 # Chat-Project Association Table
 class ChatProject(Base):
     __tablename__ = "chat_project"
+    __table_args__ = (
+        Index("ix_chat_project_project_id", "project_id"), # chat_id lookups use the primary key
+    )
 
     chat_id = Column(Integer, ForeignKey("chats.id"), primary_key=True)
     project_id = Column(Integer, ForeignKey("projects.id"), primary_key=True)
@@ -95,6 +105,12 @@ class ChatProject(Base):
 # Document Uploads Table
 class DocumentUpload(Base):
     __tablename__ = "document_uploads"
+    __table_args__ = (
+        # Keyset pages of the with-status listing, per sort column (the project_id prefix serves plain lookups too)
+        Index("ix_document_uploads_project_id_created_at", "project_id", "created_at", "id"),
+        Index("ix_document_uploads_project_id_file_name", "project_id", "file_name", "id"),
+        Index("ix_document_uploads_project_id_file_size", "project_id", "file_size", "id"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     project_id = Column(Integer, ForeignKey("projects.id"), nullable=False)
@@ -106,9 +122,12 @@ class DocumentUpload(Base):
     created_at = Column(DateTime, default=datetime.now(UTC))
     updated_at = Column(DateTime, default=datetime.now(UTC), onupdate=datetime.now(UTC)) # For consumer updates
     status = Column(String(50), default="pending") # e.g., pending, queued, processing, completed, error
+    stage = Column(String(50), nullable=True) # Last completed ingestion stage, see document_consumer.INGESTION_STAGES
     error_message = Column(Text, nullable=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     document_id = Column(Integer, ForeignKey("documents.id"), nullable=True) # Link to the processed Document
+    # Document this upload is a new version of; no foreign key, the replaced row is deleted once superseded
+    replaces_document_id = Column(Integer, nullable=True)
 
     project = relationship("Project", back_populates="document_uploads")
     user = relationship("User", back_populates="document_uploads")
@@ -117,15 +136,22 @@ class DocumentUpload(Base):
 # Documents Table
 class Document(Base):
     __tablename__ = "documents"
+    __table_args__ = (
+        Index("ix_documents_project_id_file_hash", "project_id", "file_hash"), # Duplicate checks
+        Index("ix_documents_project_id_created_at", "project_id", "created_at", "id"), # Keyset pages of project listings
+        Index("ix_documents_project_id_file_name", "project_id", "file_name", "id"),
+        Index("ix_documents_project_id_file_size", "project_id", "file_size", "id"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     file_path = Column(String(255), nullable=False) # Permanent storage path (S3 or local)
     file_name = Column(String(255), nullable=False)
-    file_size = Column(Integer)
+    file_size = Column(Integer, nullable=False)
     content_type = Column(String(100))
     file_hash = Column(String(64))
     project_id = Column(Integer, ForeignKey("projects.id"), nullable=False)
     markdown_s3_link = Column(String(255), nullable=True) # Link to the extracted markdown text (S3 or local path)
+    conversion_key = Column(String(64), nullable=True) # Cache key of a complete LLM conversion, see markdown_conversion
     created_at = Column(DateTime, default=datetime.now(UTC)) # When document record (post-processing) is created
     updated_at = Column(DateTime, default=datetime.now(UTC), onupdate=datetime.now(UTC))
     uploaded_by = Column(Integer, ForeignKey("users.id"), nullable=False) # User who initiated the upload
@@ -138,19 +164,36 @@ class Document(Base):
 # Document Chunks Table
 class DocumentChunk(Base):
     __tablename__ = "document_chunks"
+    __table_args__ = (
+        Index("ix_document_chunks_document_id", "document_id"),
+        Index(
+            "ix_document_chunks_chunk_metadata", "chunk_metadata",
+            postgresql_using="gin", postgresql_ops={"chunk_metadata": "jsonb_path_ops"}
+        ), # Containment (@>) queries on chunk metadata
+    )
 
     id = Column(String(64), primary_key=True)
     project_id = Column(Integer, ForeignKey("projects.id"), nullable=False)
     file_name = Column(String(255), nullable=False) # Original file name for context
     hash = Column(String(64), nullable=False) # Hash of the original file
+    content_hash = Column(String(64), nullable=True) # Hash of the chunk's text and headers, for incremental re-ingestion
     created_at = Column(DateTime, default=datetime.now(UTC))
     updated_at = Column(DateTime, default=datetime.now(UTC), onupdate=datetime.now(UTC))
     document_id = Column(Integer, ForeignKey("documents.id"), nullable=False)
-    chunk_metadata = Column(JSON) # Includes text, original chunk metadata, etc.
+    chunk_metadata = Column(JSON().with_variant(JSONB(), "postgresql")) # Includes text, original chunk metadata, etc.
 
     project = relationship("Project", back_populates="document_chunks")
     document = relationship("Document", back_populates="document_chunks")
 
+# Cached LLM Markdown conversions of individual source pieces, shared across projects
+class MarkdownPieceCache(Base):
+    __tablename__ = "markdown_piece_cache"
+
+    piece_key = Column(String(64), primary_key=True) # Hash of the piece text, prompt, model and converter version
+    markdown = Column(Text, nullable=False)
+    model = Column(String(255), nullable=False)
+    created_at = Column(DateTime, default=datetime.now(UTC))
+
 # Permissions Table
 class Permission(Base):
     __tablename__ = "permissions"
@@ -165,6 +208,9 @@ class Permission(Base):
 # Project Permissions Table
 class ProjectPermission(Base):
     __tablename__ = "project_permissions"
+    __table_args__ = (
+        Index("ix_project_permissions_user_id_project_id", "user_id", "project_id"), # A user's scopes
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     project_id = Column(Integer, ForeignKey("projects.id"), nullable=False)
@@ -1,40 +1,45 @@
+import asyncio
 import logging
 from typing import List, Optional, Tuple, Dict, Any, AsyncIterator, Union
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import Depends, HTTPException, status
 import json # Added
 import base64 # Added
+import time
+from opentelemetry import trace
+from opentelemetry.context import Context
 
 from app.models.models import Chat, Message, User, Project, ChatProject
 from app.dtos.chatDTO import ChatCreate, ChatResponse
 from app.dtos.messageDTO import MessageCreate, MessageResponse
-from db.database import get_db_session
+from db.database import get_async_db_session
 from app.services.llm_service import LLMService, get_llm_service
 from app.services.qdrant_service import QdrantService, get_qdrant_service
 from app.llm_providers.prompt_factory import ChatPromptFactory
+from app.config.config import getConfig
+from app.core.tracing import collect_stage_timings, stage_span, start_span, trace_id_hex
 from datetime import datetime, UTC
-from sqlalchemy import desc
+from sqlalchemy import desc, select, update
 
 logger = logging.getLogger(__name__)
 
 class ChatService:
     def __init__(self,
-                    db: Session = Depends(get_db_session),
+                    db: AsyncSession = Depends(get_async_db_session),
                     llm_service: LLMService = Depends(get_llm_service),
                     qdrant_service: QdrantService = Depends(get_qdrant_service)):
         self.db = db
         self.llm_service = llm_service
         self.qdrant_service = qdrant_service
 
-    def get_chats_for_user(self, user_id: int) -> List[ChatResponse]:
+    async def get_chats_for_user(self, user_id: int) -> List[ChatResponse]:
         # Join Chat with ChatProject in a single query and order by updated_at
-        chat_with_projects = (
-            self.db.query(Chat, ChatProject.project_id)
+        chat_with_projects = (await self.db.execute(
+            select(Chat, ChatProject.project_id)
             .join(ChatProject, Chat.id == ChatProject.chat_id)
-            .filter(Chat.user_id == user_id)
+            .where(Chat.user_id == user_id)
             .order_by(desc(Chat.updated_at))
-            .all()
-        )
+        )).all()
         
         # Get all chat IDs to fetch messages in bulk
         chat_ids = [chat.id for chat, _ in chat_with_projects]
@@ -43,12 +48,11 @@ class ChatService:
         # Group messages by chat_id for easier access
         all_messages = {}
         if chat_ids:
-            messages_query = (
-                self.db.query(Message)
-                .filter(Message.chat_id.in_(chat_ids))
+            messages_query = (await self.db.scalars(
+                select(Message)
+                .where(Message.chat_id.in_(chat_ids))
                 .order_by(Message.created_at.asc())
-                .all()
-            )
+            )).all()
             
             # Group messages by chat_id
             for message in messages_query:
@@ -79,32 +83,31 @@ class ChatService:
             )
         return response_chats
 
-    def create_chat_session(self, user_id: int, chat_create_dto: ChatCreate) -> ChatResponse:
-        project = self.db.query(Project).filter(Project.id == chat_create_dto.project_id).first()
+    async def create_chat_session(self, user_id: int, chat_create_dto: ChatCreate) -> ChatResponse:
+        project = await self.db.get(Project, chat_create_dto.project_id)
         if not project:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Project with ID {chat_create_dto.project_id} not found.")
         now = datetime.now(UTC)
         new_chat = Chat(title=chat_create_dto.title, user_id=user_id, created_at=now, updated_at=now)
         self.db.add(new_chat)
-        self.db.commit()
-        self.db.refresh(new_chat)
+        await self.db.flush() # Assigns new_chat.id
         chat_project_link = ChatProject(chat_id=new_chat.id, project_id=chat_create_dto.project_id)
         self.db.add(chat_project_link)
-        self.db.commit()
+        await self.db.commit()
         return ChatResponse(
             id=new_chat.id, title=new_chat.title, user_id=new_chat.user_id,
             project_id=chat_create_dto.project_id, created_at=new_chat.created_at,
             updated_at=new_chat.updated_at, messages=[]
         )
 
-    def get_chat_by_id(self, chat_id: int, user_id: int) -> Optional[ChatResponse]:
+    async def get_chat_by_id(self, chat_id: int, user_id: int) -> Optional[ChatResponse]:
         # Use a join to get chat and project_id in a single query
-        chat_with_project = (
-            self.db.query(Chat, ChatProject.project_id)
+        chat_with_project = (await self.db.execute(
+            select(Chat, ChatProject.project_id)
             .join(ChatProject, Chat.id == ChatProject.chat_id, isouter=True)
-            .filter(Chat.id == chat_id, Chat.user_id == user_id)
-            .first()
-        )
+            .where(Chat.id == chat_id, Chat.user_id == user_id)
+            .limit(1)
+        )).first()
         
         if not chat_with_project:
             return None
@@ -115,12 +118,11 @@ class ChatService:
             logger.error(f"Critical: Chat {chat_id} exists but has no project link.")
             
         # Get messages in a separate query
-        messages_db = (
-            self.db.query(Message)
-            .filter(Message.chat_id == chat_id)
+        messages_db = (await self.db.scalars(
+            select(Message)
+            .where(Message.chat_id == chat_id)
             .order_by(Message.created_at.asc())
-            .all()
-        )
+        )).all()
         
         return ChatResponse(
             id=chat_db.id,
@@ -132,26 +134,24 @@ class ChatService:
             messages=[MessageResponse.model_validate(msg) for msg in messages_db]
         )
 
-    def _save_message_to_db(self, chat_id: int, role: str, content: str) -> Message:
+    async def _save_message_to_db(self, chat_id: int, role: str, content: str) -> Message:
         now = datetime.now(UTC)
         message_db = Message(
             chat_id=chat_id, role=role, content=content,
             created_at=now, updated_at=now
         )
         self.db.add(message_db)
-        chat_db_to_update = self.db.query(Chat).filter(Chat.id == chat_id).first()
-        if chat_db_to_update:
-            chat_db_to_update.updated_at = now
-        self.db.commit()
-        self.db.refresh(message_db)
+        await self.db.execute(update(Chat).where(Chat.id == chat_id).values(updated_at=now))
+        await self.db.commit()
+        await self.db.refresh(message_db)
         return message_db
 
     async def save_user_message(self, chat_id: int, user_id: int, message_create_dto: MessageCreate) -> MessageResponse:
-        chat = self.get_chat_by_id(chat_id=chat_id, user_id=user_id)
+        chat = await self.get_chat_by_id(chat_id=chat_id, user_id=user_id)
         if not chat:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chat session not found or access denied.")
         
-        user_message_db = self._save_message_to_db(chat_id, "user", message_create_dto.content)
+        user_message_db = await self._save_message_to_db(chat_id, "user", message_create_dto.content)
         return MessageResponse.model_validate(user_message_db)
 
     async def process_and_stream_assistant_response(
@@ -163,8 +163,30 @@ class ChatService:
         """
         Processes the user's question, decides on RAG, calls LLM stream,
         saves the full assistant response, and yields deltas, citation payload, and final saved DTO.
+        Traced as one chat.respond span; with TRACING_STAGE_TIMINGS a last stage_timings dict
+        gives the duration (ms) of each stage.
         """
-        chat = self.get_chat_by_id(chat_id=chat_id, user_id=user_id)
+        timings: Optional[Dict[str, float]] = {} if getConfig().TRACING_STAGE_TIMINGS else None
+        collect_stage_timings(timings)
+        request_span = start_span("chat.respond", **{"chat.id": chat_id})
+        started = time.perf_counter()
+        try:
+            async for item in self._respond(chat_id, user_id, user_question, trace.set_span_in_context(request_span)):
+                yield item
+        finally:
+            request_span.end()
+            collect_stage_timings(None)
+        if timings is not None:
+            timings["chat.respond"] = round((time.perf_counter() - started) * 1000, 1)
+            yield {"type": "stage_timings", "data": timings, "trace_id": trace_id_hex(request_span)}
+
+    async def _respond(
+        self, chat_id: int, user_id: int, user_question: str, trace_context: Context
+    ) -> AsyncIterator[Union[str, MessageResponse, Dict[str, Any]]]:
+        with stage_span("chat.load_history", parent=trace_context):
+            chat = await self.get_chat_by_id(chat_id=chat_id, user_id=user_id)
+            # Nothing else is read until the answer is saved: do not hold a pooled connection through the LLM calls
+            await self.db.close()
         if not chat:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Chat session not found (unexpected).")
         if chat.project_id is None:
@@ -172,7 +194,8 @@ class ChatService:
 
         history_for_llm = [{"role": msg.role, "content": msg.content} for msg in chat.messages]
         rag_decision_history = history_for_llm[:-1] if history_for_llm and history_for_llm[-1]["role"] == "user" else history_for_llm
-        rag_decision = await self.llm_service.decide_rag_necessity(rag_decision_history, user_question)
+        with stage_span("chat.rag_decision", parent=trace_context):
+            rag_decision = await self.llm_service.decide_rag_necessity(rag_decision_history, user_question)
 
         full_assistant_content_parts = []
         final_llm_data = None
@@ -185,7 +208,8 @@ class ChatService:
             logger.info(f"Chat {chat_id}: RAG needed. Reason: {rag_decision.get('reason', 'N/A')}")
             try:
                 # Enrich the query for better vector search
-                enriched_query = await self.llm_service.enrich_query_for_rag(rag_decision_history, user_question)
+                with stage_span("chat.query_enrichment", parent=trace_context):
+                    enriched_query = await self.llm_service.enrich_query_for_rag(rag_decision_history, user_question)
                 search_query = enriched_query if enriched_query else user_question
                 
                 if enriched_query:
@@ -193,9 +217,12 @@ class ChatService:
                 else:
                     logger.info(f"Chat {chat_id}: Query enrichment failed, using original query")
                 
-                retrieved_qdrant_hits = self.qdrant_service.search_chunks(
-                    query_text=search_query, project_id=chat.project_id, limit=7 # Limit to 3 contexts for now
-                )
+                with stage_span("chat.retrieval", parent=trace_context, **{"chat.project_id": chat.project_id}):
+                    # Embedding and the Qdrant request block, so they run in a worker thread
+                    retrieved_qdrant_hits = await asyncio.to_thread(
+                        self.qdrant_service.search_chunks,
+                        query_text=search_query, project_id=chat.project_id, limit=7 # Limit to 3 contexts for now
+                    )
                 if retrieved_qdrant_hits:
                     for i, hit in enumerate(retrieved_qdrant_hits):
                         payload = hit.payload or {}
@@ -208,7 +235,8 @@ class ChatService:
                                 "project_id": payload.get("project_id"),
                                 "file_name": payload.get("file_name"),
                                 "chunk_id": payload.get("chunk_metadata", {}).get("chunk_id"),
-                                "headers": payload.get("chunk_metadata", {}).get("headers")
+                                "headers": payload.get("chunk_metadata", {}).get("headers"),
+                                "pages": payload.get("chunk_metadata", {}).get("pages") # Source pages, for PDFs converted page by page
                                 # Add other metadata from payload.chunk_metadata if needed by frontend
                             }
                         }
@@ -252,7 +280,7 @@ class ChatService:
 
         messages_for_llm_stream = [{"role": "user", "content": prompt_for_llm_generation}]
 
-        async for item in self.llm_service.get_chat_completion_stream(messages=messages_for_llm_stream):
+        async for item in self.llm_service.get_chat_completion_stream(messages=messages_for_llm_stream, trace_context=trace_context):
             if isinstance(item, str):
                 full_assistant_content_parts.append(item)
                 yield item  # Yield text delta
@@ -279,11 +307,12 @@ class ChatService:
             else:
                 final_assistant_content = "Sorry, I could not generate a response for your query."
         
-        assistant_message_db = self._save_message_to_db(chat_id, "assistant", final_assistant_content)
+        with stage_span("chat.save_message", parent=trace_context):
+            assistant_message_db = await self._save_message_to_db(chat_id, "assistant", final_assistant_content)
         yield MessageResponse.model_validate(assistant_message_db)
 
 def get_chat_service(
-    db: Session = Depends(get_db_session),
+    db: AsyncSession = Depends(get_async_db_session),
     llm_service: LLMService = Depends(get_llm_service),
     qdrant_service: QdrantService = Depends(get_qdrant_service)
 ) -> ChatService:
@@ -1,88 +1,308 @@
+import os
 import re
 import uuid
 import hashlib
-from typing import List, Dict, Optional, Tuple
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from itertools import accumulate
+from typing import Any, Callable, List, Dict, Iterable, Iterator, Match, Optional, Pattern, Sequence, Tuple
+from datetime import UTC, datetime
+from sqlalchemy import delete, insert, update
 from sqlalchemy.orm import Session
-from app.models.models import DocumentChunk, Document
+from app.models.models import DocumentChunk, Document, DocumentUpload
 
-def _split_text_recursive(
-    text: str, max_chunk_size: int, separators: List[str], chunk_overlap: int = 50
-) -> List[str]:
+# Measures the "size" of a piece of text. `len` measures characters;
+# `make_token_length_function` builds one that counts embedding-model tokens.
+LengthFunction = Callable[[str], int]
+# Character length an atomic match counts for, e.g. the length of the code block a placeholder stands for
+AtomicLength = Callable[[Match[str]], int]
+
+
+def make_token_length_function(tokenizer: Any, cache_size: int = 65536) -> LengthFunction:
     """
-    Recursively splits text trying different separators.
-    Starts with the coarsest separator, then finer ones if chunks are still too large.
-    Applies a final character-level split if needed.
+    Builds a length function that counts tokens with the embedding model's tokenizer.
+
+    Token counts are cached per line: the splitter measures the same lines many
+    times while it grows and re-splits chunks, so each distinct line is only
+    tokenized once. A text's length is the sum of its lines' token counts, which
+    matches whitespace-pretokenizing tokenizers (WordPiece, SentencePiece) since
+    a newline never merges tokens across lines.
     """
-    final_chunks = []
-    # Start with the full text
-    remaining_text = text.strip()
-    if not remaining_text:
-        return []
+    @lru_cache(maxsize=cache_size)
+    def _line_token_count(line: str) -> int:
+        if not line:
+            return 0
+        return len(tokenizer.encode(line, add_special_tokens=False))
 
-    # Base case: If the text is already small enough
-    if len(remaining_text) <= max_chunk_size:
-        return [remaining_text]
+    def _token_length(text: str) -> int:
+        return sum(_line_token_count(line) for line in text.split("\n"))
 
-    current_separator = separators[0] if separators else ""
+    return _token_length
+
+
+def _tail_within(text: str, limit: int, length_function: LengthFunction = len) -> str:
+    """
+    Returns the longest suffix of `text` whose length is at most `limit`.
+    For token lengths the suffix starts on a word boundary so no token is cut in half.
+    Each word is measured once and the counts are summed, which equals the suffix's own
+    count for whitespace-pretokenizing tokenizers (see make_token_length_function).
+    """
+    if limit <= 0 or not text:
+        return ""
+    if length_function is len:
+        return text[-limit:]
+
+    words = text.split(" ")
+    tail_length = 0
+    first_word = len(words)
+    while first_word > 0:
+        tail_length += length_function(words[first_word - 1])
+        if tail_length > limit:
+            break
+        first_word -= 1
+    return " ".join(words[first_word:])
 
-    # Try splitting with the current separator
-    if current_separator:
-        split_using_separator = remaining_text.split(current_separator)
+
+# A chunk produced by the splitter: `prefix + base[start:end]`. `prefix` is the
+# overlap carried over from the previous chunk (at most `chunk_overlap` long),
+# so building a chunk never copies more than the overlap until it is emitted.
+_Span = Tuple[str, str, int, int]
+
+
+def _span_text(span: _Span) -> str:
+    prefix, base, start, end = span
+    return prefix + base[start:end]
+
+
+def _strip_bounds(base: str, start: int, end: int) -> Tuple[int, int]:
+    """Same bounds as `base[start:end].strip()`, without copying the range."""
+    while start < end and base[start].isspace():
+        start += 1
+    while end > start and base[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+def _separator_bounds(
+    base: str, start: int, end: int, separator: str, atomic_pattern: Optional[Pattern[str]] = None
+) -> Sequence[int]:
+    """
+    End offsets of the pieces `base[start:end]` splits into, where every piece but
+    the first starts with its separator (the pieces tile the range exactly).
+    An empty separator yields one piece per character.
+    Matches of `atomic_pattern` are never cut: boundaries inside a match are dropped.
+    """
+    if not separator:
+        bounds: Sequence[int] = range(start + 1, end + 1)
     else:
-        # If no separators left, split by character
-        split_using_separator = list(remaining_text) # Effectively character split prep
-
-    current_chunk = ""
-    for i, part in enumerate(split_using_separator):
-        # Add separator back if it wasn't the final character split
-        part_to_add = part
-        if current_separator and i > 0:
-             part_to_add = current_separator + part
-
-        # If adding the next part doesn't exceed the max size
-        if not current_chunk or len(current_chunk) + len(part_to_add) <= max_chunk_size:
-            current_chunk += part_to_add
+        # str.split runs in C; only the piece lengths are kept
+        piece_lengths = [len(piece) + len(separator) for piece in base[start:end].split(separator)]
+        piece_lengths[0] -= len(separator)
+        bounds = list(accumulate(piece_lengths, initial=start))[1:]
+
+    atomic_ranges = [match.span() for match in atomic_pattern.finditer(base, start, end)] if atomic_pattern else []
+    if not atomic_ranges:
+        return bounds
+    atomic_starts = [range_start for range_start, _ in atomic_ranges]
+
+    def outside_atomic(offset: int) -> bool:
+        index = bisect_right(atomic_starts, offset - 1) - 1
+        return index < 0 or offset >= atomic_ranges[index][1]
+
+    return [offset for offset in bounds if outside_atomic(offset)]
+
+
+def _atomic_extra_length(
+    base: str, start: int, end: int, atomic_pattern: Optional[Pattern[str]], atomic_length: Optional[AtomicLength]
+) -> Optional[Callable[[int, int], int]]:
+    """
+    For character lengths: how many characters a range of `base[start:end]` gains when its atomic
+    matches count as `atomic_length(match)` instead of their own length. Splitting never cuts a
+    match, so a match is inside a range exactly when it starts there. None if there is nothing to add.
+    """
+    if atomic_pattern is None or atomic_length is None:
+        return None
+    match_starts: List[int] = []
+    extra = [0]
+    for match in atomic_pattern.finditer(base, start, end):
+        match_starts.append(match.start())
+        extra.append(extra[-1] + atomic_length(match) - (match.end() - match.start()))
+    if not match_starts:
+        return None
+
+    def extra_length(range_start: int, range_end: int) -> int:
+        return extra[bisect_left(match_starts, range_end)] - extra[bisect_left(match_starts, range_start)]
+
+    return extra_length
+
+
+def _split_range(
+    base: str,
+    start: int,
+    end: int,
+    max_chunk_size: int,
+    separators: List[str],
+    chunk_overlap: int,
+    length_function: LengthFunction,
+    atomic_pattern: Optional[Pattern[str]] = None,
+    atomic_length: Optional[AtomicLength] = None,
+) -> List[_Span]:
+    """
+    Offset-based core of `_split_text_recursive`: works on `base[start:end]` and
+    returns spans into `base` instead of building strings piece by piece.
+    """
+    extra_length = _atomic_extra_length(base, start, end, atomic_pattern, atomic_length) if length_function is len else None
+    if extra_length is not None:
+        def measure(prefix: str, chunk_start: int, chunk_end: int) -> int:
+            return len(prefix) + chunk_end - chunk_start + extra_length(chunk_start, chunk_end)
+    elif length_function is len:
+        def measure(prefix: str, chunk_start: int, chunk_end: int) -> int:
+            return len(prefix) + chunk_end - chunk_start
+    else:
+        def measure(prefix: str, chunk_start: int, chunk_end: int) -> int:
+            return length_function(prefix + base[chunk_start:chunk_end])
+
+    start, end = _strip_bounds(base, start, end)
+    if start == end:
+        return []
+    if measure("", start, end) <= max_chunk_size:
+        return [("", base, start, end)]
+    if atomic_pattern is not None and atomic_pattern.fullmatch(base, start, end):
+        # An atomic unit (e.g. a code block) is kept whole even when it is larger than a chunk
+        return [("", base, start, end)]
+
+    current_separator = separators[0] if separators else ""
+    finer_separators = separators[1:]
+    bounds = _separator_bounds(base, start, end, current_separator, atomic_pattern)
+
+    def recurse(span: _Span) -> List[_Span]:
+        prefix, _, span_start, span_end = span
+        if prefix:
+            # Only reachable with a non-monotonic length function; split the joined text instead.
+            joined = _span_text(span)
+            return _split_range(
+                joined, 0, len(joined), max_chunk_size, finer_separators, chunk_overlap, length_function,
+                atomic_pattern, atomic_length
+            )
+        return _split_range(
+            base, span_start, span_end, max_chunk_size, finer_separators, chunk_overlap, length_function,
+            atomic_pattern, atomic_length
+        )
+
+    def overlap_of(span: _Span) -> str:
+        if chunk_overlap <= 0:
+            return ""
+        prefix, span_base, span_start, span_end = span
+        if length_function is len and span_end - span_start >= chunk_overlap:
+            overlap = span_base[span_end - chunk_overlap:span_end]
         else:
-            # Chunk is full. Need to process this chunk.
-            # If the chunk itself is too large even after splitting by the current separator
-            if len(current_chunk) > max_chunk_size:
-                # Recurse with finer separators
-                finer_separators = separators[1:]
-                recursive_chunks = _split_text_recursive(
-                    current_chunk, max_chunk_size, finer_separators, chunk_overlap
-                )
-                final_chunks.extend(recursive_chunks)
+            overlap = _tail_within(_span_text(span), chunk_overlap, length_function)
+        if atomic_pattern is not None and overlap:
+            # Never carry an atomic unit (or a cut piece of one) into the next chunk
+            chunk_text = _span_text(span)
+            overlap_start = len(chunk_text) - len(overlap)
+            for match in atomic_pattern.finditer(chunk_text):
+                if match.end() > overlap_start:
+                    overlap = chunk_text[match.end():]
+        return overlap
+
+    def furthest_fit(prefix: str, chunk_start: int, first: int) -> int:
+        """
+        Largest piece index j >= first such that the chunk extended through piece j
+        still fits, or first - 1 if piece `first` does not fit. Gallops, then
+        bisects, so a chunk costs O(log pieces) measurements instead of one per piece.
+        """
+        if measure(prefix, chunk_start, bounds[first]) > max_chunk_size:
+            return first - 1
+        fits, step = first, 1
+        while fits + step < len(bounds) and measure(prefix, chunk_start, bounds[fits + step]) <= max_chunk_size:
+            fits += step
+            step *= 2
+        too_far = min(fits + step, len(bounds))
+        while too_far - fits > 1:
+            middle = (fits + too_far) // 2
+            if measure(prefix, chunk_start, bounds[middle]) <= max_chunk_size:
+                fits = middle
             else:
-                 # Chunk is within size limits
-                 final_chunks.append(current_chunk)
-
-            # Start a new chunk with the current part, adding overlap from the previous chunk
-            overlap = final_chunks[-1][-chunk_overlap:] if final_chunks and chunk_overlap > 0 else ""
-            current_chunk = overlap + part_to_add
-
-            # Check if the new chunk (with overlap) is already too large
-            if len(current_chunk) > max_chunk_size:
-                 # If the part itself is too large, recurse on it directly
-                 finer_separators = separators[1:]
-                 recursive_chunks = _split_text_recursive(
-                    part_to_add, max_chunk_size, finer_separators, chunk_overlap
-                 )
-                 final_chunks.extend(recursive_chunks)
-                 current_chunk = "" # Reset chunk as it was handled recursively
+                too_far = middle
+        return fits
+
+    final_spans: List[_Span] = []
+    current: Optional[_Span] = None  # None or an empty span both mean "no current chunk"
+    index = 0
+    while index < len(bounds):
+        piece_start = bounds[index - 1] if index else start
+        piece_end = bounds[index]
+
+        if current is None or (not current[0] and current[2] == current[3]):
+            # The first piece of a chunk is always taken, however large
+            current = ("", base, piece_start, piece_end)
+            index += 1
+            continue
+
+        prefix, _, chunk_start, _ = current
+        fits = furthest_fit(prefix, chunk_start, index)
+        if fits >= index:
+            current = (prefix, base, chunk_start, bounds[fits])
+            index = fits + 1
+            continue
+
+        # Chunk is full. If it is too large even after splitting by the current separator, recurse.
+        if measure(prefix, chunk_start, current[3]) > max_chunk_size:
+            final_spans.extend(recurse(current))
+        else:
+            final_spans.append(current)
+
+        # Start a new chunk with the current piece, adding overlap from the previous chunk
+        overlap = overlap_of(final_spans[-1]) if final_spans else ""
+        current = (overlap, base, piece_start, piece_end)
+        if measure(overlap, piece_start, piece_end) > max_chunk_size:
+            # The piece itself is too large, recurse on it directly
+            final_spans.extend(recurse(("", base, piece_start, piece_end)))
+            current = None
+        index += 1
 
     # Add the last remaining chunk
-    if current_chunk:
-        if len(current_chunk) > max_chunk_size:
-            finer_separators = separators[1:]
-            recursive_chunks = _split_text_recursive(
-                current_chunk, max_chunk_size, finer_separators, chunk_overlap
-            )
-            final_chunks.extend(recursive_chunks)
+    if current is not None and (current[0] or current[2] < current[3]):
+        if measure(current[0], current[2], current[3]) > max_chunk_size:
+            final_spans.extend(recurse(current))
         else:
-            final_chunks.append(current_chunk)
+            final_spans.append(current)
 
-    # Filter out potential empty chunks from splitting
-    return [chunk for chunk in final_chunks if chunk.strip()]
+    # Filter out whitespace-only chunks
+    return [
+        span for span in final_spans
+        if span[0].strip() or _strip_bounds(span[1], span[2], span[3])[0] < span[3]
+    ]
+
+
+def _split_text_recursive(
+    text: str,
+    max_chunk_size: int,
+    separators: List[str],
+    chunk_overlap: int = 50,
+    length_function: LengthFunction = len,
+    atomic_pattern: Optional[Pattern[str]] = None,
+    atomic_length: Optional[AtomicLength] = None,
+) -> List[str]:
+    """
+    Recursively splits text trying different separators.
+    Starts with the coarsest separator, then finer ones if chunks are still too large.
+    Applies a final character-level split if needed.
+    `max_chunk_size` and `chunk_overlap` are measured with `length_function`
+    (characters by default, tokens when given a tokenizer-based length function).
+
+    Works on index ranges into `text` and only builds each chunk's string once,
+    so the cost is linear in the text length for every separator level.
+    Matches of `atomic_pattern` are never split and never carried over as overlap; with character
+    lengths, `atomic_length` sets how long a match counts (its own length by default).
+    """
+    spans = _split_range(
+        text, 0, len(text), max_chunk_size, separators, chunk_overlap, length_function, atomic_pattern, atomic_length
+    )
+    return [_span_text(span) for span in spans]
 
 
 def _split_markdown_by_headers(
@@ -137,27 +357,85 @@ def _split_markdown_by_headers(
 
     return chunks
 
+CODE_BLOCK_PATTERN = re.compile(r"(^```.*?^```)", re.MULTILINE | re.DOTALL)
+MARKDOWN_SEPARATORS = ["\n\n", "\n", ". ", "! ", "? ", " ", ""]
+# Page boundaries left in converted Markdown (e.g. by the PDF converter); stripped from chunks into metadata["pages"]
+PAGE_MARKER_PATTERN = re.compile(r"<!-- page: (\d+) -->\n*")
+
+
+def page_marker(page_number: int) -> str:
+    return f"<!-- page: {page_number} -->\n\n"
+
+
+def chunk_content_hash(text: str, headers: Optional[Dict[str, str]] = None) -> str:
+    """
+    SHA-256 of a chunk's text and its header path. Headers are included because they are part
+    of the stored payload, so a section that moved under a different heading is re-indexed.
+    """
+    hasher = hashlib.sha256()
+    for level, title in sorted((headers or {}).items()):
+        hasher.update(f"{level}:{title}\n".encode("utf-8"))
+    hasher.update(b"\n")
+    hasher.update(text.encode("utf-8"))
+    return hasher.hexdigest()
+
+
 def chunk_markdown(
     markdown_text: str,
     split_level: int = 3,
     max_chunk_size: int = 1000,
     chunk_overlap: int = 50,
-    source_document: Optional[str] = None # This is document_id as string
+    source_document: Optional[str] = None, # This is document_id as string
+    length_function: LengthFunction = len # Measures max_chunk_size/chunk_overlap; see make_token_length_function
 ) -> List[Dict]:
-    code_block_pattern = re.compile(r"(^```.*?^```)", re.MULTILINE | re.DOTALL)
-    code_blocks = {}
-    placeholder_template = "CODEBLOCK_PLACEHOLDER_{}"
+    # Fenced code blocks are swapped for numbered placeholders so headers inside code are not
+    # treated as sections. The per-call nonce keeps placeholders from colliding with document text,
+    # and the trailing "_" keeps "..._1_" from matching a prefix of "..._12_".
+    code_blocks: List[str] = []
+    placeholder_prefix = f"CODEBLOCK_PLACEHOLDER_{uuid.uuid4().hex[:12]}_"
+    placeholder_pattern = re.compile(re.escape(placeholder_prefix) + r"(\d+)_")
 
     def replace_code_block(match):
-        block_id = str(uuid.uuid4())
-        placeholder = placeholder_template.format(block_id)
-        code_blocks[placeholder] = match.group(1)
-        return placeholder
+        code_blocks.append(match.group(1))
+        return f"{placeholder_prefix}{len(code_blocks) - 1}_"
+
+    def restore_code_blocks(text: str) -> str:
+        # Single regex pass per chunk instead of one str.replace per code block
+        if not code_blocks:
+            return text
+        return placeholder_pattern.sub(lambda match: code_blocks[int(match.group(1))], text)
+
+    processed_text = CODE_BLOCK_PATTERN.sub(replace_code_block, markdown_text)
+    # Size chunks by their restored text so a placeholder counts as the code block it stands for.
+    # Character counts stay on the splitter's `len` paths, with each placeholder counted as its block's length.
+    split_length, placeholder_length = length_function, None
+    if code_blocks and length_function is len:
+        placeholder_length = lambda match: len(code_blocks[int(match.group(1))])
+    elif code_blocks:
+        split_length = lambda text: length_function(restore_code_blocks(text))
 
-    processed_text = code_block_pattern.sub(replace_code_block, markdown_text)
     primary_chunks = _split_markdown_by_headers(processed_text, split_level)
     final_chunks = []
     chunk_seq_id = 0
+    has_page_markers = PAGE_MARKER_PATTERN.search(markdown_text) is not None
+    current_page: Optional[int] = None # Page the text before the next chunk ended on
+
+    def add_chunk(text: str, chunk_metadata: Dict) -> None:
+        nonlocal chunk_seq_id, current_page
+        if has_page_markers:
+            marker_pages = [int(number) for number in PAGE_MARKER_PATTERN.findall(text)]
+            # A chunk starts on the page the previous text ended on, unless it starts with a page marker
+            pages = [current_page] if current_page is not None and not PAGE_MARKER_PATTERN.match(text.lstrip()) else []
+            pages += [page for page in marker_pages if page not in pages]
+            if marker_pages:
+                current_page = marker_pages[-1]
+            text = PAGE_MARKER_PATTERN.sub("", text).strip()
+            if not text:
+                return
+            chunk_metadata["pages"] = pages
+        chunk_metadata["content_hash"] = chunk_content_hash(text, chunk_metadata["headers"])
+        final_chunks.append({"text": text, "metadata": chunk_metadata})
+        chunk_seq_id += 1
 
     for headers, text_block in primary_chunks:
         if not text_block.strip():
@@ -168,100 +446,227 @@ def chunk_markdown(
             base_metadata["source_document_id"] = source_document # Store original doc_id here
             base_metadata["chunk_sequence"] = chunk_seq_id # Store sequence here
 
-        # Re-insert code blocks before further splitting or finalizing
-        # This needs to happen before _split_text_recursive if text_block is large
-        # and before final_chunks.append if text_block is small.
-        
-        # Temporarily restore code blocks for accurate length check and splitting
-        temp_restored_text_block = text_block
-        for placeholder, code in code_blocks.items():
-            if placeholder in temp_restored_text_block:
-                temp_restored_text_block = temp_restored_text_block.replace(placeholder, code)
-
-        if len(temp_restored_text_block) <= max_chunk_size:
-            final_text = temp_restored_text_block # Already restored
-            
+        restored_text_block = restore_code_blocks(text_block)
+
+        if length_function(restored_text_block) <= max_chunk_size:
             chunk_metadata = base_metadata.copy()
-            # --- MODIFICATION FOR QDRANT POINT ID ---
             # Generate a UUID for the chunk_id (which will be DocumentChunk.id and Qdrant point ID)
             chunk_metadata["chunk_id"] = str(uuid.uuid4())
-            # --- END MODIFICATION ---
-            
-            final_chunks.append({"text": final_text, "metadata": chunk_metadata})
-            chunk_seq_id += 1
+            add_chunk(restored_text_block, chunk_metadata)
         else:
-            # If splitting recursively, pass the text_block *without* code blocks restored yet,
-            # as _split_text_recursive works on plain text.
-            separators = ["\n\n", "\n", ". ", "! ", "? ", " ", ""]
+            # Split the text with placeholders still in place; each placeholder is atomic,
+            # so a code block is never cut and only ends up in a chunk of its own if it is too large.
             sub_chunks_text_only = _split_text_recursive(
-                text_block, max_chunk_size, separators, chunk_overlap # Pass original text_block with placeholders
+                text_block, max_chunk_size, MARKDOWN_SEPARATORS, chunk_overlap, split_length,
+                atomic_pattern=placeholder_pattern if code_blocks else None, atomic_length=placeholder_length
             )
 
             for sub_chunk_text_placeholder in sub_chunks_text_only:
-                # Restore code blocks into the sub-chunk
-                final_sub_text = sub_chunk_text_placeholder
-                for placeholder, code in code_blocks.items():
-                    if placeholder in final_sub_text:
-                        final_sub_text = final_sub_text.replace(placeholder, code)
-
                 chunk_metadata = base_metadata.copy()
-                # --- MODIFICATION FOR QDRANT POINT ID ---
                 chunk_metadata["chunk_id"] = str(uuid.uuid4()) # New UUID for each sub-chunk
                 # Update sequence for sub-chunks if needed, or rely on order
                 chunk_metadata["sub_chunk_sequence_within_block"] = chunk_seq_id # Or a more granular sequence
-                # --- END MODIFICATION ---
-
-                final_chunks.append({"text": final_sub_text, "metadata": chunk_metadata})
-                chunk_seq_id += 1 # Increment for each sub-chunk or manage sequence differently
+                add_chunk(restore_code_blocks(sub_chunk_text_placeholder), chunk_metadata)
 
-    # Final pass to ensure no placeholders remain (should be handled above)
-    # for chunk in final_chunks:
-    #      for placeholder, code in code_blocks.items():
-    #          if placeholder in chunk["text"]:
-    #              chunk["text"] = chunk["text"].replace(placeholder, code)
     return final_chunks
 
 
-def save_chunks_to_database(
-    db: Session,
+# Length function used by chunk_markdown_batch workers, set once per process by _init_chunking_worker
+_worker_length_function: LengthFunction = len
+
+
+def _init_chunking_worker(tokenizer_name: Optional[str]) -> None:
+    global _worker_length_function
+    if tokenizer_name:
+        from transformers import AutoTokenizer # Heavy import, only needed in token mode
+        _worker_length_function = make_token_length_function(AutoTokenizer.from_pretrained(tokenizer_name))
+
+
+def _chunk_markdown_worker(markdown_text: str, source_document: Optional[str], chunk_kwargs: Dict) -> List[Dict]:
+    return chunk_markdown(
+        markdown_text, source_document=source_document, length_function=_worker_length_function, **chunk_kwargs
+    )
+
+
+def chunk_markdown_batch(
+    documents: Iterable[Tuple[str, Optional[str]]],
+    max_workers: Optional[int] = None,
+    tokenizer_name: Optional[str] = None,
+    **chunk_kwargs
+) -> Iterator[List[Dict]]:
+    """
+    Chunks many Markdown documents across CPU cores with chunk_markdown.
+
+    `documents` yields (markdown_text, source_document) pairs and is consumed lazily;
+    each document's chunk list is yielded in input order as soon as it and every
+    document before it are done, with at most a few documents per worker in flight.
+    `tokenizer_name` (a HuggingFace tokenizer, normally the embedding model) switches
+    the workers to token lengths; the length function itself cannot be pickled.
+    `chunk_kwargs` are passed through to chunk_markdown (split_level, max_chunk_size, chunk_overlap).
+    """
+    if max_workers == 1:
+        _init_chunking_worker(tokenizer_name)
+        for markdown_text, source_document in documents:
+            yield _chunk_markdown_worker(markdown_text, source_document, chunk_kwargs)
+        return
+
+    workers = max_workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_chunking_worker, initargs=(tokenizer_name,)
+    ) as executor:
+        max_in_flight = workers * 4
+        in_flight = deque()
+        for markdown_text, source_document in documents:
+            in_flight.append(executor.submit(_chunk_markdown_worker, markdown_text, source_document, chunk_kwargs))
+            if len(in_flight) >= max_in_flight:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+def _chunk_rows(
     chunks: List[Dict],
     document_id: int,
     project_id: int,
     file_name: str,
-    file_hash: str # This is the original file_hash
-) -> List[str]: # Returns list of DocumentChunk.id (which are now UUIDs)
-    saved_chunk_ids = []
-    
+    file_hash: str,
+    now: datetime
+) -> List[Dict]:
+    rows = []
     for chunk_data in chunks:
-        # The chunk_id is now a UUID generated in chunk_markdown
+        # The chunk_id is a UUID generated in chunk_markdown
         chunk_id = chunk_data["metadata"].get("chunk_id")
         if not chunk_id:
             # This should not happen if chunk_markdown always assigns a UUID
-            # As a fallback, generate one here, but it's better if chunk_markdown is robust
             chunk_id = str(uuid.uuid4())
             chunk_data["metadata"]["chunk_id"] = chunk_id # Ensure it's in metadata for consistency
-        
-        # Create a new database record
-        db_chunk = DocumentChunk(
-            id=chunk_id, # This is now a UUID string
-            project_id=project_id,
-            document_id=document_id,
-            file_name=file_name,
-            hash=file_hash, # Store the original file's hash for reference
-            chunk_metadata=chunk_data["metadata"] # This includes source_document_id, chunk_sequence etc.
-        )
-        
-        # Add the chunk text directly to the metadata for storage in DocumentChunk
-        # This is already part of the design.
-        # db_chunk.chunk_metadata["content"] = chunk_data["text"] # This is redundant if text is in Qdrant payload
-
-        # The actual text of the chunk is in chunk_data["text"]
-        # It will be put into the Qdrant payload by the consumer.
-        # The DocumentChunk.chunk_metadata will store the metadata from chunk_markdown.
-        
-        db.add(db_chunk)
-        saved_chunk_ids.append(chunk_id)
-    
+
+        # The chunk text itself goes into the Qdrant payload; chunk_metadata stores
+        # the metadata from chunk_markdown (source_document_id, chunk_sequence etc.)
+        rows.append({
+            "id": chunk_id,
+            "project_id": project_id,
+            "document_id": document_id,
+            "file_name": file_name,
+            "hash": file_hash, # Store the original file's hash for reference
+            "content_hash": chunk_data["metadata"].get("content_hash") or chunk_content_hash(
+                chunk_data["text"], chunk_data["metadata"].get("headers")
+            ),
+            "chunk_metadata": chunk_data["metadata"],
+            "created_at": now,
+            "updated_at": now,
+        })
+    return rows
+
+
+def save_chunks_to_database(
+    db: Session,
+    chunks: List[Dict],
+    document_id: int,
+    project_id: int,
+    file_name: str,
+    file_hash: str, # This is the original file_hash
+    batch_size: int = 1000
+) -> List[str]: # Returns list of DocumentChunk.id (which are now UUIDs)
+    """
+    Bulk-inserts a document's chunks with executemany INSERTs of `batch_size` rows,
+    skipping the ORM unit of work (no DocumentChunk objects, identity map or per-row flush).
+    All batches are committed in a single transaction.
+    """
+    rows = _chunk_rows(chunks, document_id, project_id, file_name, file_hash, datetime.now(UTC))
+
+    for batch_start in range(0, len(rows), batch_size):
+        db.execute(insert(DocumentChunk), rows[batch_start:batch_start + batch_size])
+
     db.commit() # Commit all chunks for this document in a single transaction
-    
-    return saved_chunk_ids
+
+    return [row["id"] for row in rows]
+
+
+def diff_chunks(
+    previous_chunks: Iterable[Tuple[str, Optional[str]]],
+    chunks: List[Dict]
+) -> Tuple[List[Dict], List[Dict], List[str]]:
+    """
+    Matches a new version's chunks against the previous version's (chunk_id, content_hash) pairs.
+
+    A chunk whose content_hash matches an unclaimed previous chunk takes over that chunk's id
+    (metadata["chunk_id"]), so its row and vector can be kept instead of re-embedded.
+    Returns (new_chunks, reused_chunks, removed_chunk_ids). Previous chunks without a
+    content_hash (ingested before hashes were stored) are always removed.
+    """
+    unclaimed: Dict[str, List[str]] = {}
+    removed_chunk_ids = []
+    for chunk_id, content_hash in previous_chunks:
+        if content_hash:
+            unclaimed.setdefault(content_hash, []).append(chunk_id)
+        else:
+            removed_chunk_ids.append(chunk_id)
+
+    new_chunks, reused_chunks = [], []
+    for chunk_data in chunks:
+        metadata = chunk_data["metadata"]
+        content_hash = metadata.get("content_hash") or chunk_content_hash(chunk_data["text"], metadata.get("headers"))
+        matching_ids = unclaimed.get(content_hash)
+        if matching_ids:
+            metadata["chunk_id"] = matching_ids.pop(0)
+            reused_chunks.append(chunk_data)
+        else:
+            new_chunks.append(chunk_data)
+
+    removed_chunk_ids.extend(chunk_id for chunk_ids in unclaimed.values() for chunk_id in chunk_ids)
+    return new_chunks, reused_chunks, removed_chunk_ids
+
+
+def save_chunk_updates_to_database(
+    db: Session,
+    chunks: List[Dict],
+    previous_document_id: int,
+    document_id: int,
+    project_id: int,
+    file_name: str,
+    file_hash: str,
+    batch_size: int = 1000
+) -> Tuple[List[Dict], List[Dict], List[str]]:
+    """
+    Incremental counterpart of save_chunks_to_database for a new version of an existing document.
+
+    Diffs `chunks` against the previous version's chunks by content_hash: unchanged chunks keep
+    their rows (moved to the new document with refreshed metadata), new chunks are inserted and
+    chunks that disappeared are deleted. The superseded Document record is deleted and its uploads
+    are pointed at the new one, so re-uploading the old file is ingested again instead of being
+    reported as a duplicate. Everything happens in one transaction.
+    Returns diff_chunks' (new_chunks, reused_chunks, removed_chunk_ids) for updating the vector store.
+    """
+    previous_chunks = db.query(DocumentChunk.id, DocumentChunk.content_hash).filter(
+        DocumentChunk.document_id == previous_document_id
+    ).all()
+    new_chunks, reused_chunks, removed_chunk_ids = diff_chunks(previous_chunks, chunks)
+
+    now = datetime.now(UTC)
+    rows = _chunk_rows(new_chunks, document_id, project_id, file_name, file_hash, now)
+    for batch_start in range(0, len(rows), batch_size):
+        db.execute(insert(DocumentChunk), rows[batch_start:batch_start + batch_size])
+
+    # ORM bulk UPDATE by primary key: one executemany per batch
+    reused_rows = [
+        {"id": chunk_data["metadata"]["chunk_id"], "document_id": document_id, "hash": file_hash,
+         "chunk_metadata": chunk_data["metadata"], "updated_at": now}
+        for chunk_data in reused_chunks
+    ]
+    for batch_start in range(0, len(reused_rows), batch_size):
+        db.execute(update(DocumentChunk), reused_rows[batch_start:batch_start + batch_size])
+
+    for batch_start in range(0, len(removed_chunk_ids), batch_size):
+        db.execute(
+            delete(DocumentChunk).where(DocumentChunk.id.in_(removed_chunk_ids[batch_start:batch_start + batch_size]))
+        )
+
+    if previous_document_id != document_id: # Equal when re-saving a document's own chunks on resume
+        db.execute(
+            update(DocumentUpload).where(DocumentUpload.document_id == previous_document_id).values(document_id=document_id)
+        )
+        db.execute(delete(Document).where(Document.id == previous_document_id))
+    db.commit()
+
+    return new_chunks, reused_chunks, removed_chunk_ids
@@ -0,0 +1,131 @@
+import re
+import unicodedata
+from typing import List, NamedTuple, Optional
+
+# Refinement modes decided per document
+REFINE_NONE = "none"         # MarkItDown output is used as-is
+REFINE_SECTIONS = "sections" # Only low-quality sections are sent to the LLM
+REFINE_ALL = "all"           # The whole document is sent to the LLM (previous behaviour)
+
+# Values accepted by Config.MARKDOWN_REFINEMENT_POLICY
+POLICY_AUTO = "auto"
+POLICY_ALWAYS = "always"
+POLICY_NEVER = "never"
+
+# Content types whose MarkItDown output is the source text itself
+TEXT_CONTENT_TYPES = {"text/markdown", "text/plain"}
+
+# A section is low quality above this share of unreadable characters (mojibake, control chars, U+FFFD)
+MAX_GARBAGE_RATIO = 0.01
+# ...or when this share of its lines look like a table flattened into whitespace-separated columns
+MAX_LOOSE_TABLE_LINE_RATIO = 0.3
+# Long documents need at least one heading per this many words to count as structured
+MIN_WORDS_PER_HEADING = 1500
+# Above this share of low-quality words, refining sections separately is not worth it
+MAX_SECTION_REFINE_RATIO = 0.5
+
+HEADING_PATTERN = re.compile(r"^#{1,6}\s+\S")
+FENCE_PATTERN = re.compile(r"^\s*(```|~~~)")
+PIPE_TABLE_PATTERN = re.compile(r"^\s*\|.*\|\s*$")
+# Two or more gaps of 2+ spaces/tabs between non-space text, e.g. "Revenue   1,200   1,350"
+LOOSE_COLUMNS_PATTERN = re.compile(r"\S(?:\t|\s{2,})\S.*\S(?:\t|\s{2,})\S")
+
+
+class SectionStats(NamedTuple):
+    words: int
+    garbage_ratio: float
+    loose_table_ratio: float
+
+    @property
+    def low_quality(self) -> bool:
+        return self.garbage_ratio > MAX_GARBAGE_RATIO or self.loose_table_ratio > MAX_LOOSE_TABLE_LINE_RATIO
+
+
+class RefinementPlan(NamedTuple):
+    mode: str
+    sections: List[str]          # The MarkItDown output split at headings; "".join(sections) is the original
+    refine_indices: List[int]    # Sections to refine in REFINE_SECTIONS mode
+    reason: str
+
+
+def split_sections(markdown: str) -> List[str]:
+    """Splits Markdown before each heading line outside fenced code blocks, keeping the text intact."""
+    sections: List[str] = []
+    current: List[str] = []
+    in_fence = False
+    for line in markdown.splitlines(keepends=True):
+        if FENCE_PATTERN.match(line):
+            in_fence = not in_fence
+        elif not in_fence and HEADING_PATTERN.match(line) and current:
+            sections.append("".join(current))
+            current = []
+        current.append(line)
+    if current:
+        sections.append("".join(current))
+    return sections
+
+
+def _is_garbage(char: str) -> bool:
+    if char in "\n\t\r":
+        return False
+    # Cc: control, Co: private use, Cs: surrogates, Cn: unassigned; U+FFFD is the decoder's replacement char
+    return char == "\ufffd" or unicodedata.category(char) in ("Cc", "Co", "Cs", "Cn")
+
+
+def section_stats(section: str) -> SectionStats:
+    garbage = sum(1 for char in section if _is_garbage(char))
+    lines = []
+    in_fence = False
+    for line in section.splitlines():
+        if FENCE_PATTERN.match(line):
+            in_fence = not in_fence
+        elif not in_fence and line.strip() and not HEADING_PATTERN.match(line):
+            lines.append(line) # Aligned columns inside code blocks are intentional
+    loose_table_lines = sum(
+        1 for line in lines if LOOSE_COLUMNS_PATTERN.search(line) and not PIPE_TABLE_PATTERN.match(line)
+    )
+    return SectionStats(
+        words=len(section.split()),
+        garbage_ratio=garbage / len(section) if section else 0.0,
+        loose_table_ratio=loose_table_lines / len(lines) if lines else 0.0,
+    )
+
+
+def plan_refinement(content_type: Optional[str], markitdown_output: str, policy: str = POLICY_AUTO) -> RefinementPlan:
+    """
+    Decides how much of a MarkItDown conversion to send to the LLM.
+
+    Markdown and plain-text uploads, and conversions that already have headings and clean tables
+    (typical for DOCX/XLSX), skip the LLM. Structured documents with a few broken sections (garbled
+    characters, tables flattened into columns of spaces) only have those sections refined. Documents
+    without structure, or mostly low quality, are refined in full. An empty MarkItDown output is
+    always refined in full, since the LLM then works from the raw file.
+    """
+    sections = split_sections(markitdown_output) if markitdown_output.strip() else []
+    if not sections:
+        return RefinementPlan(REFINE_ALL, sections, [], "no MarkItDown output")
+    if policy == POLICY_ALWAYS:
+        return RefinementPlan(REFINE_ALL, sections, [], "policy is 'always'")
+    if policy == POLICY_NEVER:
+        return RefinementPlan(REFINE_NONE, sections, [], "policy is 'never'")
+
+    stats = [section_stats(section) for section in sections]
+    low_quality = [i for i, section in enumerate(stats) if section.low_quality]
+    total_words = sum(section.words for section in stats) or 1
+    low_quality_words = sum(stats[i].words for i in low_quality)
+
+    if content_type in TEXT_CONTENT_TYPES:
+        # The upload is the text itself: an LLM pass would only restyle it; only repair garbled sections
+        garbled = [i for i, section in enumerate(stats) if section.garbage_ratio > MAX_GARBAGE_RATIO]
+        if garbled:
+            return RefinementPlan(REFINE_SECTIONS, sections, garbled, f"{len(garbled)} garbled sections in text upload")
+        return RefinementPlan(REFINE_NONE, sections, [], "text upload")
+
+    headings = sum(1 for section in sections if HEADING_PATTERN.match(section))
+    if total_words > MIN_WORDS_PER_HEADING and total_words / max(headings, 1) > MIN_WORDS_PER_HEADING:
+        return RefinementPlan(REFINE_ALL, sections, [], f"{headings} headings for {total_words} words")
+    if low_quality_words / total_words > MAX_SECTION_REFINE_RATIO:
+        return RefinementPlan(REFINE_ALL, sections, [], f"{low_quality_words} of {total_words} words in low-quality sections")
+    if low_quality:
+        return RefinementPlan(REFINE_SECTIONS, sections, low_quality, f"{len(low_quality)} of {len(sections)} sections low quality")
+    return RefinementPlan(REFINE_NONE, sections, [], "well-structured MarkItDown output")
@@ -1,11 +1,10 @@
+import asyncio
 import os
 import hashlib
-import shutil
-import boto3
 import logging
 from fastapi import Depends, HTTPException, status, UploadFile
-from sqlalchemy.orm import Session
-from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, insert, select, update
 from typing import List, Optional, Dict, Tuple
 from datetime import UTC, datetime
 import uuid
@@ -13,8 +12,10 @@ import json # For RabbitMQ message
 
 from app.models.models import Document, DocumentUpload, Project, DocumentChunk
 from app.config.config import getConfig
-from db.database import get_db_session
+from db.database import get_async_db_session
+from app.services.pagination import InvalidCursorError, decode_cursor, encode_cursor, keyset_page, split_page
 from app.services.rabbitmq import RabbitMQService, get_rabbitmq_service # Import RabbitMQService
+from app.services.storage import LocalStorage, Storage, get_storage
 
 logger = logging.getLogger(__name__)
 
@@ -36,223 +37,356 @@ def create_temp_file_path(filename: str) -> str:
     unique_filename = f"{uuid.uuid4().hex}{ext}"
     return os.path.join(TEMP_DIR, unique_filename)
 
+UPLOAD_READ_SIZE = 1024 * 1024 # Bytes read from the request body at a time
+
+class UploadTooLargeError(Exception):
+    pass
+
+async def stage_upload_file(
+    file: UploadFile,
+    storage: Storage,
+    staging_prefix: str = "",
+    part_size: int = 8 * 1024 * 1024
+) -> Tuple[str, int, str]:
+    """
+    Streams an upload to `storage` under `<staging_prefix><uuid><ext>`, hashing it on the way; the
+    file is never held in memory whole (S3 buffers at most one multipart part).
+    Returns (staged path, size, sha256). An empty file is not staged and gets an empty path.
+    Raises UploadTooLargeError as soon as MAX_FILE_SIZE is exceeded, leaving nothing behind.
+    """
+    hasher = hashlib.sha256()
+    file_size = 0
+
+    async def chunks():
+        nonlocal file_size
+        while chunk := await file.read(UPLOAD_READ_SIZE):
+            file_size += len(chunk)
+            if file_size > MAX_FILE_SIZE:
+                raise UploadTooLargeError(f"File size exceeds maximum allowed ({MAX_FILE_SIZE // (1024 * 1024)}MB)")
+            hasher.update(chunk)
+            yield chunk
+
+    ext = os.path.splitext(file.filename or "")[1]
+    staged_path = await storage.save_stream(
+        chunks(), f"{staging_prefix}{uuid.uuid4().hex}{ext}", file.content_type or "application/octet-stream", part_size
+    )
+    return staged_path or "", file_size, hasher.hexdigest()
+
+def discard_staged_upload(storage: Storage, staged_path: str) -> None:
+    """Removes a staged upload that will not be processed (duplicate, failed to queue, or already ingested)."""
+    if not staged_path:
+        return
+    try:
+        storage.delete(staged_path)
+    except Exception as e:
+        logger.warning(f"Could not remove staged upload {staged_path}: {e}")
+
 class DocumentService:
     def __init__(
         self, 
-        db: Session = Depends(get_db_session),
+        db: AsyncSession = Depends(get_async_db_session),
         rabbitmq_service: RabbitMQService = Depends(get_rabbitmq_service)
         ):
         self.db = db
         self.config = getConfig()
         self.rabbitmq_service = rabbitmq_service
-        self.s3_client = self._create_s3_client()
-        self.bucket_name = self.config.MINIO_BUCKET_NAME if self.s3_client else None
-        
-    def _create_s3_client(self): # This S3 client is for the synchronous part of upload if needed
-        try:
-            # This client might not be strictly needed here if all S3 ops are in consumer
-            # But keeping it in case of future needs for DocumentService
-            endpoint_url = self.config.MINIO_ENDPOINT
-            access_key = self.config.MINIO_ACCESS_KEY
-            secret_key = self.config.MINIO_SECRET_KEY
-            
-            if not all([endpoint_url, access_key, secret_key, self.config.MINIO_BUCKET_NAME]):
-                logger.warning("MinIO not fully configured. S3 client for DocumentService not initialized.")
-                return None
-                
-            s3_client = boto3.client(
-                's3', endpoint_url=endpoint_url,
-                aws_access_key_id=access_key, aws_secret_access_key=secret_key,
-                region_name='us-east-1', config=boto3.session.Config(signature_version='s3v4')
-            )
-            try:
-                s3_client.head_bucket(Bucket=self.config.MINIO_BUCKET_NAME)
-                logger.info(f"S3 Bucket '{self.config.MINIO_BUCKET_NAME}' accessible by DocumentService.")
-            except Exception:
-                logger.warning(f"S3 Bucket '{self.config.MINIO_BUCKET_NAME}' not found or inaccessible by DocumentService. Attempting to create.")
-                try:
-                    s3_client.create_bucket(Bucket=self.config.MINIO_BUCKET_NAME)
-                    logger.info(f"S3 Bucket '{self.config.MINIO_BUCKET_NAME}' created by DocumentService.")
-                except Exception as create_e:
-                    logger.error(f"Failed to create S3 bucket '{self.config.MINIO_BUCKET_NAME}' by DocumentService: {create_e}")
-                    return None
-            return s3_client
-        except Exception as e:
-            logger.error(f"Error initializing S3 client in DocumentService: {e}")
-            return None
+        self.storage = get_storage()
+        if self.config.UPLOAD_STAGING == "s3":
+            self.staging_storage, self.staging_prefix = self.storage, self.config.UPLOAD_STAGING_PREFIX
+        else:
+            self.staging_storage, self.staging_prefix = LocalStorage(TEMP_DIR), ""
 
     async def upload_documents(
         self, 
         files: List[UploadFile], 
         project_id: int, 
-        user_id: int
+        user_id: int,
+        replace_existing: bool = False
     ) -> List[Dict]: # Returns List[DocumentUploadResult]
-        project = self.db.query(Project).filter(Project.id == project_id).first()
+        """
+        Stages all files concurrently (bounded by UPLOAD_CONCURRENCY), then checks duplicates with one
+        query over all hashes, inserts the DocumentUpload rows in one statement and publishes their
+        messages as one confirmed batch. Results are returned in the order of `files`.
+        With `replace_existing`, each file is a new version of the project's latest document with the
+        same file name, which the consumer replaces incrementally; otherwise same-named files coexist.
+        """
+        project = await self.db.get(Project, project_id)
         if not project:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Project with ID {project_id} not found")
-        
-        upload_results = []
-        
-        for file in files:
-            file_result = {"file_name": file.filename, "status": "error", "upload_id": None, "document_id": None, "is_exist": False, "error": None}
+
+        upload_results = [
+            {"file_name": file.filename, "status": "error", "upload_id": None, "document_id": None, "is_exist": False, "error": None}
+            for file in files
+        ]
+        semaphore = asyncio.Semaphore(max(self.config.UPLOAD_CONCURRENCY, 1))
+
+        async def stage(file: UploadFile, file_result: Dict) -> Optional[Tuple[str, int, str]]:
             try:
                 if file.content_type not in ALLOWED_CONTENT_TYPES:
                     file_result["error"] = f"Unsupported file type: {file.content_type}"
                     logger.warning(f"Unsupported file type for {file.filename}: {file.content_type}")
-                    upload_results.append(file_result)
-                    continue
-                
-                content = await file.read()
-                file_size = len(content)
-                await file.seek(0)
-                
-                if file_size == 0:
+                    return None
+                if file.size is not None and file.size > MAX_FILE_SIZE:
+                    # Rejected from the multipart part's size before reading any of it
+                    file_result["error"] = f"File size exceeds maximum allowed ({MAX_FILE_SIZE // (1024 * 1024)}MB)"
+                    logger.warning(f"File size exceeded for {file.filename}: {file.size} bytes")
+                    return None
+                async with semaphore:
+                    staged = await stage_upload_file(file, self.staging_storage, self.staging_prefix, self.config.UPLOAD_PART_SIZE)
+                if staged[1] == 0:
                     file_result["error"] = "File is empty."
                     logger.warning(f"Empty file uploaded: {file.filename}")
-                    upload_results.append(file_result)
-                    continue
+                    return None
+                return staged
+            except UploadTooLargeError as e:
+                file_result["error"] = str(e)
+                logger.warning(f"File size exceeded for {file.filename}")
+            except Exception as e:
+                file_result["error"] = f"Error saving uploaded file: {e}"
+                logger.error(f"Error staging upload {file.filename}: {e}", exc_info=True)
+            finally:
+                if hasattr(file, 'file') and file.file:
+                    file.file.close()
+            return None
 
-                if file_size > MAX_FILE_SIZE:
-                    file_result["error"] = f"File size exceeds maximum allowed ({MAX_FILE_SIZE // (1024 * 1024)}MB)"
-                    logger.warning(f"File size exceeded for {file.filename}: {file_size} bytes")
-                    upload_results.append(file_result)
-                    continue
-                
-                file_hash = hashlib.sha256(content).hexdigest()
-                
-                existing_document = self.db.query(Document).filter(
-                    Document.project_id == project_id,
-                    Document.file_hash == file_hash
-                ).first()
-                
-                if existing_document:
+        staged_files = await asyncio.gather(*(stage(file, file_result) for file, file_result in zip(files, upload_results)))
+        staged_indices = [i for i, staged in enumerate(staged_files) if staged]
+        if not staged_indices:
+            return upload_results
+
+        try:
+            # One query for the duplicates of the whole batch
+            file_hashes = {staged_files[i][2] for i in staged_indices}
+            existing_documents = dict((await self.db.execute(
+                select(Document.file_hash, func.min(Document.id))
+                .where(Document.project_id == project_id, Document.file_hash.in_(file_hashes))
+                .group_by(Document.file_hash)
+            )).all())
+            replaced_documents = {}
+            if replace_existing:
+                file_names = {files[i].filename for i in staged_indices}
+                replaced_documents = dict((await self.db.execute(
+                    select(Document.file_name, func.max(Document.id))
+                    .where(Document.project_id == project_id, Document.file_name.in_(file_names))
+                    .group_by(Document.file_name)
+                )).all())
+
+            now = datetime.now(UTC)
+            new_indices = []
+            rows = []
+            for i in staged_indices:
+                staged_path, file_size, file_hash = staged_files[i]
+                file_result = upload_results[i]
+                if file_hash in existing_documents:
+                    discard_staged_upload(self.staging_storage, staged_path)
                     file_result["status"] = "exists"
-                    file_result["document_id"] = existing_document.id
+                    file_result["document_id"] = existing_documents[file_hash]
                     file_result["is_exist"] = True
-                    logger.info(f"Document {file.filename} (hash: {file_hash}) already exists in project {project_id}.")
-                    upload_results.append(file_result)
-                    continue
-                
-                temp_file_path = create_temp_file_path(file.filename)
-                try:
-                    with open(temp_file_path, "wb") as buffer:
-                        shutil.copyfileobj(file.file, buffer)
-                except Exception as e:
-                    file_result["error"] = f"Error saving temporary file: {e}"
-                    logger.error(f"Error saving temp file {file.filename}: {e}", exc_info=True)
-                    upload_results.append(file_result)
+                    logger.info(f"Document {file_result['file_name']} (hash: {file_hash}) already exists in project {project_id}.")
                     continue
-                
-                now = datetime.now(UTC)
-                document_upload = DocumentUpload(
-                    project_id=project_id,
-                    file_name=file.filename, 
-                    file_hash=file_hash,
-                    file_size=file_size,
-                    content_type=file.content_type,
-                    temp_path=temp_file_path,
-                    user_id=user_id,
-                    status="queued", # Initial status before RabbitMQ pickup
-                    created_at=now,
-                    updated_at=now
-                )
-                
-                self.db.add(document_upload)
-                self.db.commit()
-                self.db.refresh(document_upload)
-
-                # Publish message to RabbitMQ
-                message_body = {"document_upload_id": document_upload.id}
-                published = self.rabbitmq_service.publish_message(
-                    queue_name=self.config.RABBITMQ_DOCUMENT_QUEUE,
-                    message=message_body
-                )
-
-                if published:
-                    file_result["status"] = "queued"
-                    file_result["upload_id"] = document_upload.id
-                    logger.info(f"File {file.filename} (upload_id: {document_upload.id}) queued for processing via RabbitMQ.")
-                else:
-                    # Rollback DocumentUpload creation or mark as error if MQ publish fails
-                    document_upload.status = "error"
-                    document_upload.error_message = "Failed to queue for processing."
-                    self.db.commit()
-                    file_result["status"] = "error"
-                    file_result["upload_id"] = document_upload.id
-                    file_result["error"] = "Failed to queue for processing."
-                    logger.error(f"Failed to publish message to RabbitMQ for DocumentUpload {document_upload.id}.")
-                
-                upload_results.append(file_result)
-                    
-            except HTTPException:
-                raise
-            except Exception as e:
-                logger.error(f"Unexpected error during upload of file '{getattr(file, 'filename', 'unknown')}': {e}", exc_info=True)
-                self.db.rollback()
-                file_result["error"] = f"Unexpected server error: {e}"
-                upload_results.append(file_result)
-            finally:
-                if hasattr(file, 'file') and file.file:
-                     file.file.close()
+                new_indices.append(i)
+                rows.append({
+                    "project_id": project_id,
+                    "file_name": files[i].filename,
+                    "file_hash": file_hash,
+                    "file_size": file_size,
+                    "content_type": files[i].content_type,
+                    "temp_path": staged_path,
+                    "user_id": user_id,
+                    "replaces_document_id": replaced_documents.get(files[i].filename),
+                    "status": "queued", # Initial status before RabbitMQ pickup
+                    "created_at": now,
+                    "updated_at": now,
+                })
+            if not rows:
+                return upload_results
+
+            # One multi-row INSERT ... RETURNING, ids in the order of `rows`
+            upload_ids = (await self.db.scalars(
+                insert(DocumentUpload).returning(DocumentUpload.id, sort_by_parameter_order=True),
+                rows
+            )).all()
+            await self.db.commit()
+        except Exception as e:
+            logger.error(f"Unexpected error while registering uploads for project {project_id}: {e}", exc_info=True)
+            await self.db.rollback()
+            for i in staged_indices:
+                if upload_results[i]["status"] == "error":
+                    discard_staged_upload(self.staging_storage, staged_files[i][0])
+                    upload_results[i]["error"] = f"Unexpected server error: {e}"
+            return upload_results
+
+        # Publish all messages as one batch; each is confirmed by the broker. The wait for the confirms
+        # blocks, so it runs in a worker thread instead of on the event loop
+        published = await asyncio.to_thread(
+            self.rabbitmq_service.publish_messages,
+            queue_name=self.config.RABBITMQ_DOCUMENT_QUEUE,
+            messages=[{"document_upload_id": upload_id} for upload_id in upload_ids]
+        )
+
+        failed_ids = []
+        for i, upload_id, was_published in zip(new_indices, upload_ids, published):
+            file_result = upload_results[i]
+            file_result["upload_id"] = upload_id
+            if was_published:
+                file_result["status"] = "queued"
+                logger.info(f"File {file_result['file_name']} (upload_id: {upload_id}) queued for processing via RabbitMQ.")
+            else:
+                file_result["error"] = "Failed to queue for processing."
+                failed_ids.append(upload_id)
+        if failed_ids:
+            # Kept staged so run_requeue_uploads can publish them again
+            await self.db.execute(
+                update(DocumentUpload)
+                .where(DocumentUpload.id.in_(failed_ids))
+                .values(status="error", error_message="Failed to queue for processing.", updated_at=datetime.now(UTC))
+            )
+            await self.db.commit()
+            logger.error(f"Failed to publish messages to RabbitMQ for DocumentUploads {failed_ids}.")
         return upload_results
     
-    async def get_documents_with_status(self, project_id: int) -> List[Dict]:
-        # Retrieve all DocumentUpload entries for the project
-        uploads_and_docs = self.db.query(
-                DocumentUpload, 
-                Document
-            ).outerjoin(Document, DocumentUpload.document_id == Document.id)\
-            .filter(DocumentUpload.project_id == project_id)\
-            .all()
+    @staticmethod
+    def _listing_filters(model, project_id: int, content_type: Optional[str], name_prefix: Optional[str]) -> list:
+        filters = [model.project_id == project_id]
+        if content_type:
+            filters.append(model.content_type == content_type)
+        if name_prefix:
+            filters.append(model.file_name.startswith(name_prefix, autoescape=True))
+        return filters
+
+    @staticmethod
+    def _sort_column(model, sort: str):
+        # The bare column, so each order is served by its (project_id, column, id) index
+        return getattr(model, sort)
+
+    @staticmethod
+    def _page_position(sort: str, order: str, cursor: Optional[str]):
+        if cursor is None:
+            return None
+        try:
+            return decode_cursor(cursor, sort, order)
+        except InvalidCursorError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    async def get_documents(
+        self,
+        project_id: int,
+        content_type: Optional[str] = None,
+        name_prefix: Optional[str] = None,
+        sort: str = "created_at",
+        order: str = "desc",
+        cursor: Optional[str] = None,
+        limit: Optional[int] = 100 # None: every remaining row
+    ) -> Tuple[List[Document], Optional[str]]:
+        """One keyset page of the project's processed documents and the cursor of the next page, if any."""
+        sort_column = self._sort_column(Document, sort)
+        query = keyset_page(
+            select(Document, sort_column.label("sort_value"))
+            .where(*self._listing_filters(Document, project_id, content_type, name_prefix)),
+            sort_column, Document.id, order, self._page_position(sort, order, cursor), limit
+        )
+        rows, has_more = split_page((await self.db.execute(query)).all(), limit)
+        next_cursor = encode_cursor(sort, order, rows[-1].sort_value, rows[-1].Document.id) if has_more else None
+        return [row.Document for row in rows], next_cursor
+
+    async def count_documents(self, project_id: int, content_type: Optional[str] = None, name_prefix: Optional[str] = None) -> int:
+        return await self.db.scalar(
+            select(func.count(Document.id)).where(*self._listing_filters(Document, project_id, content_type, name_prefix))
+        )
+
+    async def get_documents_with_status(
+        self,
+        project_id: int,
+        statuses: Optional[List[str]] = None,
+        content_type: Optional[str] = None,
+        name_prefix: Optional[str] = None,
+        sort: str = "created_at",
+        order: str = "desc",
+        cursor: Optional[str] = None,
+        limit: Optional[int] = 100 # None: every remaining row
+    ) -> Tuple[List[Dict], Optional[str]]:
+        """
+        One keyset page of the project's uploads with the processed document they led to, if any, and
+        the cursor of the next page. Filters and sorting apply to the upload's columns.
+        """
+        filters = self._listing_filters(DocumentUpload, project_id, content_type, name_prefix)
+        if statuses:
+            filters.append(DocumentUpload.status.in_(statuses))
+        sort_column = self._sort_column(DocumentUpload, sort)
+        query = keyset_page(
+            select(
+                DocumentUpload.id, DocumentUpload.file_name, DocumentUpload.file_size, DocumentUpload.content_type,
+                DocumentUpload.file_hash, DocumentUpload.project_id, DocumentUpload.created_at, DocumentUpload.updated_at,
+                DocumentUpload.user_id, DocumentUpload.status, DocumentUpload.error_message,
+                sort_column.label("sort_value"),
+                Document.id.label("doc_id"), Document.file_path.label("doc_file_path"),
+                Document.file_size.label("doc_file_size"), Document.content_type.label("doc_content_type"),
+                Document.file_hash.label("doc_file_hash"), Document.markdown_s3_link.label("doc_markdown_s3_link"),
+                Document.created_at.label("doc_created_at"), Document.updated_at.label("doc_updated_at")
+            )
+            .outerjoin(Document, DocumentUpload.document_id == Document.id)
+            .where(*filters),
+            sort_column, DocumentUpload.id, order, self._page_position(sort, order, cursor), limit
+        )
+        rows, has_more = split_page((await self.db.execute(query)).all(), limit)
 
         results = []
-        for upload, doc in uploads_and_docs:
-            # Determine processing status based on upload status and document existence
-            if upload.status == "completed" and doc:
-                processing_status = "completed"
-            elif upload.status == "error":
-                processing_status = "error"
-            elif upload.status in ["queued", "processing"]:
-                processing_status = upload.status
-            elif upload.status == "pending":
-                processing_status = "pending"
-            else:
-                processing_status = upload.status
-
-            status_detail = {
-                "id": doc.id if doc else upload.id,  # Use document ID if available, otherwise upload ID
-                "file_path": doc.file_path if doc else "",
-                "file_name": upload.file_name,
-                "file_size": doc.file_size if doc else upload.file_size,
-                "content_type": doc.content_type if doc else upload.content_type,
-                "file_hash": doc.file_hash if doc else upload.file_hash,
-                "project_id": upload.project_id,
-                "markdown_s3_link": doc.markdown_s3_link if doc else None,
-                "created_at": doc.created_at if doc else upload.created_at,
-                "updated_at": doc.updated_at if doc else upload.updated_at,
-                "uploaded_by": upload.user_id,
-                "processing_status": processing_status,
-                "error_message": upload.error_message,
-                "upload_id": upload.id,
-            }
+        for row in rows:
+            has_doc = row.doc_id is not None
+            results.append({
+                "id": row.doc_id if has_doc else row.id,  # Use document ID if available, otherwise upload ID
+                "file_path": row.doc_file_path if has_doc else "",
+                "file_name": row.file_name,
+                "file_size": row.doc_file_size if has_doc else row.file_size,
+                "content_type": row.doc_content_type if has_doc else row.content_type,
+                "file_hash": row.doc_file_hash if has_doc else row.file_hash,
+                "project_id": row.project_id,
+                "markdown_s3_link": row.doc_markdown_s3_link if has_doc else None,
+                "created_at": row.doc_created_at if has_doc else row.created_at,
+                "updated_at": row.doc_updated_at if has_doc else row.updated_at,
+                "uploaded_by": row.user_id,
+                "processing_status": row.status, # pending, queued, processing, retrying, completed or error
+                "error_message": row.error_message,
+                "upload_id": row.id,
+            })
+        next_cursor = encode_cursor(sort, order, rows[-1].sort_value, rows[-1].id) if has_more else None
+        return results, next_cursor
 
-            results.append(status_detail)
-        return results
+    async def count_documents_with_status(
+        self,
+        project_id: int,
+        statuses: Optional[List[str]] = None,
+        content_type: Optional[str] = None,
+        name_prefix: Optional[str] = None
+    ) -> Dict[str, int]:
+        """Number of the project's uploads matching the filters, per processing status."""
+        filters = self._listing_filters(DocumentUpload, project_id, content_type, name_prefix)
+        if statuses:
+            filters.append(DocumentUpload.status.in_(statuses))
+        rows = (await self.db.execute(
+            select(DocumentUpload.status, func.count(DocumentUpload.id)).where(*filters).group_by(DocumentUpload.status)
+        )).all()
+        return {upload_status: count for upload_status, count in rows}
 
 class DocumentProcessingService: # Primarily for status checks now
-    def __init__(self, db: Session = Depends(get_db_session)):
+    def __init__(self, db: AsyncSession = Depends(get_async_db_session)):
         self.db = db
         # S3 client or other processing dependencies are now mainly in the consumer
         # QdrantService is also used by consumer
 
     async def get_processing_status(self, upload_ids: List[int]) -> Dict[int, Dict]:
         result_map: Dict[int, Dict] = {}
-        document_uploads = self.db.query(DocumentUpload).filter(
-            DocumentUpload.id.in_(upload_ids)
-        ).all()
-        
+        uploads_by_id = {
+            row.id: row for row in (await self.db.execute(
+                select(
+                    DocumentUpload.id, DocumentUpload.file_name, DocumentUpload.status,
+                    DocumentUpload.error_message, DocumentUpload.stage, DocumentUpload.document_id
+                ).where(DocumentUpload.id.in_(upload_ids))
+            )).all()
+        }
+
         for upload_id_query in upload_ids: # Iterate through requested IDs to ensure all are covered
-            doc_upload = next((du for du in document_uploads if du.id == upload_id_query), None)
+            doc_upload = uploads_by_id.get(upload_id_query)
 
             if not doc_upload:
                 result_map[upload_id_query] = {"status": "not_found", "detail": "DocumentUpload ID not found."}
@@ -263,20 +397,45 @@ class DocumentProcessingService: # Primarily for status checks now
                 "file_name": doc_upload.file_name,
                 "upload_status": doc_upload.status,
                 "upload_error": doc_upload.error_message,
+                "upload_stage": doc_upload.stage,
                 "document_id": doc_upload.document_id # ID of the processed Document record
             }
             result_map[doc_upload.id] = status_info
             
         return result_map
 
+    async def get_active_upload_statuses(self, project_id: int) -> List[Dict]:
+        """Statuses of the project's uploads still in flight; the snapshot a status stream starts from."""
+        rows = (await self.db.execute(
+            select(
+                DocumentUpload.id, DocumentUpload.file_name, DocumentUpload.status,
+                DocumentUpload.error_message, DocumentUpload.stage, DocumentUpload.document_id
+            ).where(
+                DocumentUpload.project_id == project_id,
+                DocumentUpload.status.not_in(("completed", "error"))
+            ).order_by(DocumentUpload.id)
+        )).all()
+        return [
+            {
+                "upload_id": row.id,
+                "project_id": project_id,
+                "file_name": row.file_name,
+                "upload_status": row.status,
+                "upload_error": row.error_message,
+                "upload_stage": row.stage,
+                "document_id": row.document_id
+            }
+            for row in rows
+        ]
+
 def get_document_service(
-    db: Session = Depends(get_db_session),
+    db: AsyncSession = Depends(get_async_db_session),
     rabbitmq_service: RabbitMQService = Depends(get_rabbitmq_service)
 ) -> DocumentService:
     return DocumentService(db=db, rabbitmq_service=rabbitmq_service)
 
 def get_document_processing_service(
-    db: Session = Depends(get_db_session)
+    db: AsyncSession = Depends(get_async_db_session)
 ) -> DocumentProcessingService:
     # QdrantService is not directly injected here anymore, consumer will get it.
     return DocumentProcessingService(db=db)
@@ -0,0 +1,129 @@
+import hashlib
+import logging
+import os
+from typing import Iterator, Optional
+from urllib.parse import quote, urlparse
+
+from botocore.exceptions import ClientError
+from fastapi import HTTPException, Request, status
+from fastapi.responses import FileResponse, RedirectResponse, Response, StreamingResponse
+
+from app.services.storage import Storage
+
+logger = logging.getLogger(__name__)
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag, as used for GET requests."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    bare_etag = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == bare_etag for candidate in if_none_match.split(","))
+
+
+def content_disposition(filename: str, disposition: str = "attachment") -> str:
+    return f"{disposition}; filename*=utf-8''{quote(filename)}"
+
+
+def _local_etag(path: str) -> str:
+    stat = os.stat(path)
+    return '"' + hashlib.md5(f"{stat.st_mtime}-{stat.st_size}".encode(), usedforsecurity=False).hexdigest() + '"'
+
+
+def _iter_s3_body(body) -> Iterator[bytes]:
+    try:
+        yield from body.iter_chunks(chunk_size=STREAM_CHUNK_SIZE)
+    finally:
+        body.close()
+
+
+def stored_file_response(
+    request: Request,
+    stored_path: str,
+    media_type: str,
+    filename: str,
+    storage: Optional[Storage] = None,
+    etag: Optional[str] = None,
+    presigned_url_expiry: int = 0,
+    disposition: str = "attachment"
+) -> Response:
+    """
+    Streams a stored file (s3:// link or local path) without loading it into memory.
+
+    Honours a single-range `Range` header (206 Partial Content) and `If-None-Match` (304). `etag`,
+    when the caller has a content-based one (e.g. the file hash), is used for both storage backends;
+    otherwise S3's ETag or a size/mtime ETag for local files is used. With `presigned_url_expiry` > 0,
+    S3 files are not proxied at all: the client is redirected to a presigned GET URL.
+    s3:// links are read with `storage`'s S3 client.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if etag and etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    if stored_path.startswith("s3://"):
+        s3_client = storage.client if storage is not None else None
+        if not s3_client:
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="S3 storage not properly configured")
+        parsed_url = urlparse(stored_path)
+        bucket_name, s3_key = parsed_url.netloc, parsed_url.path.lstrip("/")
+
+        if presigned_url_expiry > 0:
+            url = s3_client.generate_presigned_url(
+                "get_object",
+                Params={
+                    "Bucket": bucket_name, "Key": s3_key,
+                    "ResponseContentType": media_type,
+                    "ResponseContentDisposition": content_disposition(filename, disposition),
+                },
+                ExpiresIn=presigned_url_expiry
+            )
+            return RedirectResponse(url, status_code=status.HTTP_307_TEMPORARY_REDIRECT)
+
+        get_kwargs = {"Bucket": bucket_name, "Key": s3_key}
+        range_header = request.headers.get("range")
+        if range_header:
+            get_kwargs["Range"] = range_header # S3 parses and validates the range itself
+        if if_none_match and not etag:
+            get_kwargs["IfNoneMatch"] = if_none_match
+        try:
+            s3_object = s3_client.get_object(**get_kwargs)
+        except ClientError as e:
+            error_code = e.response.get("Error", {}).get("Code")
+            if error_code in ("304", "NotModified"):
+                return Response(status_code=status.HTTP_304_NOT_MODIFIED)
+            if error_code in ("NoSuchKey", "404"):
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found in S3 storage.")
+            if error_code == "InvalidRange":
+                raise HTTPException(status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE, detail="Requested range not satisfiable.")
+            logger.error(f"Error retrieving {stored_path} from S3: {e}", exc_info=True)
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to retrieve file from S3 storage.")
+
+        headers = {
+            "Accept-Ranges": "bytes",
+            "Content-Length": str(s3_object["ContentLength"]),
+            "ETag": etag or s3_object.get("ETag", ""),
+            "Content-Disposition": content_disposition(filename, disposition),
+        }
+        if s3_object.get("ContentRange"):
+            headers["Content-Range"] = s3_object["ContentRange"]
+        return StreamingResponse(
+            _iter_s3_body(s3_object["Body"]),
+            status_code=status.HTTP_206_PARTIAL_CONTENT if s3_object.get("ContentRange") else status.HTTP_200_OK,
+            media_type=media_type,
+            headers=headers
+        )
+
+    if not os.path.exists(stored_path):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found at the specified local path.")
+    etag = etag or _local_etag(stored_path)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    # FileResponse sends the file with sendfile where available and answers Range requests itself
+    return FileResponse(
+        stored_path, media_type=media_type, filename=filename,
+        content_disposition_type=disposition, headers={"ETag": etag}
+    )
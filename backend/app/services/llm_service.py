@@ -1,12 +1,16 @@
 import json
 import logging
 import re
+import time
 from typing import Dict, Any, List, Optional, Tuple, AsyncIterator, Union
 
 from openai import AsyncOpenAI # Direct import
 from openai.types.chat import ChatCompletionChunk # For type hinting
 
 from app.config.config import Config, getConfig
+from app.core.metrics import LLM_DURATION_SECONDS, LLM_TIME_TO_FIRST_TOKEN_SECONDS, observe_llm_usage, timed_completion
+from app.core.tracing import record_stage, stage_span, start_span
+from opentelemetry.context import Context
 from app.llm_providers.llm_factory import LLMFactory
 from app.llm_providers.utils import extract_json_from_response
 from fastapi import Depends
@@ -24,7 +28,9 @@ class LLMService:
         model_name: Optional[str] = None, # Model override
         temperature: Optional[float] = None,
         max_tokens: Optional[int] = None,
-        response_format: Optional[Dict[str, str]] = None # e.g. {"type": "json_object"}
+        response_format: Optional[Dict[str, str]] = None, # e.g. {"type": "json_object"}
+        call_type: str = "answer", # Label of the LLM metrics, see app.core.metrics
+        trace_context: Optional[Context] = None # Parent of the stream's span; a generator cannot use the current span
     ) -> AsyncIterator[Union[str, Dict[str, Any]]]:
         """
         Gets a streaming chat completion from OpenAI or Gemini (via OpenAI SDK).
@@ -35,6 +41,11 @@ class LLMService:
         collected_usage_data = {
             "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0
         }
+        current_model_name = model_name or ""
+        started, started_ns = time.perf_counter(), time.time_ns()
+        first_token_at = finished_at = None
+        outcome = "cancelled" # Until the stream ends; stays so if the consumer of the stream stops early
+        span = start_span(f"llm.{call_type}", parent=trace_context, start_time=started_ns, **{"llm.provider": selected_provider})
 
         try:
             # LLMFactory now returns AsyncOpenAI client directly for supported providers
@@ -67,6 +78,11 @@ class LLMService:
             async for chunk in response_stream:
                 if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
                     delta_content = chunk.choices[0].delta.content
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                        LLM_TIME_TO_FIRST_TOKEN_SECONDS.labels(call_type, current_model_name).observe(first_token_at - started)
+                        span.add_event("first_token")
+                        record_stage(f"llm.{call_type}.ttft", (first_token_at - started) * 1000)
                     full_response_text_parts.append(delta_content)
                     yield delta_content
                 
@@ -78,6 +94,7 @@ class LLMService:
                     # So, we don't expect more content deltas after this.
 
             final_full_content = "".join(full_response_text_parts)
+            outcome, finished_at = "ok", time.perf_counter()
             logger.info(f"Stream finished for {selected_provider}. Full content length: {len(final_full_content)}. Usage: {collected_usage_data}")
             yield {
                 "type": "final_data",
@@ -86,6 +103,7 @@ class LLMService:
             }
 
         except Exception as e:
+            outcome, finished_at = "error", time.perf_counter()
             logger.error(f"Error in get_chat_completion_stream from {selected_provider}: {e}", exc_info=True)
             yield {
                 "type": "error",
@@ -93,6 +111,18 @@ class LLMService:
                 "full_content": "".join(full_response_text_parts) + f"\n[ERROR: Stream interrupted: {str(e)}]",
                 "usage": collected_usage_data # Partial usage if any was collected
             }
+        finally:
+            # Runs when the generator is closed, possibly well after the last yield
+            duration = (finished_at or time.perf_counter()) - started
+            LLM_DURATION_SECONDS.labels(call_type, current_model_name, outcome).observe(duration)
+            observe_llm_usage(call_type, current_model_name, collected_usage_data)
+            record_stage(f"llm.{call_type}", duration * 1000)
+            span.set_attributes({
+                "llm.model": current_model_name, "llm.outcome": outcome,
+                "llm.usage.prompt_tokens": collected_usage_data["prompt_tokens"],
+                "llm.usage.completion_tokens": collected_usage_data["completion_tokens"]
+            })
+            span.end(end_time=started_ns + int(duration * 1e9)) # When the stream ended, not when it was closed
 
     async def decide_rag_necessity(self, history: List[Dict[str, str]], user_question: str) -> Optional[Dict[str, Any]]:
         """
@@ -124,7 +154,8 @@ class LLMService:
                 "response_format": response_format_json # For OpenAI/Gemini
             }
 
-            completion = await client.chat.completions.create(**completion_kwargs)
+            with stage_span("llm.decision", **{"llm.provider": selected_provider, "llm.model": resolved_model_name}):
+                completion = await timed_completion(client, "decision", **completion_kwargs)
             content = completion.choices[0].message.content
             
             if content:
@@ -174,7 +205,8 @@ class LLMService:
                 # "stream": False
             }
 
-            completion = await client.chat.completions.create(**completion_kwargs)
+            with stage_span("llm.enrichment", **{"llm.provider": selected_provider, "llm.model": resolved_model_name}):
+                completion = await timed_completion(client, "enrichment", **completion_kwargs)
             enriched_query = completion.choices[0].message.content
             
             if enriched_query and enriched_query.strip():
@@ -0,0 +1,202 @@
+import hashlib
+import logging
+import re
+from importlib import metadata
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.consumers.retry_policy import TRANSIENT_LLM_ERRORS
+from app.core.metrics import timed_completion
+from app.core.tracing import stage_span
+from app.models.models import Document, MarkdownPieceCache
+from app.services.storage import Storage
+from app.llm_providers.utils import clean_markdown_response
+
+logger = logging.getLogger(__name__)
+
+# Bump when the conversion pipeline changes its output (splitting, cleaning, joining pieces),
+# so conversions cached by an older pipeline are not reused.
+PIPELINE_VERSION = "4"
+
+
+def _markitdown_version() -> str:
+    try:
+        return metadata.version("markitdown")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+CONVERTER_VERSION = f"{PIPELINE_VERSION}/markitdown-{_markitdown_version()}"
+
+
+def _sha256(*parts: str) -> str:
+    hasher = hashlib.sha256()
+    for part in parts:
+        hasher.update(part.encode("utf-8"))
+        hasher.update(b"\0") # Separator so ("ab", "c") and ("a", "bc") differ
+    return hasher.hexdigest()
+
+
+def conversion_cache_key(file_hash: str, prompt: str, model: str, refinement_policy: str = "") -> str:
+    """
+    Key of a whole-file conversion: the same bytes, converter version, prompt, model and
+    refinement policy give the same Markdown.
+    """
+    return _sha256(file_hash, CONVERTER_VERSION, _sha256(prompt), model, refinement_policy)
+
+
+def piece_cache_key(piece: str, prompt: str, model: str) -> str:
+    """Key of a single LLM-refined piece, independent of which file (or project) it came from."""
+    return _sha256(_sha256(piece), CONVERTER_VERSION, _sha256(prompt), model)
+
+
+def split_by_sentence(text, max_words=2000):
+    # Split text into sentences (basic rule-based approach)
+    sentences = re.findall(r'[^.!?]+[.!?]?', text.strip())
+
+    chunks = []
+    current_chunk = []
+    current_word_count = 0
+
+    for sentence in sentences:
+        sentence = sentence.strip()
+        if not sentence: # Skip empty sentences
+            continue
+        word_count = len(sentence.split())
+
+        if current_word_count + word_count > max_words and current_chunk: # Ensure current_chunk is not empty before appending
+            chunks.append(' '.join(current_chunk))
+            current_chunk = [sentence]
+            current_word_count = word_count
+        elif current_word_count + word_count <= max_words: # Only add if it fits
+            current_chunk.append(sentence)
+            current_word_count += word_count
+        else: # Sentence itself is too long, add it as its own chunk
+            if current_chunk: # Append previous chunk first
+                 chunks.append(' '.join(current_chunk))
+            chunks.append(sentence)
+            current_chunk = []
+            current_word_count = 0
+
+
+    if current_chunk:
+        chunks.append(' '.join(current_chunk))
+
+    return chunks
+
+
+def find_cached_markdown_link(db: Session, file_hash: str, conversion_key: str) -> Optional[str]:
+    """Returns the stored Markdown of any document (in any project) converted from the same file with the same key."""
+    row = db.query(Document.markdown_s3_link).filter(
+        Document.file_hash == file_hash,
+        Document.conversion_key == conversion_key,
+        Document.markdown_s3_link.isnot(None)
+    ).order_by(Document.id.desc()).first()
+    return row.markdown_s3_link if row else None
+
+
+def read_stored_markdown(storage: Storage, markdown_link: str) -> str:
+    """Reads Markdown saved by the consumer, from an s3:// link or a local path (see app.services.storage)."""
+    return storage.read_bytes(markdown_link).decode('utf-8')
+
+
+def _cache_piece(db: Session, piece_key: str, markdown: str, model: str) -> None:
+    # Committed right away so a job that fails later still keeps the pieces it paid for
+    try:
+        db.add(MarkdownPieceCache(piece_key=piece_key, markdown=markdown, model=model))
+        db.commit()
+    except IntegrityError:
+        db.rollback() # Another consumer cached the same piece first
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Could not cache converted piece {piece_key}: {e}")
+
+
+async def refine_markdown_with_llm(
+    db: Session,
+    content: str,
+    client,
+    model: str,
+    prompt: str,
+    file_name: str
+) -> Tuple[str, bool]:
+    """
+    Converts/refines `content` to Markdown with the LLM, one split_by_sentence piece at a time.
+
+    Pieces already converted with the same prompt, model and converter version (by any job) are
+    taken from the piece cache; newly converted pieces are added to it as they complete.
+    Returns the joined Markdown and whether every piece was converted. Failed pieces are skipped,
+    so an incomplete result must not be cached as a whole-file conversion. Transient API errors
+    (rate limits, timeouts, lost connections) are raised instead: the message is retried later and
+    resumes from the cached pieces.
+    """
+    pieces = [piece for piece in split_by_sentence(content) if piece.strip()]
+    piece_keys = [piece_cache_key(piece, prompt, model) for piece in pieces]
+    cached: Dict[str, str] = {}
+    if piece_keys:
+        cached = dict(db.query(MarkdownPieceCache.piece_key, MarkdownPieceCache.markdown).filter(
+            MarkdownPieceCache.piece_key.in_(set(piece_keys))
+        ).all())
+    if cached:
+        logger.info(f"Reusing {len(cached)} of {len(pieces)} converted pieces from cache for {file_name}.")
+
+    processed_pieces: List[str] = []
+    complete = True
+    for piece_index, (piece, piece_key) in enumerate(zip(pieces, piece_keys)):
+        if piece_key in cached:
+            processed_pieces.append(cached[piece_key])
+            continue
+
+        logger.info(f"Processing chunk {piece_index + 1}/{len(pieces)} for {file_name}")
+        completion_kwargs = {
+            "messages": [
+                {"role": "user", "content": piece},
+                {"role": "developer", "content": prompt}
+            ],
+            "temperature": 0.5,
+            "model": model,
+        }
+        try:
+            with stage_span("llm.markdown", **{"llm.model": model, "markdown.piece": piece_index}):
+                response = await timed_completion(client, "markdown", **completion_kwargs)
+            if response and response.choices and response.choices[0].message and response.choices[0].message.content:
+                cleaned_content = clean_markdown_response(response.choices[0].message.content)
+                processed_pieces.append(cleaned_content)
+                cached[piece_key] = cleaned_content
+                _cache_piece(db, piece_key, cleaned_content, model)
+                logger.info(f"LLM successfully processed chunk {piece_index + 1} for {file_name}.")
+            else:
+                complete = False
+                logger.warning(f"LLM failed to process chunk {piece_index + 1} for {file_name} or returned empty. Skipping this chunk.")
+        except TRANSIENT_LLM_ERRORS:
+            raise
+        except Exception as e_llm_chunk:
+            complete = False
+            logger.error(f"Error processing chunk {piece_index + 1} with LLM for {file_name}: {e_llm_chunk}")
+
+    return "\n\n".join(processed_pieces), complete
+
+
+async def refine_sections_with_llm(
+    db: Session,
+    sections: List[str],
+    refine_indices: List[int],
+    client,
+    model: str,
+    prompt: str,
+    file_name: str
+) -> Tuple[str, bool]:
+    """
+    Refines only the sections at `refine_indices` with refine_markdown_with_llm and splices the
+    results back in order. A section the LLM could not convert at all keeps its MarkItDown text.
+    """
+    refined_sections = list(sections)
+    complete = True
+    for index in refine_indices:
+        refined, section_complete = await refine_markdown_with_llm(db, sections[index], client, model, prompt, file_name)
+        complete = complete and section_complete
+        if refined:
+            refined_sections[index] = refined.rstrip("\n") + "\n\n"
+    return "".join(refined_sections), complete
@@ -0,0 +1,70 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Any, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Select, tuple_
+
+SORT_ORDERS = ("asc", "desc")
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+def _encode_value(value: Any) -> Any:
+    return {"dt": value.isoformat()} if isinstance(value, datetime) else value
+
+
+def _decode_value(value: Any) -> Any:
+    return datetime.fromisoformat(value["dt"]) if isinstance(value, dict) else value
+
+
+def encode_cursor(sort: str, order: str, value: Any, row_id: int) -> str:
+    """Opaque cursor pointing just after the row with sort key `value` and primary key `row_id`."""
+    payload = json.dumps([sort, order, _encode_value(value), row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str, order: str) -> Tuple[Any, int]:
+    """
+    Returns the (sort value, id) a cursor points after. Raises InvalidCursorError if it is malformed
+    or was issued for another sort or order, as its position would be meaningless for this one.
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        cursor_sort, cursor_order, value, row_id = payload
+        value = _decode_value(value)
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise InvalidCursorError("Malformed pagination cursor")
+    if (cursor_sort, cursor_order) != (sort, order) or not isinstance(row_id, int):
+        raise InvalidCursorError(f"Cursor was not issued for sort={sort} order={order}")
+    return value, row_id
+
+
+def keyset_page(
+    query: Select, sort_column, id_column, order: str, cursor: Optional[Tuple[Any, int]], limit: Optional[int]
+) -> Select:
+    """
+    Orders `query` by (sort_column, id_column) and restricts it to the `limit + 1` rows after `cursor`;
+    the extra row only tells whether there is a next page (see split_page). Unlike OFFSET, the cost of
+    a page does not grow with its depth when an index on (..., sort_column, id) exists.
+    A `limit` of None returns every row after `cursor`.
+    """
+    descending = order == "desc"
+    if cursor is not None:
+        position = tuple_(sort_column, id_column)
+        query = query.where(position < tuple_(*cursor) if descending else position > tuple_(*cursor))
+    if descending:
+        query = query.order_by(sort_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(sort_column.asc(), id_column.asc())
+    return query.limit(limit + 1) if limit is not None else query
+
+
+def split_page(rows: Sequence, limit: Optional[int]) -> Tuple[List, bool]:
+    """Rows of the page and whether more follow, from the result of a keyset_page query."""
+    if limit is None:
+        return list(rows), False
+    return list(rows[:limit]), len(rows) > limit
@@ -0,0 +1,72 @@
+import asyncio
+import io
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PDF_CONTENT_TYPE = "application/pdf"
+
+
+def count_pdf_pages(path: str) -> int:
+    from pdfminer.pdfpage import PDFPage # Only walks the page tree; no content is parsed
+    with open(path, "rb") as f:
+        return sum(1 for _ in PDFPage.get_pages(f))
+
+
+def extract_page_range(path: str, first_page: int, last_page: int) -> List[Tuple[int, str]]:
+    """
+    Extracts the text of pages [first_page, last_page) (0-based) as (1-based page number, text) pairs.
+    Uses the same pdfminer text conversion (default LAParams) that MarkItDown applies to a whole PDF.
+    Runs in a worker process.
+    """
+    from pdfminer.converter import TextConverter
+    from pdfminer.layout import LAParams
+    from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+    from pdfminer.pdfpage import PDFPage
+
+    resource_manager = PDFResourceManager()
+    output = io.StringIO()
+    pages = []
+    with open(path, "rb") as f, TextConverter(resource_manager, output, laparams=LAParams()) as device:
+        interpreter = PDFPageInterpreter(resource_manager, device)
+        page_numbers = range(first_page, last_page)
+        for page_number, page in zip(page_numbers, PDFPage.get_pages(f, pagenos=set(page_numbers))):
+            interpreter.process_page(page)
+            pages.append((page_number + 1, output.getvalue().replace("\x0c", ""))) # Drop the form feed ending each page
+            output.seek(0)
+            output.truncate(0)
+    return pages
+
+
+async def iter_pdf_pages(
+    path: str,
+    max_workers: Optional[int] = None,
+    pages_per_range: int = 8
+) -> AsyncIterator[Tuple[int, str]]:
+    """
+    Converts a PDF to text page by page across a process pool, yielding (page number, text) in page order.
+
+    The document is split into ranges of `pages_per_range` pages, all submitted up front; each
+    range's pages are yielded as soon as it and the ranges before it are done, so the caller
+    can refine early pages while later ones are still being extracted.
+    """
+    page_count = count_pdf_pages(path)
+    if page_count == 0:
+        return
+    ranges = [(start, min(start + pages_per_range, page_count)) for start in range(0, page_count, pages_per_range)]
+    workers = min(max_workers or os.cpu_count() or 1, len(ranges))
+    logger.info(f"Extracting {page_count} PDF pages in {len(ranges)} ranges with {workers} processes.")
+
+    loop = asyncio.get_running_loop()
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        futures = [loop.run_in_executor(executor, extract_page_range, path, start, end) for start, end in ranges]
+        for future in futures:
+            for page in await future:
+                yield page
+    finally:
+        # Stop unstarted ranges if the consumer gives up early (error, cancellation)
+        executor.shutdown(wait=False, cancel_futures=True)
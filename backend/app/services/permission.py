@@ -1,35 +1,164 @@
 from functools import wraps
-from typing import List, Optional
+from itertools import chain
+from typing import Dict, FrozenSet, Iterable, List, Optional
 import inspect
+import threading
+import time
+from collections import OrderedDict
 
 from fastapi import Depends, HTTPException, status
+from sqlalchemy import event, inspect as sa_inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
+from app.config.config import getConfig
+from app.core.principal_cache import Principal
 from app.models.models import Permission, ProjectPermission, User
-from db.database import get_db_session
+from db.database import AsyncSessionLocal, get_async_db_session
 from typing import Union
 
+ADMIN_PERMISSION = "admin" # Grants every permission of its project
+
+
+class ScopeSet:
+    """A user's permissions indexed by project, so any number of required permissions is one set intersection."""
+
+    def __init__(self, by_project: Optional[Dict[int, FrozenSet[str]]] = None):
+        self.by_project = by_project or {}
+
+    @classmethod
+    def from_scopes(cls, scopes: Iterable[str]) -> "ScopeSet":
+        """Builds the set from "<project_id>:<permission>" scopes, as embedded in access tokens."""
+        by_project: Dict[int, set] = {}
+        for scope in scopes:
+            project_id, _, permission_name = scope.partition(":")
+            by_project.setdefault(int(project_id), set()).add(permission_name)
+        return cls({project_id: frozenset(names) for project_id, names in by_project.items()})
+
+    def permissions(self, project_id: int) -> FrozenSet[str]:
+        return self.by_project.get(int(project_id), frozenset())
+
+    def allows(self, project_id: int, required_permissions: FrozenSet[str]) -> bool:
+        """True if the user has any of `required_permissions` (or admin) on the project."""
+        granted = self.permissions(project_id)
+        return ADMIN_PERMISSION in granted or not granted.isdisjoint(required_permissions)
+
+    def __contains__(self, scope: str) -> bool:
+        project_id, _, permission_name = scope.partition(":")
+        return permission_name in self.permissions(int(project_id))
+
+
+class PermissionEngine:
+    """
+    Process-wide cache of ScopeSets by user, invalidated by version.
+
+    Every committed ProjectPermission change bumps the version of the users it touched (bulk
+    statements bump all users, see the session hooks below), so a ScopeSet stored or captured under
+    an older version is reloaded. Changes committed by other processes are picked up within the TTL.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl_seconds: float = 60, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self._global_version = 0
+        self._user_versions: Dict[int, int] = {}
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def version(self, user_id: int) -> int:
+        # Both counters only grow, so any bump changes the sum
+        return self._global_version + self._user_versions.get(user_id, 0)
+
+    def bump(self, user_ids: Optional[Iterable[int]] = None) -> None:
+        """Invalidates the given users' scopes, or everyone's when `user_ids` is None."""
+        with self._lock:
+            if user_ids is None:
+                self._global_version += 1
+                self._entries.clear()
+                return
+            for user_id in user_ids:
+                self._user_versions[user_id] = self._user_versions.get(user_id, 0) + 1
+                self._entries.pop(user_id, None)
+
+    async def scope_set(self, db: AsyncSession, user_id: int) -> ScopeSet:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                version, expires_at, scopes = entry
+                if version == self.version(user_id) and expires_at > self.clock():
+                    self._entries.move_to_end(user_id)
+                    return scopes
+        # Captured before loading: a bump during the query leaves the entry outdated rather than wrong
+        version = self.version(user_id)
+        scopes = ScopeSet.from_scopes(await PermissionService(db).getUserScopes(user_id))
+        if self.max_size > 0 and self.ttl_seconds > 0:
+            with self._lock:
+                self._entries[user_id] = (version, self.clock() + self.ttl_seconds, scopes)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return scopes
+
+
+permission_engine = PermissionEngine(
+    max_size=getConfig().PRINCIPAL_CACHE_MAX_SIZE,
+    ttl_seconds=getConfig().PRINCIPAL_CACHE_TTL_SECONDS
+)
+
+_PENDING_PERMISSION_CHANGES = "pending_permission_changes"
+_ALL_USERS = None
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_permission_changes(session, flush_context):
+    changed = session.info.setdefault(_PENDING_PERMISSION_CHANGES, set())
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, ProjectPermission):
+            changed.add(obj.user_id)
+            changed.update(sa_inspect(obj).attrs.user_id.history.deleted or ())
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_bulk_permission_changes(orm_execute_state):
+    # query(ProjectPermission).filter(...).delete() and friends bypass the flush; the users they touch are unknown
+    if (orm_execute_state.is_delete or orm_execute_state.is_update or orm_execute_state.is_insert) \
+            and orm_execute_state.bind_mapper is not None and orm_execute_state.bind_mapper.class_ is ProjectPermission:
+        orm_execute_state.session.info.setdefault(_PENDING_PERMISSION_CHANGES, set()).add(_ALL_USERS)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_permission_changes(session):
+    # Bumped only once committed, so no concurrent request can cache the pre-commit state under the new version
+    changed = session.info.pop(_PENDING_PERMISSION_CHANGES, None)
+    if changed:
+        permission_engine.bump(None if _ALL_USERS in changed else changed)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_permission_changes(session):
+    session.info.pop(_PENDING_PERMISSION_CHANGES, None)
+
 
 class PermissionService:
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         self.db = db
 
-    def getUserScopes(self, user_id: int = None):
+    async def getUserScopes(self, user_id: int = None):
         # This function creates a scope for the permission check
         # You can customize this function to create the scope you need
 
-        permissions = self.db.query(
-            ProjectPermission.project_id,
-            ProjectPermission.user_id,
-            Permission.name.label('permission_name'),
-            Permission.description,
-            Permission.is_system_level
-        ).join(
-            Permission, 
-            ProjectPermission.permission_id == Permission.id
-        ).filter(
-            ProjectPermission.user_id == user_id
-        ).all()
+        permissions = (await self.db.execute(
+            select(
+                ProjectPermission.project_id,
+                Permission.name.label('permission_name')
+            ).join(
+                Permission, 
+                ProjectPermission.permission_id == Permission.id
+            ).where(
+                ProjectPermission.user_id == user_id
+            )
+        )).all()
 
         scopes = []
 
@@ -38,7 +167,7 @@ class PermissionService:
 
         return scopes
     
-    def check_permission(self, user_id: int, project_id: int, required_permission: str) -> bool:
+    async def check_permission(self, user_id: int, project_id: int, required_permission: str) -> bool:
         """
         Check if a user has a specific permission for a project
         
@@ -50,59 +179,65 @@ class PermissionService:
         Returns:
             bool: True if user has permission, False otherwise
         """
-        # Get user scopes
-        scopes = self.getUserScopes(user_id)
-        
-        # Check if the required scope exists
-        required_scope = f"{project_id}:{required_permission}"
-        
-        # Also check for admin permission which grants all permissions
-        admin_scope = f"{project_id}:admin"
-        
-        return required_scope in scopes or admin_scope in scopes
+        # Admin permission grants all permissions
+        return await self.has_any_permission(user_id, project_id, [required_permission])
+
+    async def get_scope_set(self, user_id: int) -> ScopeSet:
+        """The user's permissions per project, from the permission engine's cache."""
+        return await permission_engine.scope_set(self.db, user_id)
+
+    async def has_any_permission(self, user_id: int, project_id: int, required_permissions: Iterable[str]) -> bool:
+        """Checks several alternative permissions with one (cached) scope lookup."""
+        return (await self.get_scope_set(user_id)).allows(project_id, frozenset(required_permissions))
     
-    def check_is_superuser(self, user_id: int) -> bool:
+    async def check_is_superuser(self, user_id: int) -> bool:
         """Check if a user is a superuser"""
-        user = self.db.query(User).filter(User.id == user_id).first()
-        return user is not None and user.is_superuser
+        is_superuser = await self.db.scalar(select(User.is_superuser).where(User.id == user_id))
+        return bool(is_superuser)
 
 
-def getPermissionService(db: Session = Depends(get_db_session)):
+def getPermissionService(db: AsyncSession = Depends(get_async_db_session)):
     return PermissionService(db)
 
 
+def _principal_scopes(current_user) -> Optional[ScopeSet]:
+    """The scopes resolved with the authenticated principal, unless its permissions changed since."""
+    if isinstance(current_user, Principal) and current_user.permission_version == permission_engine.version(current_user.id):
+        return current_user.scopes
+    return None
+
+
 def require_permission(permission_name: Union[str, list[str]], project_id_param: str = "project_id"):
     """
     Decorator to check if a user has one of the required permissions for a project.
+
+    The user's scopes are resolved once per request: from the authenticated principal, else from the
+    permission engine's cache, else with a single query on the endpoint's own session.
     
     Args:
         permission_name: A permission name or list of permission names (e.g., 'add_document' or ['add', 'edit'])
         project_id_param: The parameter name that contains the project ID in the endpoint
     """
+    required_permissions = frozenset(permission_name if isinstance(permission_name, list) else [permission_name])
+
     def decorator(func):
+        param_names = list(inspect.signature(func).parameters.keys())
+
         @wraps(func)
         async def wrapper(*args, **kwargs):
-            # Get database and service
-            db = next(get_db_session())
-            permission_service = PermissionService(db)
-
             # Extract project_id
             project_id = kwargs.get(project_id_param)
-            if project_id is None:
-                sig = inspect.signature(func)
-                param_names = list(sig.parameters.keys())
-                if project_id_param in param_names and len(args) > param_names.index(project_id_param):
-                    project_id = args[param_names.index(project_id_param)]
+            if project_id is None and project_id_param in param_names and len(args) > param_names.index(project_id_param):
+                project_id = args[param_names.index(project_id_param)]
 
             # Extract current_user
             current_user = kwargs.get("current_user")
             if current_user is None:
                 for arg in args:
-                    if isinstance(arg, User):
+                    if isinstance(arg, (User, Principal)):
                         current_user = arg
                         break
-                if current_user is None and "current_user" in inspect.signature(func).parameters:
-                    param_names = list(sig.parameters.keys())
+                if current_user is None and "current_user" in param_names:
                     current_user_index = param_names.index("current_user")
                     if len(args) > current_user_index:
                         current_user = args[current_user_index]
@@ -115,16 +250,19 @@ def require_permission(permission_name: Union[str, list[str]], project_id_param:
             if current_user.is_superuser:
                 return await func(*args, **kwargs)
 
-            # Convert to list if single string
-            required_permissions = permission_name if isinstance(permission_name, list) else [permission_name]
+            scopes = _principal_scopes(current_user)
+            if scopes is None:
+                db = kwargs.get("db")
+                if isinstance(db, AsyncSession):
+                    scopes = await permission_engine.scope_set(db, current_user.id)
+                else:
+                    async with AsyncSessionLocal() as db:
+                        scopes = await permission_engine.scope_set(db, current_user.id)
 
-            if not any(
-                permission_service.check_permission(current_user.id, project_id, perm)
-                for perm in required_permissions
-            ):
+            if not scopes.allows(project_id, required_permissions):
                 raise HTTPException(
                     status_code=status.HTTP_403_FORBIDDEN,
-                    detail=f"User lacks required permissions: {required_permissions}"
+                    detail=f"User lacks required permissions: {sorted(required_permissions)}"
                 )
 
             return await func(*args, **kwargs)
@@ -6,6 +6,8 @@ from sentence_transformers import SentenceTransformer
 from fastapi import Depends
 
 from app.config.config import Config, getConfig
+from app.core.metrics import EMBEDDING_BATCH_SIZE, EMBEDDING_SECONDS, QDRANT_SECONDS
+from app.core.tracing import stage_span
 
 logger = logging.getLogger(__name__)
 
@@ -79,7 +81,9 @@ class QdrantService:
             raise RuntimeError("Embedding model not available")
         
         logger.info(f"Generating embeddings for {len(texts)} texts.")
-        embeddings = self.embedding_model.encode(texts, show_progress_bar=False)
+        EMBEDDING_BATCH_SIZE.observe(len(texts))
+        with EMBEDDING_SECONDS.time(), stage_span("embedding", **{"embedding.batch_size": len(texts)}):
+            embeddings = self.embedding_model.encode(texts, show_progress_bar=False)
         logger.info(f"Embeddings generated successfully.")
         return embeddings.tolist()
 
@@ -96,12 +100,76 @@ class QdrantService:
         logger.info(f"Upserting {len(points)} points to collection '{collection_name}'.")
         try:
             # Consider batching if len(points) is very large
-            self.client.upsert(collection_name=collection_name, points=points, wait=True)
+            with QDRANT_SECONDS.labels("upsert").time(), stage_span("qdrant.upsert", **{"qdrant.points": len(points)}):
+                self.client.upsert(collection_name=collection_name, points=points, wait=True)
             logger.info(f"Successfully upserted {len(points)} points.")
         except Exception as e:
             logger.error(f"Error upserting points to Qdrant collection '{collection_name}': {e}")
             raise
 
+    def set_payloads(self, payloads: Dict[str, Dict[str, Any]]):
+        """Replaces the payload of existing points (point id -> payload) without touching their vectors."""
+        if not self.client:
+            logger.error("Qdrant client not initialized. Cannot update payloads.")
+            raise RuntimeError("Qdrant client not available")
+        if not payloads:
+            return
+
+        collection_name = self.settings.QDRANT_COLLECTION_NAME
+        operations = [
+            models.OverwritePayloadOperation(overwrite_payload=models.SetPayload(payload=payload, points=[point_id]))
+            for point_id, payload in payloads.items()
+        ]
+        try:
+            with QDRANT_SECONDS.labels("set_payload").time():
+                self.client.batch_update_points(collection_name=collection_name, update_operations=operations, wait=True)
+            logger.info(f"Updated payloads of {len(operations)} points.")
+        except Exception as e:
+            logger.error(f"Error updating payloads in Qdrant collection '{collection_name}': {e}")
+            raise
+
+    def delete_points(self, point_ids: List[str]):
+        if not self.client:
+            logger.error("Qdrant client not initialized. Cannot delete points.")
+            raise RuntimeError("Qdrant client not available")
+        if not point_ids:
+            return
+
+        collection_name = self.settings.QDRANT_COLLECTION_NAME
+        try:
+            with QDRANT_SECONDS.labels("delete").time():
+                self.client.delete(
+                    collection_name=collection_name,
+                    points_selector=models.PointIdsList(points=point_ids),
+                    wait=True
+                )
+            logger.info(f"Deleted {len(point_ids)} points from collection '{collection_name}'.")
+        except Exception as e:
+            logger.error(f"Error deleting points from Qdrant collection '{collection_name}': {e}")
+            raise
+
+    def delete_document_points(self, document_id: int):
+        """Deletes every point whose payload still belongs to the document (e.g. a replaced version)."""
+        if not self.client:
+            logger.error("Qdrant client not initialized. Cannot delete points.")
+            raise RuntimeError("Qdrant client not available")
+
+        collection_name = self.settings.QDRANT_COLLECTION_NAME
+        points_filter = models.Filter(
+            must=[models.FieldCondition(key="document_id", match=models.MatchValue(value=document_id))]
+        )
+        try:
+            with QDRANT_SECONDS.labels("delete").time():
+                self.client.delete(
+                    collection_name=collection_name,
+                    points_selector=models.FilterSelector(filter=points_filter),
+                    wait=True
+                )
+            logger.info(f"Deleted points of document {document_id}.")
+        except Exception as e:
+            logger.error(f"Error deleting points from Qdrant collection '{collection_name}': {e}")
+            raise
+
     def search_chunks(
         self,
         query_text: str,
@@ -130,13 +198,14 @@ class QdrantService:
             logger.info(f"Applying filter for project_id: {project_id}")
 
         try:
-            search_results = self.client.search(
-                collection_name=collection_name,
-                query_vector=query_embedding,
-                query_filter=search_filter,
-                limit=limit,
-                with_payload=True # Ensure payload is returned
-            )
+            with QDRANT_SECONDS.labels("search").time(), stage_span("qdrant.search", **{"qdrant.limit": limit}):
+                search_results = self.client.search(
+                    collection_name=collection_name,
+                    query_vector=query_embedding,
+                    query_filter=search_filter,
+                    limit=limit,
+                    with_payload=True # Ensure payload is returned
+                )
             logger.info(f"Found {len(search_results)} results.")
             return search_results
         except Exception as e:
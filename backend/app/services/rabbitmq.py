@@ -1,11 +1,27 @@
 import json
+import threading
 import pika
-from typing import Dict, Any, Optional
+import pika.exceptions
+from collections import Counter
+from functools import wraps
+from typing import Dict, Any, List, Optional
 from app.config.config import getConfig
+from app.core.tracing import inject_trace_headers, stage_span, start_span
 import logging
 
 logger = logging.getLogger(__name__)
 
+def _serialized(method):
+    """
+    Runs a method under the service's lock. A pika BlockingConnection is not thread-safe, and the API
+    publishes from worker threads (to keep the wait for confirms off the event loop), so they take turns.
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
 class RabbitMQService:
     """Service for interacting with RabbitMQ message queues."""
     
@@ -14,6 +30,8 @@ class RabbitMQService:
         self.config = getConfig()
         self.connection = None
         self.channel = None
+        self.confirm_channel = None # Opened on first publish_messages call
+        self._lock = threading.Lock()
         self._initialize_connection()
     
     def _initialize_connection(self):
@@ -45,7 +63,9 @@ class RabbitMQService:
             logger.error(f"Failed to connect to RabbitMQ: {str(e)}")
             self.connection = None
             self.channel = None
+        self.confirm_channel = None
     
+    @_serialized
     def publish_message(self, queue_name: str, message: Dict[str, Any], 
                         correlation_id: Optional[str] = None) -> bool:
         """
@@ -70,20 +90,22 @@ class RabbitMQService:
             # Convert message to JSON
             message_body = json.dumps(message).encode('utf-8')
             
-            # Set up message properties
-            properties = pika.BasicProperties(
-                delivery_mode=2,  # Persistent message
-                content_type='application/json',
-                correlation_id=correlation_id
-            )
-            
-            # Publish message
-            self.channel.basic_publish(
-                exchange='',
-                routing_key=queue_name,
-                body=message_body,
-                properties=properties
-            )
+            with stage_span("rabbitmq.publish", **{"messaging.destination.name": queue_name}):
+                # Set up message properties; the trace context lets the consumer continue this trace
+                properties = pika.BasicProperties(
+                    delivery_mode=2,  # Persistent message
+                    content_type='application/json',
+                    correlation_id=correlation_id,
+                    headers=inject_trace_headers({})
+                )
+
+                # Publish message
+                self.channel.basic_publish(
+                    exchange='',
+                    routing_key=queue_name,
+                    body=message_body,
+                    properties=properties
+                )
             
             logger.info(f"Published message to queue: {queue_name}")
             return True
@@ -91,12 +113,172 @@ class RabbitMQService:
             logger.error(f"Failed to publish message: {str(e)}")
             return False
     
+    @_serialized
+    def publish_messages(self, queue_name: str, messages: List[Dict[str, Any]]) -> List[bool]:
+        """
+        Publish a batch of messages on a channel with publisher confirms.
+
+        Each message is reported as published only once the broker has confirmed it (persisted
+        to the durable queue); unroutable or nacked messages are reported as failed.
+
+        Returns:
+            List[bool]: One entry per message, in order
+        """
+        if not messages:
+            return []
+        if not self.connection or self.connection.is_closed:
+            self._initialize_connection()
+        if not self.connection:
+            logger.error("No RabbitMQ connection available")
+            return [False] * len(messages)
+
+        try:
+            if not self.confirm_channel or self.confirm_channel.is_closed:
+                self.confirm_channel = self.connection.channel()
+                self.confirm_channel.confirm_delivery()
+        except Exception as e:
+            logger.error(f"Failed to open RabbitMQ confirm channel: {str(e)}")
+            self.confirm_channel = None
+            return [False] * len(messages)
+
+        # One span for the batch; every message carries its trace context so the consumer continues the trace
+        span = start_span("rabbitmq.publish", **{"messaging.destination.name": queue_name, "messaging.batch.message_count": len(messages)})
+        properties = pika.BasicProperties(delivery_mode=2, content_type='application/json', headers=inject_trace_headers({}, span))
+        results = []
+        for message in messages:
+            try:
+                self.confirm_channel.basic_publish(
+                    exchange='',
+                    routing_key=queue_name,
+                    body=json.dumps(message).encode('utf-8'),
+                    properties=properties,
+                    mandatory=True # Unroutable messages are returned instead of silently dropped
+                )
+                results.append(True)
+            except (pika.exceptions.UnroutableError, pika.exceptions.NackError) as e:
+                logger.error(f"Broker did not confirm message to {queue_name}: {str(e)}")
+                results.append(False)
+            except Exception as e:
+                # The channel or connection is gone; the remaining messages cannot be confirmed either
+                logger.error(f"Failed to publish message batch: {str(e)}")
+                self.confirm_channel = None
+                results.extend([False] * (len(messages) - len(results)))
+                break
+        span.set_attribute("messaging.published_count", sum(results))
+        span.end()
+        logger.info(f"Published {sum(results)} of {len(messages)} messages to queue: {queue_name}")
+        return results
+
     def close_connection(self):
         """Close the RabbitMQ connection."""
         if self.connection and not self.connection.is_closed:
             self.connection.close()
             logger.info("RabbitMQ connection closed")
 
+# Message headers used by the retry topology
+ATTEMPT_HEADER = "x-attempt" # 1 on the first delivery (absent header), incremented on each retry
+MAX_ATTEMPTS_HEADER = "x-max-attempts" # Optional per-message override of RABBITMQ_MAX_ATTEMPTS
+LAST_ERROR_HEADER = "x-last-error"
+
+# Process-wide retry counters, keyed by (queue, outcome) with outcome "retried" or "dead_lettered"
+retry_metrics: Counter = Counter()
+
+
+def retry_delays_ms(config=None) -> List[int]:
+    """Delay before each retry: base, 2x base, 4x base... capped at the max delay, one per allowed retry."""
+    config = config or getConfig()
+    return [
+        min(config.RABBITMQ_RETRY_BASE_DELAY_MS * 2 ** retry, config.RABBITMQ_RETRY_MAX_DELAY_MS)
+        for retry in range(max(config.RABBITMQ_MAX_ATTEMPTS - 1, 0))
+    ]
+
+
+def retry_queue_name(queue_name: str, delay_ms: int) -> str:
+    return f"{queue_name}.retry.{delay_ms}"
+
+
+def dead_letter_exchange_name(queue_name: str) -> str:
+    return f"{queue_name}.dlx"
+
+
+def declare_retry_topology(channel, queue_name: str, config=None) -> None:
+    """
+    Declares the delayed-retry and dead-letter topology for `queue_name`.
+
+    Each delay gets its own queue with a fixed x-message-ttl (per-queue TTL keeps expiry FIFO);
+    expired messages are dead-lettered through the default exchange back onto `queue_name`.
+    Messages that fail permanently or run out of attempts are published to the `<queue>.dlx`
+    exchange, which routes them to `<queue>.dead` for inspection.
+    The work queue itself keeps its original arguments, so existing deployments need no migration.
+    """
+    for delay_ms in sorted(set(retry_delays_ms(config))):
+        channel.queue_declare(
+            queue=retry_queue_name(queue_name, delay_ms),
+            durable=True,
+            arguments={
+                "x-message-ttl": delay_ms,
+                "x-dead-letter-exchange": "",
+                "x-dead-letter-routing-key": queue_name,
+            }
+        )
+    dead_letter_exchange = dead_letter_exchange_name(queue_name)
+    channel.exchange_declare(exchange=dead_letter_exchange, exchange_type="direct", durable=True)
+    channel.queue_declare(queue=f"{queue_name}.dead", durable=True)
+    channel.queue_bind(queue=f"{queue_name}.dead", exchange=dead_letter_exchange, routing_key=queue_name)
+
+
+def message_attempt(properties) -> int:
+    headers = getattr(properties, "headers", None) or {}
+    return int(headers.get(ATTEMPT_HEADER, 1))
+
+
+def message_max_attempts(properties, config=None) -> int:
+    headers = getattr(properties, "headers", None) or {}
+    return int(headers.get(MAX_ATTEMPTS_HEADER, (config or getConfig()).RABBITMQ_MAX_ATTEMPTS))
+
+
+def _forward_properties(properties, headers: Dict[str, Any]) -> pika.BasicProperties:
+    return pika.BasicProperties(
+        delivery_mode=2,
+        content_type=getattr(properties, "content_type", None) or 'application/json',
+        correlation_id=getattr(properties, "correlation_id", None),
+        headers=headers
+    )
+
+
+def publish_retry(channel, queue_name: str, body: bytes, properties, error: str, config=None) -> int:
+    """Publishes a failed message to the delay queue for its next attempt. Returns the delay in ms."""
+    attempt = message_attempt(properties)
+    delays = retry_delays_ms(config)
+    delay_ms = delays[min(attempt, len(delays)) - 1]
+    headers = dict(getattr(properties, "headers", None) or {})
+    headers[ATTEMPT_HEADER] = attempt + 1
+    headers[LAST_ERROR_HEADER] = error[:500]
+    channel.basic_publish(
+        exchange='',
+        routing_key=retry_queue_name(queue_name, delay_ms),
+        body=body,
+        properties=_forward_properties(properties, headers)
+    )
+    retry_metrics[(queue_name, "retried")] += 1
+    logger.info(f"Scheduled attempt {attempt + 1} of message from '{queue_name}' in {delay_ms} ms (retried total: {retry_metrics[(queue_name, 'retried')]})")
+    return delay_ms
+
+
+def publish_dead_letter(channel, queue_name: str, body: bytes, properties, error: str) -> None:
+    """Routes a message that failed permanently (or ran out of attempts) to `<queue>.dead`."""
+    headers = dict(getattr(properties, "headers", None) or {})
+    headers[ATTEMPT_HEADER] = message_attempt(properties)
+    headers[LAST_ERROR_HEADER] = error[:500]
+    channel.basic_publish(
+        exchange=dead_letter_exchange_name(queue_name),
+        routing_key=queue_name,
+        body=body,
+        properties=_forward_properties(properties, headers)
+    )
+    retry_metrics[(queue_name, "dead_lettered")] += 1
+    logger.warning(f"Dead-lettered message from '{queue_name}' after {headers[ATTEMPT_HEADER]} attempts (dead-lettered total: {retry_metrics[(queue_name, 'dead_lettered')]})")
+
 # Singleton instance
 _rabbitmq_service = None
 
@@ -0,0 +1,343 @@
+import asyncio
+import logging
+import os
+import shutil
+import threading
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Optional
+from urllib.parse import urlparse
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config as BotoConfig
+from botocore.exceptions import ClientError
+
+from app.config.config import getConfig
+
+logger = logging.getLogger(__name__)
+
+
+def _split_s3_path(path: str):
+    parsed_url = urlparse(path)
+    return parsed_url.netloc, parsed_url.path.lstrip("/")
+
+
+def _is_missing(error: ClientError) -> bool:
+    return error.response.get("Error", {}).get("Code") in ("NoSuchKey", "404")
+
+
+def _download_local_file(path: str, local_path: str) -> None:
+    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+    shutil.copy2(path, local_path)
+
+
+def _read_local_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _delete_local_file(path: str) -> None:
+    if os.path.exists(path):
+        os.remove(path)
+
+
+class Storage(ABC):
+    """
+    Where uploaded originals and converted Markdown are kept, by key. The save and copy methods return
+    the stored path that callers keep (Document.file_path, markdown_s3_link) and later pass back.
+
+    Every backend also reads, copies and deletes plain file paths, since documents stored before S3
+    was configured (and staged temp files) keep local paths.
+    """
+
+    client = None # S3 client, if any; callers that can use one (presigned URLs, ranged GETs) check for it
+
+    @abstractmethod
+    def path_for(self, key: str) -> str:
+        """Stored path of `key`."""
+
+    @abstractmethod
+    def ensure_ready(self) -> None:
+        """Verifies (or creates) the bucket or root directory."""
+
+    @abstractmethod
+    def save_file(self, local_path: str, key: str, content_type: str) -> str:
+        """Stores a local file at `key`."""
+
+    @abstractmethod
+    def save_bytes(self, data: bytes, key: str, content_type: str) -> str:
+        """Stores `data` at `key`."""
+
+    @abstractmethod
+    async def save_stream(self, chunks: AsyncIterator[bytes], key: str, content_type: str, part_size: int = 0) -> Optional[str]:
+        """Stores chunks as they arrive. Returns None (nothing stored) for an empty stream; stores nothing if `chunks` raises."""
+
+    @abstractmethod
+    def copy(self, source_path: str, key: str, content_type: str) -> str:
+        """Copies a stored path (or a local file) to `key`. Raises FileNotFoundError if the source is missing."""
+
+    @abstractmethod
+    def download_file(self, path: str, local_path: str) -> None:
+        """Copies a stored path to a local file, creating its directory."""
+
+    @abstractmethod
+    def read_bytes(self, path: str) -> bytes:
+        """Raises FileNotFoundError if nothing is stored at `path`."""
+
+    @abstractmethod
+    def delete(self, path: str) -> None:
+        """Deletes a stored path; nothing happens if it is already gone."""
+
+
+class LocalStorage(Storage):
+    """Stores objects as files under `root`, keyed like S3 keys. Stored paths are plain file paths."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def ensure_ready(self) -> None:
+        os.makedirs(self.root, exist_ok=True)
+
+    def _target(self, key: str) -> str:
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def save_file(self, local_path: str, key: str, content_type: str) -> str:
+        path = self._target(key)
+        shutil.copy2(local_path, path)
+        return path
+
+    def save_bytes(self, data: bytes, key: str, content_type: str) -> str:
+        path = self._target(key)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    async def save_stream(self, chunks: AsyncIterator[bytes], key: str, content_type: str, part_size: int = 0) -> Optional[str]:
+        """Writes chunks as they arrive. Returns None (nothing stored) for an empty stream; removes the file if `chunks` raises."""
+        path = self._target(key)
+        size = 0
+        try:
+            with open(path, "wb") as f:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    f.write(chunk)
+        except BaseException:
+            os.remove(path)
+            raise
+        if size == 0:
+            os.remove(path)
+            return None
+        return path
+
+    def copy(self, source_path: str, key: str, content_type: str) -> str:
+        if source_path.startswith("s3://"):
+            raise FileNotFoundError(f"S3 storage not configured; cannot read {source_path}.")
+        return self.save_file(source_path, key, content_type)
+
+    def download_file(self, path: str, local_path: str) -> None:
+        if path.startswith("s3://"):
+            raise FileNotFoundError(f"S3 storage not configured; cannot read {path}.")
+        _download_local_file(path, local_path)
+
+    def read_bytes(self, path: str) -> bytes:
+        if path.startswith("s3://"):
+            raise FileNotFoundError(f"S3 storage not configured; cannot read {path}.")
+        return _read_local_file(path)
+
+    def delete(self, path: str) -> None:
+        if path.startswith("s3://"):
+            raise FileNotFoundError(f"S3 storage not configured; cannot delete {path}.")
+        _delete_local_file(path)
+
+
+class S3Storage(Storage):
+    """Stores objects in an S3/MinIO bucket; stored paths are s3://bucket/key links."""
+
+    def __init__(self, client, bucket_name: str, transfer_config: Optional[TransferConfig] = None):
+        self.client = client
+        self.bucket_name = bucket_name
+        self.transfer_config = transfer_config or TransferConfig()
+
+    def path_for(self, key: str) -> str:
+        return f"s3://{self.bucket_name}/{key}"
+
+    def ensure_ready(self) -> None:
+        try:
+            self.client.head_bucket(Bucket=self.bucket_name)
+            logger.info(f"S3 Bucket '{self.bucket_name}' accessible.")
+        except ClientError:
+            logger.warning(f"S3 Bucket '{self.bucket_name}' not found or inaccessible. Attempting to create.")
+            self.client.create_bucket(Bucket=self.bucket_name)
+            logger.info(f"S3 Bucket '{self.bucket_name}' created.")
+
+    def save_file(self, local_path: str, key: str, content_type: str) -> str:
+        # upload_file switches to a parallel multipart upload above the transfer config's threshold
+        self.client.upload_file(
+            local_path, self.bucket_name, key,
+            ExtraArgs={"ContentType": content_type}, Config=self.transfer_config
+        )
+        return self.path_for(key)
+
+    def save_bytes(self, data: bytes, key: str, content_type: str) -> str:
+        self.client.put_object(Bucket=self.bucket_name, Key=key, Body=data, ContentType=content_type)
+        return self.path_for(key)
+
+    async def save_stream(self, chunks: AsyncIterator[bytes], key: str, content_type: str, part_size: int = 8 * 1024 * 1024) -> Optional[str]:
+        """
+        Uploads chunks as they arrive, buffering at most one part: a single PUT for streams up to
+        `part_size`, a multipart upload beyond. Returns None for an empty stream; aborts the
+        multipart upload if `chunks` raises.
+        """
+        multipart_id = None
+        parts = []
+        buffer = bytearray()
+        size = 0
+
+        async def upload_part():
+            response = await asyncio.to_thread(
+                self.client.upload_part, Bucket=self.bucket_name, Key=key, UploadId=multipart_id,
+                PartNumber=len(parts) + 1, Body=bytes(buffer)
+            )
+            parts.append({"PartNumber": len(parts) + 1, "ETag": response["ETag"]})
+
+        try:
+            async for chunk in chunks:
+                size += len(chunk)
+                buffer += chunk
+                if len(buffer) >= part_size:
+                    if multipart_id is None:
+                        response = await asyncio.to_thread(
+                            self.client.create_multipart_upload, Bucket=self.bucket_name, Key=key, ContentType=content_type
+                        )
+                        multipart_id = response["UploadId"]
+                    await upload_part()
+                    buffer = bytearray()
+
+            if size == 0:
+                return None
+            if multipart_id is None:
+                await asyncio.to_thread(self.save_bytes, bytes(buffer), key, content_type)
+            else:
+                if buffer:
+                    await upload_part()
+                await asyncio.to_thread(
+                    self.client.complete_multipart_upload, Bucket=self.bucket_name, Key=key, UploadId=multipart_id,
+                    MultipartUpload={"Parts": parts}
+                )
+        except BaseException:
+            if multipart_id is not None:
+                try:
+                    await asyncio.to_thread(self.client.abort_multipart_upload, Bucket=self.bucket_name, Key=key, UploadId=multipart_id)
+                except Exception as abort_e:
+                    logger.warning(f"Could not abort multipart upload of {key}: {abort_e}")
+            raise
+        return self.path_for(key)
+
+    def copy(self, source_path: str, key: str, content_type: str) -> str:
+        """Copies a stored file to `key`; S3 sources are copied server-side without passing through this process."""
+        if not source_path.startswith("s3://"):
+            return self.save_file(source_path, key, content_type)
+        source_bucket, source_key = _split_s3_path(source_path)
+        try:
+            # The managed copy switches to a parallel multipart copy above the transfer config's threshold
+            # (a single CopyObject request is limited to 5 GB)
+            self.client.copy(
+                CopySource={"Bucket": source_bucket, "Key": source_key},
+                Bucket=self.bucket_name, Key=key,
+                ExtraArgs={"ContentType": content_type, "MetadataDirective": "REPLACE"},
+                Config=self.transfer_config
+            )
+        except ClientError as e:
+            if _is_missing(e):
+                raise FileNotFoundError(f"Stored file {source_path} not found.") from e
+            raise
+        return self.path_for(key)
+
+    def download_file(self, path: str, local_path: str) -> None:
+        if not path.startswith("s3://"):
+            return _download_local_file(path, local_path)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        bucket_name, key = _split_s3_path(path)
+        self.client.download_file(bucket_name, key, local_path, Config=self.transfer_config)
+
+    def read_bytes(self, path: str) -> bytes:
+        if not path.startswith("s3://"):
+            return _read_local_file(path)
+        bucket_name, key = _split_s3_path(path)
+        try:
+            return self.client.get_object(Bucket=bucket_name, Key=key)["Body"].read()
+        except ClientError as e:
+            if _is_missing(e):
+                raise FileNotFoundError(f"Stored file {path} not found.") from e
+            raise
+
+    def delete(self, path: str) -> None:
+        if not path.startswith("s3://"):
+            return _delete_local_file(path)
+        bucket_name, key = _split_s3_path(path)
+        self.client.delete_object(Bucket=bucket_name, Key=key)
+
+
+def _create_storage(config) -> Storage:
+    if config.STORAGE_BACKEND == "s3":
+        if all([config.MINIO_ENDPOINT, config.MINIO_ACCESS_KEY, config.MINIO_SECRET_KEY, config.MINIO_BUCKET_NAME]):
+            client = boto3.client(
+                's3', endpoint_url=config.MINIO_ENDPOINT,
+                aws_access_key_id=config.MINIO_ACCESS_KEY, aws_secret_access_key=config.MINIO_SECRET_KEY,
+                region_name='us-east-1',
+                config=BotoConfig(
+                    signature_version='s3v4',
+                    # Shared by all request threads and transfer workers, so sized above the transfer concurrency
+                    max_pool_connections=config.S3_MAX_POOL_CONNECTIONS,
+                    connect_timeout=config.S3_CONNECT_TIMEOUT,
+                    read_timeout=config.S3_READ_TIMEOUT,
+                    retries={"max_attempts": config.S3_MAX_ATTEMPTS, "mode": "standard"},
+                )
+            )
+            transfer_config = TransferConfig(
+                multipart_threshold=config.S3_MULTIPART_THRESHOLD,
+                multipart_chunksize=config.S3_MULTIPART_CHUNKSIZE,
+                max_concurrency=config.S3_TRANSFER_MAX_CONCURRENCY,
+            )
+            return S3Storage(client, config.MINIO_BUCKET_NAME, transfer_config)
+        logger.warning("MinIO not fully configured. Falling back to local storage.")
+    return LocalStorage(config.LOCAL_STORAGE_ROOT)
+
+
+_storage: Optional[Storage] = None
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> Storage:
+    """
+    Process-wide storage (S3Storage or LocalStorage per STORAGE_BACKEND), built on first use.
+    boto3 clients are thread-safe, so one client and its connection pool serve the whole process.
+    The bucket is not checked here; init_storage does that once at startup.
+    """
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = _create_storage(getConfig())
+    return _storage
+
+
+def set_storage(storage: Optional[Storage]) -> None:
+    """Replaces the process-wide storage (e.g. a LocalStorage on a temp dir in tests); None rebuilds it from config."""
+    global _storage
+    _storage = storage
+
+
+def init_storage() -> Storage:
+    """Builds the storage and verifies (or creates) its bucket or root directory. Called once per process at startup."""
+    storage = get_storage()
+    try:
+        storage.ensure_ready()
+    except Exception as e:
+        logger.error(f"Storage check failed at startup: {e}")
+    return storage
@@ -0,0 +1,93 @@
+import asyncio
+import json
+import logging
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, Set
+
+import psycopg
+from sqlalchemy.engine import make_url
+
+from app.config.config import getConfig
+
+logger = logging.getLogger(__name__)
+
+# Postgres channel the document_uploads trigger (alembic revision e5c1a7b3d820) notifies on every
+# status or stage transition, whoever makes it: API, consumer or requeue script
+UPLOAD_STATUS_CHANNEL = "document_upload_status"
+
+
+def _psycopg_dsn(database_url: str) -> str:
+    return make_url(database_url).set(drivername="postgresql").render_as_string(hide_password=False)
+
+
+class UploadStatusBroadcaster:
+    """
+    Fans DocumentUpload status notifications out to the SSE clients of this process, by project.
+
+    One LISTEN connection per process, opened when the first client subscribes. Each subscriber
+    gets a bounded queue; a client too slow to keep up loses its oldest events rather than
+    growing the queue (the next event of an upload supersedes the previous one anyway).
+    """
+
+    def __init__(self, database_url: Optional[str] = None, queue_size: int = 256, reconnect_delay: float = 5.0,
+                 connect: Callable = psycopg.AsyncConnection.connect):
+        self.database_url = database_url
+        self.queue_size = queue_size
+        self.reconnect_delay = reconnect_delay
+        self.connect = connect
+        self._subscribers: Dict[int, Set[asyncio.Queue]] = {}
+        self._listener: Optional[asyncio.Task] = None
+
+    @contextmanager
+    def subscribe(self, project_id: int) -> Iterator[asyncio.Queue]:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(project_id, set()).add(queue)
+        self._ensure_listener()
+        try:
+            yield queue
+        finally:
+            project_subscribers = self._subscribers.get(project_id)
+            if project_subscribers is not None:
+                project_subscribers.discard(queue)
+                if not project_subscribers:
+                    del self._subscribers[project_id]
+
+    def publish(self, event: Dict[str, Any]) -> None:
+        for queue in self._subscribers.get(event.get("project_id"), ()):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    def _ensure_listener(self) -> None:
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+
+    async def _listen(self) -> None:
+        dsn = _psycopg_dsn(self.database_url or getConfig().SQLALCHEMY_DATABASE_URI)
+        while True:
+            try:
+                async with await self.connect(dsn, autocommit=True) as connection:
+                    await connection.execute(f"LISTEN {UPLOAD_STATUS_CHANNEL}")
+                    logger.info(f"Listening for DocumentUpload status notifications on '{UPLOAD_STATUS_CHANNEL}'")
+                    async for notification in connection.notifies():
+                        try:
+                            self.publish(json.loads(notification.payload))
+                        except ValueError:
+                            logger.warning(f"Ignoring malformed upload status notification: {notification.payload!r}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Upload status listener lost its connection: {e}. Reconnecting in {self.reconnect_delay}s")
+                await asyncio.sleep(self.reconnect_delay)
+
+    async def close(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._listener = None
+
+
+upload_status_broadcaster = UploadStatusBroadcaster()
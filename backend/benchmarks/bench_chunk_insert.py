@@ -0,0 +1,99 @@
+"""
+Benchmark for persisting DocumentChunk rows.
+
+Compares the previous ORM path (one DocumentChunk object per chunk, db.add, one commit)
+against the bulk executemany path in `save_chunks_to_database`, for documents
+producing tens of thousands of chunks.
+
+Usage (from backend/):
+    python -m benchmarks.bench_chunk_insert [--chunks 10000 50000] [--database-url postgresql+psycopg://...]
+
+Defaults to a throwaway SQLite database; point --database-url at a scratch
+PostgreSQL database to measure the production driver. Tables are created if
+missing and the benchmark rows are deleted afterwards.
+"""
+import argparse
+import time
+import uuid
+from datetime import UTC, datetime
+
+from sqlalchemy import create_engine, delete
+from sqlalchemy.orm import sessionmaker
+
+from app.models.models import Base, Document, DocumentChunk, Project, User
+from app.services.chunking import save_chunks_to_database
+
+
+def orm_save_chunks(db, chunks, document_id, project_id, file_name, file_hash):
+    """The per-row ORM implementation used before the bulk path, for comparison only."""
+    for chunk_data in chunks:
+        db.add(DocumentChunk(
+            id=chunk_data["metadata"]["chunk_id"], project_id=project_id, document_id=document_id,
+            file_name=file_name, hash=file_hash, chunk_metadata=chunk_data["metadata"]
+        ))
+    db.commit()
+
+
+def make_chunks(count: int, document_id: int):
+    return [
+        {
+            "text": f"chunk {i}",
+            "metadata": {
+                "headers": {"h1": "Manual", "h2": f"Section {i // 20}"},
+                "source_document_id": str(document_id),
+                "chunk_sequence": i,
+                "chunk_id": str(uuid.uuid4()),
+            },
+        }
+        for i in range(count)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, nargs="+", default=[10_000, 50_000], help="Chunks per document")
+    parser.add_argument("--database-url", default="sqlite:///./bench_chunk_insert.db")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
+    db = Session()
+    now = datetime.now(UTC)
+    user = User(email=f"bench-{uuid.uuid4().hex[:8]}@example.com", username="bench", hashed_password="x", created_at=now, updated_at=now)
+    project = Project(project_name="chunk insert benchmark", created_at=now, updated_at=now)
+    db.add_all([user, project])
+    db.flush()
+    document = Document(file_path="", file_name="bench.md", file_size=0, project_id=project.id, uploaded_by=user.id, file_hash="0" * 64, created_at=now, updated_at=now)
+    db.add(document)
+    db.commit()
+
+    print(f"{'chunks':>8} {'orm s':>8} {'bulk s':>8} {'speedup':>8}")
+    try:
+        for count in args.chunks:
+            timings = {}
+            for name, save in (("orm", orm_save_chunks), ("bulk", save_chunks_to_database)):
+                chunks = make_chunks(count, document.id)
+                session = Session()
+                started = time.perf_counter()
+                if save is save_chunks_to_database:
+                    save(session, chunks, document.id, project.id, document.file_name, document.file_hash, batch_size=args.batch_size)
+                else:
+                    save(session, chunks, document.id, project.id, document.file_name, document.file_hash)
+                timings[name] = time.perf_counter() - started
+                session.execute(delete(DocumentChunk).where(DocumentChunk.document_id == document.id))
+                session.commit()
+                session.close()
+            print(f"{count:>8} {timings['orm']:>8.2f} {timings['bulk']:>8.2f} {timings['orm'] / timings['bulk']:>7.1f}x")
+    finally:
+        db.delete(document)
+        db.delete(project)
+        db.delete(user)
+        db.commit()
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
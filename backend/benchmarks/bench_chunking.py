@@ -0,0 +1,137 @@
+"""
+Benchmark for the recursive text splitter on large synthetic Markdown documents.
+
+Compares the offset-based `_split_text_recursive` against the previous
+string-concatenating implementation (kept below as `legacy_split_text_recursive`),
+checks both produce identical chunks, and reports timings.
+
+Usage (from backend/):
+    python -m benchmarks.bench_chunking [--sizes 100000 1000000] [--tokens]
+"""
+import argparse
+import random
+import re
+import string
+import time
+from typing import Callable, List
+
+from app.services.chunking import _split_text_recursive, _tail_within, make_token_length_function
+
+SEPARATORS = ["\n\n", "\n", ". ", "! ", "? ", " ", ""]
+
+
+def legacy_split_text_recursive(
+    text: str, max_chunk_size: int, separators: List[str], chunk_overlap: int = 50,
+    length_function: Callable[[str], int] = len,
+) -> List[str]:
+    """The splitter as it was before the offset-based rewrite, for comparison only."""
+    final_chunks = []
+    remaining_text = text.strip()
+    if not remaining_text:
+        return []
+    if length_function(remaining_text) <= max_chunk_size:
+        return [remaining_text]
+
+    current_separator = separators[0] if separators else ""
+    if current_separator:
+        split_using_separator = remaining_text.split(current_separator)
+    else:
+        split_using_separator = list(remaining_text)
+
+    current_chunk = ""
+    for i, part in enumerate(split_using_separator):
+        part_to_add = part
+        if current_separator and i > 0:
+            part_to_add = current_separator + part
+        if not current_chunk or length_function(current_chunk + part_to_add) <= max_chunk_size:
+            current_chunk += part_to_add
+        else:
+            if length_function(current_chunk) > max_chunk_size:
+                final_chunks.extend(legacy_split_text_recursive(
+                    current_chunk, max_chunk_size, separators[1:], chunk_overlap, length_function))
+            else:
+                final_chunks.append(current_chunk)
+            overlap = _tail_within(final_chunks[-1], chunk_overlap, length_function) if final_chunks else ""
+            current_chunk = overlap + part_to_add
+            if length_function(current_chunk) > max_chunk_size:
+                final_chunks.extend(legacy_split_text_recursive(
+                    part_to_add, max_chunk_size, separators[1:], chunk_overlap, length_function))
+                current_chunk = ""
+
+    if current_chunk:
+        if length_function(current_chunk) > max_chunk_size:
+            final_chunks.extend(legacy_split_text_recursive(
+                current_chunk, max_chunk_size, separators[1:], chunk_overlap, length_function))
+        else:
+            final_chunks.append(current_chunk)
+    return [chunk for chunk in final_chunks if chunk.strip()]
+
+
+class SubwordTokenizer:
+    """Cheap tokenizer stand-in (one token per 4 non-space characters) so token mode runs without model downloads."""
+
+    def encode(self, text, add_special_tokens=False):
+        return re.findall(r"\S{1,4}", text)
+
+
+def _words(rng: random.Random, count: int) -> str:
+    return " ".join("".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 10))) for _ in range(count))
+
+
+def make_prose(rng: random.Random, size: int) -> str:
+    parts = []
+    while sum(map(len, parts)) < size:
+        parts.append(f"## Section {len(parts)}\n\n" + ". ".join(_words(rng, 12) for _ in range(8)) + ".\n\n")
+    return "".join(parts)[:size]
+
+
+def make_table(rng: random.Random, size: int) -> str:
+    rows = ["| " + " | ".join(f"col{i}" for i in range(8)) + " |", "|" + "---|" * 8]
+    while sum(map(len, rows)) < size:
+        rows.append("| " + " | ".join(f"{rng.random():.6f}" for _ in range(8)) + " |")
+    return "\n".join(rows)[:size]
+
+
+def make_minified(rng: random.Random, size: int) -> str:
+    return "".join(rng.choices("abcdefghij{}();=+,:'\"", k=size))
+
+
+DOCUMENTS = {"prose": make_prose, "table": make_table, "minified": make_minified}
+
+
+def _time(func, *args) -> tuple:
+    started = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - started, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000], help="Document sizes in characters")
+    parser.add_argument("--max-chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=50)
+    parser.add_argument("--tokens", action="store_true", help="Measure chunks in (stand-in subword) tokens instead of characters")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    max_size, overlap = args.max_chunk_size, args.chunk_overlap
+    if args.tokens:
+        max_size, overlap = max(1, max_size // 4), max(0, overlap // 4)
+
+    print(f"{'document':<10} {'chars':>10} {'chunks':>8} {'legacy s':>10} {'offset s':>10} {'speedup':>8}  identical")
+    for size in args.sizes:
+        for name, make_document in DOCUMENTS.items():
+            text = make_document(rng, size)
+            # Fresh length functions so neither run benefits from the other's token cache
+            legacy_length = make_token_length_function(SubwordTokenizer()) if args.tokens else len
+            offset_length = make_token_length_function(SubwordTokenizer()) if args.tokens else len
+
+            legacy_s, legacy_chunks = _time(legacy_split_text_recursive, text, max_size, SEPARATORS, overlap, legacy_length)
+            offset_s, offset_chunks = _time(_split_text_recursive, text, max_size, SEPARATORS, overlap, offset_length)
+            speedup = legacy_s / offset_s if offset_s else float("inf")
+            print(f"{name:<10} {size:>10} {len(offset_chunks):>8} {legacy_s:>10.3f} {offset_s:>10.3f} {speedup:>7.1f}x  {legacy_chunks == offset_chunks}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,396 @@
+"""
+End-to-end benchmark of the ingestion and chat pipelines, against local stand-ins for every external service:
+
+- LLM:      benchmarks.fake_openai, an OpenAI-compatible server with configurable latency, for the RAG
+            decision, query enrichment, streamed answers and Markdown refinement (--refinement)
+- Qdrant:   an in-process QdrantClient(":memory:") behind the regular QdrantService code
+- Database: a SQLite file in the work directory, or --database-url (use a scratch PostgreSQL database)
+- Storage:  LocalStorage in the work directory
+
+Ingestion uploads a synthetic Markdown corpus through DocumentService (staging, duplicate check, one
+message per file), then hands each message to the consumer's process_message_callback, one at a time as
+a consumer process does. The chat phase serves the chat router with uvicorn and drives it over HTTP with
+--concurrency clients, each in its own chat, so streamed events are timed as clients receive them.
+
+Reports throughput and the p50/p95/p99 of every stage, taken from the stage timings of the tracing spans
+(app.core.tracing; TRACING_STAGE_TIMINGS is switched on), plus the time to first token and latency seen
+by the chat clients. TRACING_EXPORTER=file additionally writes the spans of the run.
+
+Usage (from backend/):
+    python -m benchmarks.bench_rag [--documents 200 --requests 500 --concurrency 20 --ttft 0.3 --token-delay 0.02]
+    python -m benchmarks.bench_rag --embedder hash --json results.json  # no embedding model download
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import math
+import random
+import tempfile
+import time
+import uuid
+import zlib
+from collections import defaultdict
+from datetime import UTC, datetime
+from types import SimpleNamespace
+from typing import Dict, List
+
+import httpx
+import numpy as np
+import pika
+from fastapi import FastAPI, UploadFile
+from qdrant_client import QdrantClient
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+from starlette.datastructures import Headers
+
+from app.api.chat import router as chat_router
+from app.config.config import getConfig
+from app.consumers import document_consumer
+from app.core.security import get_current_user
+from app.core.tracing import collect_stage_timings, configure_tracing, shutdown_tracing, stage_span
+from app.models.models import Base, Chat, ChatProject, DocumentChunk, DocumentUpload, Project, User
+from app.services.document import DocumentService
+from app.services.qdrant_service import QdrantService, get_qdrant_service
+from app.services.storage import LocalStorage, set_storage
+from benchmarks.fake_openai import ServerThread, add_latency_arguments, build_app as build_llm_app, settings_from_args
+from db.database import get_async_db_session
+
+PERCENTILES = (0.5, 0.95, 0.99)
+
+
+class HashingEmbedder:
+    """
+    Offline stand-in for the SentenceTransformer: L2-normalised counts of hashed words. It has no
+    tokenizer, so the consumer falls back to character-based chunk sizes.
+    """
+
+    def __init__(self, dimension: int):
+        self.dimension = dimension
+
+    def encode(self, texts: List[str], show_progress_bar: bool = False) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                vectors[row, zlib.crc32(word.encode()) % self.dimension] += 1
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+
+class InMemoryQdrantService(QdrantService):
+    """QdrantService over QdrantClient(":memory:"): the same embedding, upsert and search code, no server."""
+
+    def __init__(self, settings, embedding_model):
+        self.settings = settings
+        self.client = QdrantClient(":memory:")
+        self.embedding_model = embedding_model
+        self.ensure_collection()
+
+
+class CollectingQueue:
+    """Takes the place of RabbitMQService for DocumentService, keeping the published message bodies."""
+
+    def __init__(self):
+        self.bodies: List[bytes] = []
+
+    def publish_messages(self, queue_name, messages):
+        self.bodies.extend(json.dumps(message).encode() for message in messages)
+        return [True] * len(messages)
+
+
+class FakeChannel:
+    """Takes the place of the consumer's pika channel, counting acks and republished (failed) messages."""
+
+    def __init__(self):
+        self.acked = 0
+        self.republished = 0
+
+    def basic_ack(self, delivery_tag):
+        self.acked += 1
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        self.republished += 1
+
+
+def make_vocabulary(rng: random.Random, size: int) -> List[str]:
+    syllables = ["ka", "lo", "mi", "ren", "ta", "vo", "sil", "qua", "dor", "ne", "pra", "zu", "tek", "fo", "ly", "gan"]
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def make_document(rng: random.Random, vocabulary: List[str], title: str, words: int, sections: int) -> str:
+    """Markdown with a title, `sections` H2 sections and paragraphs of about 60 words."""
+    parts = [f"# {title}\n"]
+    words_per_section = max(words // max(sections, 1), 1)
+    for section in range(sections):
+        parts.append(f"\n## {' '.join(rng.sample(vocabulary, 3)).capitalize()} {section + 1}\n")
+        remaining = words_per_section
+        while remaining > 0:
+            paragraph = rng.choices(vocabulary, k=min(remaining, 60))
+            parts.append("\n" + " ".join(paragraph).capitalize() + ".\n")
+            remaining -= len(paragraph)
+    return "".join(parts)
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    return sorted_values[max(math.ceil(q * len(sorted_values)) - 1, 0)]
+
+
+def summarize(samples: Dict[str, List[float]]) -> Dict[str, Dict[str, float]]:
+    summary = {}
+    for stage, values in samples.items():
+        values = sorted(values)
+        summary[stage] = {"count": len(values), **{f"p{round(q * 100)}_ms": round(percentile(values, q), 1) for q in PERCENTILES}}
+    return summary
+
+
+def print_stages(summary: Dict[str, Dict[str, float]]) -> None:
+    print(f"  {'stage':<28} {'count':>7} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+    for stage, row in summary.items():
+        print(f"  {stage:<28} {row['count']:>7} {row['p50_ms']:>10.1f} {row['p95_ms']:>10.1f} {row['p99_ms']:>10.1f}")
+
+
+def seed(sync_sessions, projects: int, chats: int, run_id: str):
+    """Creates the benchmark user, its projects and one chat per chat client (plus one for warm-up)."""
+    now = datetime.now(UTC)
+    with sync_sessions() as db:
+        user = User(email=f"bench-{run_id}@example.com", username=f"bench-{run_id}", hashed_password="x")
+        project_rows = [Project(project_name=f"Benchmark {run_id} #{i + 1}") for i in range(projects)]
+        db.add_all([user, *project_rows])
+        db.flush()
+        chat_rows = [Chat(title=f"Benchmark chat {i + 1}", user_id=user.id, created_at=now, updated_at=now) for i in range(chats)]
+        db.add_all(chat_rows)
+        db.flush()
+        db.add_all([
+            ChatProject(chat_id=chat.id, project_id=project_rows[i % projects].id) for i, chat in enumerate(chat_rows)
+        ])
+        db.commit()
+        return user.id, [project.id for project in project_rows], [chat.id for chat in chat_rows]
+
+
+def ingest(args, config, sync_sessions, async_url, storage, qdrant_service, corpus, project_ids, user_id, samples):
+    queue = CollectingQueue()
+
+    async def upload_all():
+        engine = create_async_engine(async_url)
+        sessions = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+        try:
+            for project_index, project_id in enumerate(project_ids):
+                documents = corpus[project_index::len(project_ids)]
+                for start in range(0, len(documents), args.upload_batch):
+                    files = [
+                        UploadFile(file=io.BytesIO(data), filename=name, size=len(data), headers=Headers({"content-type": "text/markdown"}))
+                        for name, data in documents[start:start + args.upload_batch]
+                    ]
+                    async with sessions() as db:
+                        started = time.perf_counter()
+                        await DocumentService(db=db, rabbitmq_service=queue).upload_documents(files, project_id=project_id, user_id=user_id)
+                        samples["upload.request"].append((time.perf_counter() - started) * 1000)
+        finally:
+            await engine.dispose()
+
+    started = time.perf_counter()
+    asyncio.run(upload_all())
+    upload_elapsed = time.perf_counter() - started
+
+    # The consumer opens its sessions from this module-level factory
+    document_consumer.SessionLocal = sync_sessions
+    chunking_kwargs = document_consumer._build_chunking_kwargs(config, qdrant_service)
+    channel = FakeChannel()
+    started = time.perf_counter()
+    for delivery_tag, body in enumerate(queue.bodies, 1):
+        timings: Dict[str, float] = {}
+        collect_stage_timings(timings)
+        with stage_span("ingest.document"):
+            asyncio.run(document_consumer.process_message_callback(
+                channel, SimpleNamespace(delivery_tag=delivery_tag), pika.BasicProperties(headers={}), body,
+                qdrant_service, storage, config, chunking_kwargs
+            ))
+        collect_stage_timings(None)
+        for stage, milliseconds in timings.items():
+            samples[stage].append(milliseconds)
+    consume_elapsed = time.perf_counter() - started
+
+    with sync_sessions() as db:
+        completed = db.scalar(select(func.count()).where(DocumentUpload.user_id == user_id, DocumentUpload.status == "completed"))
+        chunks = db.scalar(select(func.count()).select_from(DocumentChunk).where(DocumentChunk.project_id.in_(project_ids)))
+    return {
+        "documents": len(queue.bodies), "completed": completed, "failed": channel.republished, "chunks": chunks,
+        "upload_seconds": round(upload_elapsed, 2), "consume_seconds": round(consume_elapsed, 2),
+        "documents_per_second": round(len(queue.bodies) / consume_elapsed, 2) if consume_elapsed else None,
+        "chunks_per_second": round(chunks / consume_elapsed, 2) if consume_elapsed else None,
+    }
+
+
+def build_chat_app(async_url: str, config, qdrant_service, user_id: int) -> FastAPI:
+    engine = create_async_engine(async_url, pool_size=config.DB_POOL_SIZE, max_overflow=config.DB_MAX_OVERFLOW, pool_pre_ping=True)
+    sessions = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+    user = User(id=user_id)
+
+    async def get_session():
+        async with sessions() as session:
+            yield session
+
+    async def lifespan(app):
+        yield
+        await engine.dispose()
+
+    app = FastAPI(lifespan=lifespan)
+    app.include_router(chat_router, prefix="/chat")
+    app.dependency_overrides[get_async_db_session] = get_session
+    app.dependency_overrides[get_qdrant_service] = lambda: qdrant_service
+    app.dependency_overrides[get_current_user] = lambda: user
+    return app
+
+
+async def send_message(client: httpx.AsyncClient, chat_id: int, question: str, samples) -> bool:
+    """Sends one chat message and reads its event stream. Returns False if the stream reported an error."""
+    started = time.perf_counter()
+    first_token_at = None
+    stream_end = {}
+    ok = True
+    async with client.stream("POST", f"/chat/{chat_id}/message", json={"role": "user", "content": question}) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            event = json.loads(line[len("data: "):])
+            if event["type"] == "delta" and first_token_at is None:
+                first_token_at = time.perf_counter()
+            elif event["type"] == "error":
+                ok = False
+            elif event["type"] == "stream_end":
+                stream_end = event
+    if samples is not None:
+        if first_token_at is not None:
+            samples["client.ttft"].append((first_token_at - started) * 1000)
+        samples["client.total"].append((time.perf_counter() - started) * 1000)
+        for stage, milliseconds in stream_end.get("stage_timings", {}).items():
+            samples[stage].append(milliseconds)
+    return ok
+
+
+async def chat_load(url: str, chat_ids: List[int], questions: List[str], requests: int, samples):
+    remaining = iter(range(requests))
+    errors = 0
+
+    async def client_loop(client: httpx.AsyncClient, chat_id: int):
+        nonlocal errors
+        for i in remaining:
+            if not await send_message(client, chat_id, questions[i % len(questions)], samples):
+                errors += 1
+
+    limits = httpx.Limits(max_connections=len(chat_ids), max_keepalive_connections=len(chat_ids))
+    async with httpx.AsyncClient(base_url=url, timeout=None, limits=limits) as client:
+        await send_message(client, chat_ids[-1], questions[0], None) # Warm up the routes, pools and embedding model
+        started = time.perf_counter()
+        await asyncio.gather(*(client_loop(client, chat_id) for chat_id in chat_ids[:-1]))
+        elapsed = time.perf_counter() - started
+    return {
+        "requests": requests, "concurrency": len(chat_ids) - 1, "errors": errors, "seconds": round(elapsed, 2),
+        "requests_per_second": round(requests / elapsed, 2)
+    }
+
+
+def run(args, workdir: str):
+    run_id = uuid.uuid4().hex[:8]
+    rng = random.Random(args.seed)
+    database_url = args.database_url or f"sqlite:///{workdir}/bench.db"
+    async_url = database_url.replace("sqlite://", "sqlite+aiosqlite://", 1) if database_url.startswith("sqlite://") else database_url
+    sync_engine = create_engine(database_url, poolclass=NullPool)
+    Base.metadata.create_all(bind=sync_engine)
+    sync_sessions = sessionmaker(bind=sync_engine, autoflush=False, expire_on_commit=False)
+
+    with ServerThread(build_llm_app(settings_from_args(args))) as llm_server:
+        config = getConfig()
+        config.CHAT_PROVIDER = "gemini" # Markdown refinement always uses the "gemini" client
+        config.GEMINI_API_KEY = "benchmark"
+        config.GEMINI_API_BASE_URL = f"{llm_server.url}/v1"
+        config.GEMINI_MODEL = "fake-llm"
+        config.TRACING_STAGE_TIMINGS = True
+        config.MARKDOWN_REFINEMENT_POLICY = args.refinement
+        config.UPLOAD_STAGING = "s3" # Staged in the storage below, like the default deployment
+
+        storage = LocalStorage(f"{workdir}/storage")
+        set_storage(storage)
+        if args.embedder == "hash":
+            embedding_model = HashingEmbedder(config.EMBEDDING_DIMENSION)
+        else:
+            from sentence_transformers import SentenceTransformer
+            embedding_model = SentenceTransformer(config.EMBEDDING_MODEL_NAME)
+        qdrant_service = InMemoryQdrantService(config, embedding_model)
+
+        user_id, project_ids, chat_ids = seed(sync_sessions, args.projects, args.concurrency + 1, run_id)
+        vocabulary = make_vocabulary(rng, args.vocabulary)
+        corpus = [
+            (f"manual-{i + 1}.md", make_document(rng, vocabulary, f"Manual {i + 1} ({run_id})", args.document_words, args.sections).encode())
+            for i in range(args.documents)
+        ]
+        questions = [f"What does the documentation say about {' and '.join(rng.sample(vocabulary, 2))}?" for _ in range(100)]
+
+        ingest_samples: Dict[str, List[float]] = defaultdict(list)
+        print(f"Ingesting {args.documents} documents of ~{args.document_words} words into {args.projects} project(s)...")
+        ingestion = ingest(args, config, sync_sessions, async_url, storage, qdrant_service, corpus, project_ids, user_id, ingest_samples)
+        print(
+            f"Ingestion: {ingestion['completed']}/{ingestion['documents']} documents, {ingestion['chunks']} chunks in "
+            f"{ingestion['consume_seconds']} s -> {ingestion['documents_per_second']} documents/s, "
+            f"{ingestion['chunks_per_second']} chunks/s ({ingestion['failed']} failed; upload {ingestion['upload_seconds']} s)"
+        )
+        ingestion["stages"] = summarize(ingest_samples)
+        print_stages(ingestion["stages"])
+
+        chat_samples: Dict[str, List[float]] = defaultdict(list)
+        with ServerThread(build_chat_app(async_url, config, qdrant_service, user_id)) as api_server:
+            chat = asyncio.run(chat_load(api_server.url, chat_ids, questions, args.requests, chat_samples))
+        print(
+            f"\nChat: {chat['requests']} requests from {chat['concurrency']} clients in {chat['seconds']} s -> "
+            f"{chat['requests_per_second']} requests/s ({chat['errors']} errors)"
+        )
+        chat["stages"] = summarize(chat_samples)
+        print_stages(chat["stages"])
+
+    sync_engine.dispose()
+    return {"settings": vars(args), "ingestion": ingestion, "chat": chat}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="Default: a SQLite file in the work directory. PostgreSQL: use a scratch database")
+    parser.add_argument("--documents", type=int, default=200)
+    parser.add_argument("--document-words", type=int, default=1500)
+    parser.add_argument("--sections", type=int, default=8, help="H2 sections per document")
+    parser.add_argument("--vocabulary", type=int, default=3000, help="Distinct words of the synthetic corpus")
+    parser.add_argument("--projects", type=int, default=1)
+    parser.add_argument("--upload-batch", type=int, default=20, help="Files per upload request")
+    parser.add_argument("--requests", type=int, default=500, help="Chat messages sent in total")
+    parser.add_argument("--concurrency", type=int, default=20, help="Concurrent chat clients, each in its own chat")
+    parser.add_argument("--embedder", choices=("model", "hash"), default="model",
+                        help="model: the configured SentenceTransformer; hash: hashed-word vectors, no download")
+    parser.add_argument("--refinement", choices=("never", "auto", "always"), default="never",
+                        help="MARKDOWN_REFINEMENT_POLICY; 'always' sends every document through the fake LLM")
+    add_latency_arguments(parser)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="Also write the results to this file")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(args.log_level.upper()) # The consumer module configures INFO logging on import
+    configure_tracing("rag-benchmark")
+    try:
+        with tempfile.TemporaryDirectory(prefix="bench_rag_") as workdir:
+            results = run(args, workdir)
+    finally:
+        shutdown_tracing()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+OpenAI-compatible chat completions server with configurable latency, standing in for the LLM provider
+in benchmarks (see bench_rag). Serves POST /v1/chat/completions:
+
+- streamed requests: `--answer-tokens` one-word deltas, the first after `--ttft` seconds and the others
+  `--token-delay` apart, then a usage chunk (stream_options.include_usage)
+- JSON requests (response_format json_object, i.e. the RAG decision): {"need_rag": ..., "reason": ...},
+  need_rag true for a `--rag-ratio` share of them
+- requests with a developer/system message (Markdown conversion): the user message back, as is
+- other requests (query enrichment): the last `--query-words` words of the prompt
+
+Non-streamed responses take `--completion-latency` seconds. Token counts are word counts.
+
+Usage (from backend/), e.g. to point a running API at it with GEMINI_API_BASE_URL=http://127.0.0.1:8089/v1:
+    python -m benchmarks.fake_openai [--port 8089 --ttft 0.3 --token-delay 0.02 --answer-tokens 200]
+"""
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+ANSWER_WORDS = "the manual describes this procedure in detail and lists each step with its requirements".split()
+
+
+@dataclass
+class FakeLLMSettings:
+    ttft: float = 0.3
+    token_delay: float = 0.02
+    answer_tokens: int = 200
+    completion_latency: float = 0.4
+    rag_ratio: float = 1.0
+    query_words: int = 16
+
+
+def _words(messages) -> int:
+    return sum(len(str(message.get("content") or "").split()) for message in messages)
+
+
+def build_app(settings: FakeLLMSettings) -> FastAPI:
+    app = FastAPI()
+
+    def completion_content(body: dict) -> str:
+        messages = body.get("messages") or []
+        if (body.get("response_format") or {}).get("type") == "json_object":
+            need_rag = random.random() < settings.rag_ratio
+            return json.dumps({"need_rag": need_rag, "reason": "benchmark"})
+        user_messages = [message for message in messages if message.get("role") == "user"]
+        prompt = str(user_messages[-1].get("content") or "") if user_messages else ""
+        if any(message.get("role") in ("developer", "system") for message in messages):
+            return prompt
+        return " ".join(prompt.split()[-settings.query_words:])
+
+    async def stream(body: dict):
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+
+        def chunk(choices, usage=None) -> str:
+            payload = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": created,
+                "model": body.get("model", "fake"), "choices": choices, "usage": usage
+            }
+            return f"data: {json.dumps(payload)}\n\n"
+
+        await asyncio.sleep(settings.ttft)
+        for i in range(settings.answer_tokens):
+            if i:
+                await asyncio.sleep(settings.token_delay)
+            word = ANSWER_WORDS[i % len(ANSWER_WORDS)]
+            yield chunk([{"index": 0, "delta": {"content": word if i == 0 else f" {word}"}, "finish_reason": None}])
+        yield chunk([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if (body.get("stream_options") or {}).get("include_usage"):
+            prompt_tokens = _words(body.get("messages") or [])
+            yield chunk([], {
+                "prompt_tokens": prompt_tokens, "completion_tokens": settings.answer_tokens,
+                "total_tokens": prompt_tokens + settings.answer_tokens
+            })
+        yield "data: [DONE]\n\n"
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        if body.get("stream"):
+            return StreamingResponse(stream(body), media_type="text/event-stream")
+
+        await asyncio.sleep(settings.completion_latency)
+        content = completion_content(body)
+        prompt_tokens, completion_tokens = _words(body.get("messages") or []), len(content.split())
+        return JSONResponse({
+            "id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion", "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+        })
+
+    return app
+
+
+class ServerThread:
+    """Serves an ASGI app with uvicorn on 127.0.0.1 from a daemon thread with its own event loop."""
+
+    def __init__(self, app, port: int = 0):
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", access_log=False))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+        self.port = port
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self) -> "ServerThread":
+        self.thread.start()
+        while not self.server.started:
+            if not self.thread.is_alive():
+                raise RuntimeError("Server failed to start")
+            time.sleep(0.01)
+        self.port = self.server.servers[0].sockets[0].getsockname()[1]
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.server.should_exit = True
+        self.thread.join()
+
+
+def add_latency_arguments(parser: argparse.ArgumentParser) -> None:
+    defaults = FakeLLMSettings()
+    parser.add_argument("--ttft", type=float, default=defaults.ttft, help="Seconds before the first streamed token")
+    parser.add_argument("--token-delay", type=float, default=defaults.token_delay, help="Seconds between streamed tokens")
+    parser.add_argument("--answer-tokens", type=int, default=defaults.answer_tokens, help="Tokens of each streamed answer")
+    parser.add_argument("--completion-latency", type=float, default=defaults.completion_latency, help="Seconds per non-streamed completion")
+    parser.add_argument("--rag-ratio", type=float, default=defaults.rag_ratio, help="Share of RAG decisions answering need_rag")
+
+
+def settings_from_args(args) -> FakeLLMSettings:
+    return FakeLLMSettings(
+        ttft=args.ttft, token_delay=args.token_delay, answer_tokens=args.answer_tokens,
+        completion_latency=args.completion_latency, rag_ratio=args.rag_ratio
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8089)
+    add_latency_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(build_app(settings_from_args(args)), host="127.0.0.1", port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
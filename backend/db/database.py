@@ -1,8 +1,11 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 from sqlalchemy.pool import NullPool
 import logging
+import time
 from app.config.config import getConfig # Import your getConfig
+from app.core.metrics import DB_POOL_WAIT_SECONDS, track_pool
 
 # Load environment variables (done by getConfig now)
 # load_dotenv() # No longer needed here if getConfig handles it
@@ -31,4 +34,43 @@ def get_db_session():
     try:
         yield session
     finally:
-        session.close()
\ No newline at end of file
+        session.close()
+
+# Asynchronous Engine (psycopg 3 async) for FastAPI handlers, so queries do not block the event loop.
+# Pooled: connections are reused across requests rather than opened per session
+async_engine = create_async_engine(
+    DATABASE_URL,
+    echo=getattr(current_config, 'SQLALCHEMY_ECHO', False),
+    pool_size=current_config.DB_POOL_SIZE,
+    max_overflow=current_config.DB_MAX_OVERFLOW,
+    pool_timeout=current_config.DB_POOL_TIMEOUT,
+    pool_pre_ping=True
+)
+
+track_pool(async_engine.pool)
+
+# Sync sessions behind the async ones; their events time each connection checkout. A session only
+# checks out a connection when it first runs a query: autobegin creates the transaction right before
+# taking it from the pool, and after_begin fires once it is checked out (and pre-pinged).
+TimedSession = sessionmaker()
+
+@event.listens_for(TimedSession, "after_transaction_create")
+def _checkout_started(session, transaction):
+    if transaction.parent is None:
+        session.info["checkout_started"] = time.perf_counter()
+
+@event.listens_for(TimedSession, "after_begin")
+def _checkout_finished(session, transaction, connection):
+    started = session.info.pop("checkout_started", None)
+    if started is not None:
+        DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - started)
+
+# Asynchronous Session Factory
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, sync_session_class=TimedSession, autoflush=False, expire_on_commit=False
+)
+
+# Dependency to get an async database session
+async def get_async_db_session():
+    async with AsyncSessionLocal() as session:
+        yield session
@@ -0,0 +1,42 @@
+import argparse
+import glob
+import logging
+import os
+import sys
+
+# Add project root to Python path (same layout as run_consumer.py)
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = current_dir
+
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from app.consumers.document_consumer import bulk_ingest_markdown_files
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk-import Markdown/text files into a project, chunking them in parallel.")
+    parser.add_argument("paths", nargs="+", help="Files, directories or glob patterns (directories are searched for *.md and *.txt)")
+    parser.add_argument("--project-id", type=int, required=True)
+    parser.add_argument("--user-id", type=int, required=True, help="User recorded as the uploader")
+    parser.add_argument("--workers", type=int, default=None, help="Chunking processes (default: CHUNKING_MAX_WORKERS or CPU count)")
+    args = parser.parse_args()
+
+    file_paths = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            for pattern in ("**/*.md", "**/*.txt"):
+                file_paths.extend(glob.glob(os.path.join(path, pattern), recursive=True))
+        else:
+            file_paths.extend(glob.glob(path) or [path])
+    file_paths = sorted(set(file_paths))
+
+    logger.info(f"Bulk ingesting {len(file_paths)} files into project {args.project_id}...")
+    try:
+        counts = bulk_ingest_markdown_files(file_paths, args.project_id, args.user_id, max_workers=args.workers)
+    except Exception as e:
+        logger.critical(f"Bulk ingest failed: {e}", exc_info=True)
+        sys.exit(1)
+    sys.exit(1 if counts["failed"] else 0)
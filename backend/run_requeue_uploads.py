@@ -0,0 +1,35 @@
+import argparse
+import logging
+import os
+import sys
+
+# Add project root to Python path (same layout as run_consumer.py)
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = current_dir
+
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from app.consumers.document_consumer import requeue_failed_uploads
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Requeue failed document uploads. The consumer resumes each one after its last completed stage."
+    )
+    parser.add_argument("upload_ids", nargs="*", type=int, help="DocumentUpload IDs (default: every failed upload)")
+    parser.add_argument("--project-id", type=int, default=None, help="Only uploads of this project")
+    parser.add_argument(
+        "--stale-minutes", type=int, default=None,
+        help="Also requeue uploads stuck in 'processing' for at least this many minutes"
+    )
+    parser.add_argument("--dry-run", action="store_true", help="List the uploads without requeueing them")
+    args = parser.parse_args()
+
+    requeued = requeue_failed_uploads(
+        upload_ids=args.upload_ids or None, project_id=args.project_id,
+        stale_minutes=args.stale_minutes, dry_run=args.dry_run
+    )
+    print(f"{'Would requeue' if args.dry_run else 'Requeued'} {len(requeued)} uploads: {requeued}")
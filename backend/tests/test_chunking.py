@@ -0,0 +1,194 @@
+import re
+
+from app.services.chunking import (
+    _split_text_recursive,
+    _tail_within,
+    chunk_markdown,
+    chunk_markdown_batch,
+    diff_chunks,
+    make_token_length_function,
+    page_marker,
+)
+
+SEPARATORS = ["\n\n", "\n", ". ", "! ", "? ", " ", ""]
+
+
+class WhitespaceTokenizer:
+    """Stand-in for a HuggingFace tokenizer: one token per whitespace-separated word."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def encode(self, text, add_special_tokens=False):
+        self.calls += 1
+        return text.split()
+
+
+def test_token_length_function_caches_lines():
+    tokenizer = WhitespaceTokenizer()
+    token_length = make_token_length_function(tokenizer)
+
+    assert token_length("one two three\nfour five") == 5
+    assert token_length("one two three\nfour five\none two three") == 8
+    # Only the two distinct lines were ever tokenized
+    assert tokenizer.calls == 2
+
+
+def test_tail_within_measures_each_word_once():
+    measured = []
+
+    def word_count(text):
+        measured.append(text)
+        return len(text.split())
+
+    text = " ".join(f"word{i}" for i in range(1000))
+
+    tail = _tail_within(text, 50, word_count)
+
+    assert tail == " ".join(f"word{i}" for i in range(950, 1000))
+    # The 50 words of the tail plus the one that no longer fits, each on its own
+    assert len(measured) == 51 and all(" " not in text for text in measured)
+
+
+def test_split_text_recursive_respects_token_budget():
+    token_length = make_token_length_function(WhitespaceTokenizer())
+    text = ("Lorem ipsum dolor sit amet. " * 30 + "\n\n") * 10
+
+    chunks = _split_text_recursive(text, 50, SEPARATORS, chunk_overlap=5, length_function=token_length)
+
+    assert chunks
+    assert all(token_length(chunk) <= 50 for chunk in chunks)
+
+
+def test_chunk_markdown_token_mode_produces_fewer_chunks_than_chars():
+    token_length = make_token_length_function(WhitespaceTokenizer())
+    markdown = "# Title\n\n" + ("Một câu tiếng Việt khá dài để kiểm tra. " * 200)
+
+    by_tokens = chunk_markdown(markdown, max_chunk_size=200, chunk_overlap=10, length_function=token_length)
+    by_chars = chunk_markdown(markdown, max_chunk_size=200, chunk_overlap=10)
+
+    assert all(token_length(chunk["text"]) <= 200 for chunk in by_tokens)
+    assert len(by_tokens) < len(by_chars)
+
+
+def test_split_text_recursive_character_fallback_keeps_overlap():
+    chunks = _split_text_recursive("abcdefghij" * 3, 12, [""], chunk_overlap=2)
+
+    assert chunks == ["abcdefghijab", "abcdefghijab", "abcdefghij"]
+
+
+def test_split_text_recursive_keeps_separators_on_following_chunk():
+    chunks = _split_text_recursive("one two. three four. five six.", 12, SEPARATORS, chunk_overlap=0)
+
+    assert chunks == ["one two", ". three four", ". five six."]
+
+
+def test_split_text_recursive_handles_large_unbroken_text():
+    minified = "function(){return a+b;}" * 20000
+
+    chunks = _split_text_recursive(minified, 1000, SEPARATORS, chunk_overlap=50)
+
+    assert all(len(chunk) <= 1000 for chunk in chunks)
+    # Each chunk after the first starts with the previous chunk's last 50 characters
+    assert all(prev[-50:] == chunk[:50] for prev, chunk in zip(chunks, chunks[1:]))
+    assert sum(len(chunk) - 50 for chunk in chunks[1:]) + len(chunks[0]) == len(minified)
+
+
+def _code_heavy_markdown(block_count):
+    code_blocks = []
+    sections = ["# Guide\n"]
+    for i in range(block_count):
+        # Lines starting with "#" inside code must not be treated as headers
+        code = "```python\n" + "\n".join(f"# step {i} line {j}\nvalue_{j} = {j} * {i}" for j in range(i % 40 + 1)) + "\n```"
+        code_blocks.append(code)
+        sections.append(f"\n## Step {i}\n\n" + f"Explanation for step {i}. " * (i % 5 + 1) + "\n\n" + code + "\n\nDone.\n")
+    return "".join(sections), code_blocks
+
+
+def test_chunk_markdown_restores_hundreds_of_code_blocks_intact():
+    markdown, code_blocks = _code_heavy_markdown(300)
+
+    chunks = chunk_markdown(markdown, split_level=1, max_chunk_size=500, chunk_overlap=50)
+    texts = [chunk["text"] for chunk in chunks]
+
+    assert not any("CODEBLOCK_PLACEHOLDER" in text for text in texts)
+    assert all(text.count("```") % 2 == 0 for text in texts)
+    for code in code_blocks:
+        assert any(code in text for text in texts)
+
+
+def test_chunk_markdown_keeps_oversized_code_block_in_its_own_chunk():
+    markdown, code_blocks = _code_heavy_markdown(60)
+
+    chunks = chunk_markdown(markdown, split_level=1, max_chunk_size=300, chunk_overlap=30)
+
+    oversized = [chunk["text"] for chunk in chunks if len(chunk["text"]) > 300]
+    assert oversized
+    assert all(text in code_blocks for text in oversized)
+
+
+def test_chunk_markdown_splits_code_by_characters_like_plain_text():
+    code = "```python\nfor row in rows:\n    total += row.amount\nprint(total)\n```"
+    paragraphs = [f"Paragraph {i} explains the report totals in a few words. " * 3 for i in range(12)]
+    paragraphs[5] = code + "\nThe loop above adds every amount to the running total."
+    markdown = "\n\n".join(paragraphs)
+    # The same document with the code block as plain text of equal length, split by the character splitter
+    filler = "x" * len(code)
+    expected = _split_text_recursive(markdown.replace(code, filler), 400, SEPARATORS, chunk_overlap=30)
+
+    chunks = [chunk["text"] for chunk in chunk_markdown(markdown, max_chunk_size=400, chunk_overlap=30)]
+
+    assert chunks == [text.replace(filler, code) for text in expected]
+    # Overlap is still measured in characters, not trimmed to whole words
+    assert all(prev[-30:] == chunk[:30] for prev, chunk in zip(chunks, chunks[1:]))
+
+
+def test_chunk_markdown_batch_yields_in_input_order():
+    documents = [(f"# Doc {i}\n\n" + f"Sentence number {i}. " * (i * 20 + 1), str(i)) for i in range(12)]
+
+    batched = list(chunk_markdown_batch(iter(documents), max_workers=2, max_chunk_size=200, chunk_overlap=20))
+    serial = [chunk_markdown(text, max_chunk_size=200, chunk_overlap=20, source_document=source) for text, source in documents]
+
+    assert [[chunk["text"] for chunk in chunks] for chunks in batched] == [[chunk["text"] for chunk in chunks] for chunks in serial]
+    assert [chunks[0]["metadata"]["source_document_id"] for chunks in batched] == [source for _, source in documents]
+
+
+def test_diff_chunks_only_reembeds_edited_section():
+    sections = [f"## Section {i}\n\n" + f"Paragraph text for section {i}. " * 60 for i in range(10)]
+    previous = chunk_markdown("# Manual\n\n" + "\n".join(sections), max_chunk_size=400, chunk_overlap=20)
+    previous_rows = [(chunk["metadata"]["chunk_id"], chunk["metadata"]["content_hash"]) for chunk in previous]
+
+    sections[4] = sections[4].replace("section 4.", "section four, revised.")
+    updated = chunk_markdown("# Manual\n\n" + "\n".join(sections), max_chunk_size=400, chunk_overlap=20)
+    new_chunks, reused_chunks, removed_ids = diff_chunks(previous_rows, updated)
+
+    assert new_chunks and all(chunk["metadata"]["headers"]["h2"] == "Section 4" for chunk in new_chunks)
+    assert reused_chunks and len(new_chunks) + len(reused_chunks) == len(updated)
+    # Unchanged chunks take over the ids of the previous version's rows
+    previous_ids = {chunk_id for chunk_id, _ in previous_rows}
+    assert all(chunk["metadata"]["chunk_id"] in previous_ids for chunk in reused_chunks)
+    assert len(removed_ids) == len(previous) - len(reused_chunks)
+
+
+def test_diff_chunks_removes_rows_without_content_hash():
+    chunks = chunk_markdown("# Title\n\nShort text.")
+
+    new_chunks, reused_chunks, removed_ids = diff_chunks([("legacy-id", None)], chunks)
+
+    assert new_chunks == chunks and reused_chunks == []
+    assert removed_ids == ["legacy-id"]
+
+
+def test_chunk_markdown_records_pages_from_page_markers():
+    markdown = "# Manual\n\n"
+    for page in range(1, 6):
+        heading = f"## Chapter {page}\n\n" if page % 2 else ""
+        markdown += page_marker(page) + heading + f"Words on page {page}. " * 40 + "\n\n"
+
+    chunks = chunk_markdown(markdown, max_chunk_size=300, chunk_overlap=0)
+
+    assert not any("<!-- page" in chunk["text"] for chunk in chunks)
+    for chunk in chunks:
+        # Every page whose text is in the chunk is listed, in order
+        assert chunk["metadata"]["pages"] == sorted({int(n) for n in re.findall(r"page (\d+)\.", chunk["text"])})
+    assert sorted({page for chunk in chunks for page in chunk["metadata"]["pages"]}) == [1, 2, 3, 4, 5]
@@ -0,0 +1,63 @@
+from app.services.conversion_policy import (
+    POLICY_ALWAYS,
+    REFINE_ALL,
+    REFINE_NONE,
+    REFINE_SECTIONS,
+    plan_refinement,
+    section_stats,
+    split_sections,
+)
+
+CLEAN_SECTION = "## Section {i}\n\n" + "A clear paragraph about the topic at hand. " * 30 + "\n\n"
+PIPE_TABLE = "| Year | Revenue | Cost |\n|------|---------|------|\n| 2023 | 1,200 | 800 |\n| 2024 | 1,350 | 900 |\n"
+LOOSE_TABLE = "Year    Revenue    Cost\n2023    1,200      800\n2024    1,350      900\n"
+
+
+def _document(sections):
+    return "# Annual report\n\n" + "".join(sections)
+
+
+def test_split_sections_keeps_text_and_ignores_headings_in_code():
+    markdown = "# Title\n\nIntro\n\n```bash\n# not a heading\n```\n\n## Part\n\nBody\n"
+
+    sections = split_sections(markdown)
+
+    assert "".join(sections) == markdown
+    assert [section.splitlines()[0] for section in sections] == ["# Title", "## Part"]
+
+
+def test_section_stats_detect_loose_tables_and_garbage():
+    assert section_stats("## Table\n\n" + LOOSE_TABLE).loose_table_ratio == 1.0
+    assert section_stats("## Table\n\n" + PIPE_TABLE).loose_table_ratio == 0.0
+    assert section_stats("## Code\n\n```\na    b    c\n```\n").loose_table_ratio == 0.0
+    assert section_stats("Ã¢â‚¬�� text").garbage_ratio > 0.01
+
+
+def test_markdown_and_clean_docx_skip_llm():
+    clean = _document([CLEAN_SECTION.format(i=i) + PIPE_TABLE for i in range(5)])
+
+    assert plan_refinement("text/markdown", clean).mode == REFINE_NONE
+    assert plan_refinement("text/plain", "Just some notes without headings. " * 500).mode == REFINE_NONE
+    docx = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+    assert plan_refinement(docx, clean).mode == REFINE_NONE
+    assert plan_refinement(docx, clean, POLICY_ALWAYS).mode == REFINE_ALL
+
+
+def test_only_low_quality_sections_are_refined():
+    sections = [CLEAN_SECTION.format(i=i) for i in range(6)]
+    sections[2] += LOOSE_TABLE * 3
+    sections[4] = sections[4].replace("topic", "t��pic")
+
+    plan = plan_refinement("application/pdf", _document(sections))
+
+    assert plan.mode == REFINE_SECTIONS
+    # Section 0 is the document title, so section i of the list is plan section i + 1
+    assert plan.refine_indices == [3, 5]
+    assert "".join(plan.sections) == _document(sections)
+
+
+def test_unstructured_or_empty_conversion_is_refined_in_full():
+    pdf_text = "Line of extracted pdf text without any structure\n" * 400
+
+    assert plan_refinement("application/pdf", pdf_text).mode == REFINE_ALL
+    assert plan_refinement("application/pdf", "").mode == REFINE_ALL
@@ -0,0 +1,251 @@
+import asyncio
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.config.config import getConfig
+from app.llm_providers.prompt_factory import ChatPromptFactory
+from app.models.models import Base, Document, DocumentChunk, DocumentUpload, Project
+from app.services.chunking import chunk_markdown
+from app.services.markdown_conversion import conversion_cache_key
+from app.services.rabbitmq import ATTEMPT_HEADER, MAX_ATTEMPTS_HEADER
+from app.services.storage import LocalStorage
+
+# The consumer imports QdrantService, which loads sentence_transformers
+pytest.importorskip("sentence_transformers")
+from app.consumers import document_consumer  # noqa: E402
+
+
+class FakeChannel:
+    def __init__(self):
+        self.published = []
+        self.acked = []
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        self.published.append((exchange, routing_key, properties.headers))
+
+    def basic_ack(self, delivery_tag):
+        self.acked.append(delivery_tag)
+
+
+class UnreachableStorage:
+    """Fails like an object store that cannot be reached."""
+
+    def copy(self, source_path, key, content_type=None):
+        raise ConnectionError("storage unreachable")
+
+
+class FakeQdrant:
+    """Records vector store calls; every text embeds to the same vector."""
+
+    def __init__(self):
+        self.upserted = []
+        self.deleted_points = []
+        self.deleted_documents = []
+
+    def get_embeddings(self, texts):
+        return [[0.0, 1.0] for _ in texts]
+
+    def upsert_chunks(self, points):
+        self.upserted.extend(point.id for point in points)
+
+    def set_payloads(self, payloads):
+        pass
+
+    def delete_points(self, point_ids):
+        self.deleted_points.extend(point_ids)
+
+    def delete_document_points(self, document_id):
+        self.deleted_documents.append(document_id)
+
+
+class BulkQdrant(FakeQdrant):
+    """FakeQdrant that counts the registered documents at each embedding and fails on "broken" text."""
+    client = embedding_model = object()
+
+    def __init__(self, sessions):
+        super().__init__()
+        self.sessions = sessions
+        self.documents_at_embedding = []
+
+    def get_embeddings(self, texts):
+        with self.sessions() as db:
+            self.documents_at_embedding.append(db.query(Document).count())
+        if any("broken" in text for text in texts):
+            raise ConnectionError("embedding service unreachable")
+        return super().get_embeddings(texts)
+
+
+@pytest.fixture
+def sessions(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path}/app.db")
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+    monkeypatch.setattr(document_consumer, "SessionLocal", factory)
+    staged = tmp_path / "report.txt"
+    staged.write_text("quarterly report")
+    with factory() as db:
+        db.add(Project(id=1, project_name="Reports"))
+        db.add(DocumentUpload(
+            id=1, file_name="report.txt", file_size=16, content_type="text/plain", file_hash="abc",
+            temp_path=str(staged), project_id=1, user_id=1, status="pending"
+        ))
+        db.commit()
+    return factory
+
+
+def _deliver(channel, headers):
+    body = json.dumps({"document_upload_id": 1}).encode()
+    asyncio.run(document_consumer.process_message_callback(
+        channel, SimpleNamespace(delivery_tag=9), SimpleNamespace(headers=headers), body,
+        None, UnreachableStorage(), getConfig()
+    ))
+
+
+def test_transient_failure_is_scheduled_for_retry(sessions):
+    channel = FakeChannel()
+
+    _deliver(channel, {ATTEMPT_HEADER: 1})
+
+    queue_name = getConfig().RABBITMQ_DOCUMENT_QUEUE
+    [(exchange, routing_key, headers)] = channel.published
+    assert exchange == "" and routing_key.startswith(f"{queue_name}.retry.")
+    assert headers[ATTEMPT_HEADER] == 2
+    assert channel.acked == [9]
+    with sessions() as db:
+        upload = db.get(DocumentUpload, 1)
+        assert upload.status == "retrying"
+        assert "storage unreachable" in upload.error_message
+
+
+def test_failure_on_the_last_attempt_is_dead_lettered(sessions):
+    channel = FakeChannel()
+
+    _deliver(channel, {ATTEMPT_HEADER: 3, MAX_ATTEMPTS_HEADER: 3})
+
+    queue_name = getConfig().RABBITMQ_DOCUMENT_QUEUE
+    [(exchange, routing_key, headers)] = channel.published
+    assert (exchange, routing_key) == (f"{queue_name}.dlx", queue_name)
+    assert headers[ATTEMPT_HEADER] == 3
+    assert channel.acked == [9]
+    with sessions() as db:
+        assert db.get(DocumentUpload, 1).status == "error"
+
+
+def _indexed_document(db, storage, document_id, markdown):
+    file_path = storage.save_bytes(markdown.encode(), f"project_1/{document_id}/guide.md", "text/markdown")
+    markdown_link = storage.save_bytes(markdown.encode(), f"markdowns/project_1/{document_id}/guide.md", "text/markdown")
+    document = Document(
+        id=document_id, file_path=file_path, markdown_s3_link=markdown_link, file_name="guide.md", file_size=len(markdown),
+        file_hash=f"hash-{document_id}", project_id=1, uploaded_by=1
+    )
+    db.add(document)
+    db.commit()
+    return document
+
+
+def test_same_named_upload_replaces_only_the_document_it_names(sessions, tmp_path):
+    storage = LocalStorage(str(tmp_path / "store"))
+    qdrant = FakeQdrant()
+    sections = "\n\n".join(f"## Step {i}\n\n" + f"Instructions for step {i}. " * 20 for i in range(4))
+    with sessions() as db:
+        unrelated = _indexed_document(db, storage, 1, sections)
+        document_consumer._index_chunks(db, unrelated, chunk_markdown(sections, split_level=2, max_chunk_size=300, chunk_overlap=0, source_document="1"), qdrant)
+        old = _indexed_document(db, storage, 2, sections)
+        document_consumer._index_chunks(db, old, chunk_markdown(sections, split_level=2, max_chunk_size=300, chunk_overlap=0, source_document="2"), qdrant)
+        old_paths = [old.file_path, old.markdown_s3_link]
+        qdrant.upserted.clear()
+
+        edited = sections.replace("step 3.", "step three.")
+        new = _indexed_document(db, storage, 3, edited)
+        doc_upload = db.get(DocumentUpload, 1)
+        doc_upload.replaces_document_id = 2
+        text_chunks = chunk_markdown(edited, split_level=2, max_chunk_size=300, chunk_overlap=0, source_document="3")
+        document_consumer._index_chunks(db, new, text_chunks, qdrant, doc_upload=doc_upload, storage=storage)
+
+        assert db.get(Document, 2) is None
+        assert {document.id for document in db.query(Document)} == {1, 3}
+        assert db.query(DocumentChunk).filter(DocumentChunk.document_id == 1).count() > 0
+        # Only the edited section is embedded again
+        assert 0 < len(qdrant.upserted) < len(text_chunks)
+        assert qdrant.deleted_documents == [2]
+    assert not any(os.path.exists(path) for path in old_paths)
+    assert os.path.exists(unrelated.file_path) and os.path.exists(new.markdown_s3_link)
+
+
+def test_cached_conversion_is_copied_to_the_new_documents_own_key(sessions, tmp_path):
+    storage = LocalStorage(str(tmp_path / "store"))
+    config = getConfig()
+    conversion_key = conversion_cache_key("abc", ChatPromptFactory.to_markdown_prompt(), config.GEMINI_MODEL, config.MARKDOWN_REFINEMENT_POLICY)
+    cached_link = storage.save_bytes(b"# Quarterly report\n\nRevenue grew.", "markdowns/project_2/abc/abc.md", "text/markdown")
+    with sessions() as db:
+        db.add(Project(id=2, project_name="Archive"))
+        db.add(Document(
+            id=5, file_path="x", markdown_s3_link=cached_link, conversion_key=conversion_key, file_name="report.txt", file_size=16,
+            file_hash="abc", project_id=2, uploaded_by=1
+        ))
+        db.commit()
+    channel = FakeChannel()
+
+    asyncio.run(document_consumer.process_message_callback(
+        channel, SimpleNamespace(delivery_tag=9), SimpleNamespace(headers={}), json.dumps({"document_upload_id": 1}).encode(),
+        FakeQdrant(), storage, config
+    ))
+
+    with sessions() as db:
+        upload = db.get(DocumentUpload, 1)
+        assert upload.status == "completed"
+        markdown_link = db.get(Document, upload.document_id).markdown_s3_link
+    assert markdown_link == storage.path_for("markdowns/project_1/abc/abc.md")
+    storage.delete(cached_link)
+    assert storage.read_bytes(markdown_link) == b"# Quarterly report\n\nRevenue grew."
+
+
+@pytest.fixture
+def bulk_files(sessions, tmp_path, monkeypatch):
+    monkeypatch.setattr(document_consumer, "init_storage", lambda: LocalStorage(str(tmp_path / "store")))
+    qdrant = BulkQdrant(sessions)
+    monkeypatch.setattr(document_consumer, "QdrantService", lambda settings: qdrant)
+    paths = []
+    for name, text in [("intro.md", "# Intro\n\nWelcome."), ("setup.md", "# Setup\n\nbroken step."), ("usage.md", "# Usage\n\nRun it.")]:
+        path = tmp_path / name
+        path.write_text(text)
+        paths.append(str(path))
+    return paths, qdrant
+
+
+def test_bulk_ingest_registers_files_lazily_and_retries_failed_ones(sessions, bulk_files):
+    paths, qdrant = bulk_files
+
+    counts = document_consumer.bulk_ingest_markdown_files(paths, project_id=1, user_id=1, max_workers=1)
+
+    assert counts == {"ingested": 2, "skipped": 0, "failed": 1}
+    # Each file is registered just before it is chunked, not all of them up front
+    assert qdrant.documents_at_embedding == [1, 2, 2]
+    with sessions() as db:
+        assert sorted(document.file_name for document in db.query(Document)) == ["intro.md", "usage.md"]
+    # The failed file was removed again, so the next run ingests it instead of skipping it as a duplicate
+    counts = document_consumer.bulk_ingest_markdown_files(paths, project_id=1, user_id=1, max_workers=1)
+    assert counts == {"ingested": 0, "skipped": 2, "failed": 1}
+
+
+def test_bulk_ingest_discards_documents_left_unindexed_by_a_chunking_failure(sessions, bulk_files, monkeypatch):
+    paths, _ = bulk_files
+
+    def crashing_batch(documents, **kwargs):
+        for index, (markdown, source_document) in enumerate(documents):
+            if index == 1:
+                raise RuntimeError("chunking worker crashed")
+            yield chunk_markdown(markdown, source_document=source_document)
+
+    monkeypatch.setattr(document_consumer, "chunk_markdown_batch", crashing_batch)
+
+    counts = document_consumer.bulk_ingest_markdown_files(paths, project_id=1, user_id=1, max_workers=1)
+
+    assert counts == {"ingested": 1, "skipped": 0, "failed": 1}
+    with sessions() as db:
+        assert [document.file_name for document in db.query(Document)] == ["intro.md"]
@@ -0,0 +1,101 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.models.models import Base, Document, DocumentUpload, Project, User
+from app.services.document import DocumentService
+from app.services.pagination import InvalidCursorError, decode_cursor, encode_cursor
+from app.services.storage import LocalStorage, set_storage
+
+
+@pytest.fixture
+def listing(tmp_path):
+    set_storage(LocalStorage(str(tmp_path)))
+    engine = create_engine(f"sqlite:///{tmp_path}/app.db")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    start = datetime(2025, 1, 1)
+    db.add_all([User(id=1, email="ann@example.com", username="ann", hashed_password="x"), Project(id=1, project_name="Reports")])
+    for i in range(1, 8):
+        content_type = "application/pdf" if i % 2 else "text/plain"
+        name = f"report_{i}.pdf" if i <= 4 else f"notes{i}.txt"
+        db.add(Document(id=i, file_path=f"s3://documents/{i}", file_name=name, file_size=i * 10, content_type=content_type,
+                        file_hash=f"{i:064d}", project_id=1, uploaded_by=1, created_at=start + timedelta(minutes=i % 3), updated_at=start))
+        db.add(DocumentUpload(id=i, project_id=1, file_name=name, file_hash=f"{i:064d}", file_size=i * 10, content_type=content_type,
+                              temp_path="", status="completed" if i <= 5 else "error", user_id=1, document_id=i if i <= 5 else None,
+                              created_at=start + timedelta(minutes=i % 3), updated_at=start))
+    db.commit()
+    session_factory = async_sessionmaker(bind=create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/app.db"))
+
+    def run(method, *args, **kwargs):
+        async def call():
+            async with session_factory() as async_db:
+                return await getattr(DocumentService(db=async_db, rabbitmq_service=None), method)(*args, **kwargs)
+        return asyncio.run(call())
+
+    yield run
+    set_storage(None)
+
+
+def _all_pages(listing, method, limit, **kwargs):
+    pages, cursor = [], None
+    while True:
+        items, cursor = listing(method, 1, cursor=cursor, limit=limit, **kwargs)
+        pages.append(items)
+        if cursor is None:
+            return pages
+
+
+def test_keyset_pages_cover_every_row_once_with_ties(listing):
+    # created_at repeats every third row, so the id tiebreaker decides the order
+    pages = _all_pages(listing, "get_documents", 3, sort="created_at", order="asc")
+    ids = [document.id for page in pages for document in page]
+
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert ids == [3, 6, 1, 4, 7, 2, 5]
+
+
+def test_with_status_filters_sort_and_counts(listing):
+    pages = _all_pages(listing, "get_documents_with_status", 2, name_prefix="report_", sort="file_name", order="desc")
+    rows = [row for page in pages for row in page]
+
+    assert [row["file_name"] for row in rows] == ["report_4.pdf", "report_3.pdf", "report_2.pdf", "report_1.pdf"]
+    assert rows[0]["file_path"] == "s3://documents/4"
+
+    errors, cursor = listing("get_documents_with_status", 1, statuses=["error"], limit=10)
+    assert sorted(row["upload_id"] for row in errors) == [6, 7] and cursor is None
+    assert errors[0]["file_path"] == "" and errors[0]["processing_status"] == "error"
+
+    assert listing("count_documents_with_status", 1) == {"completed": 5, "error": 2}
+    assert listing("count_documents_with_status", 1, content_type="text/plain") == {"completed": 2, "error": 1}
+    assert listing("count_documents", 1, name_prefix="notes") == 3
+
+
+def test_listing_without_limit_returns_every_row(listing):
+    documents, cursor = listing("get_documents", 1, sort="file_size", order="asc", limit=None)
+    uploads, upload_cursor = listing("get_documents_with_status", 1, limit=None)
+
+    assert [document.id for document in documents] == [1, 2, 3, 4, 5, 6, 7] and cursor is None
+    assert len(uploads) == 7 and upload_cursor is None
+
+
+def test_name_prefix_wildcards_are_literal(listing):
+    assert listing("count_documents", 1, name_prefix="report%") == 0
+    assert listing("count_documents", 1, name_prefix="report_") == 4
+
+
+def test_cursor_is_bound_to_its_sort(listing):
+    cursor = encode_cursor("created_at", "asc", datetime(2025, 1, 1, 0, 1), 4)
+    assert decode_cursor(cursor, "created_at", "asc") == (datetime(2025, 1, 1, 0, 1), 4)
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(cursor, "file_name", "asc")
+    with pytest.raises(InvalidCursorError):
+        decode_cursor("not-a-cursor", "created_at", "asc")
+    with pytest.raises(HTTPException) as error:
+        listing("get_documents", 1, sort="created_at", order="desc", cursor=cursor)
+    assert error.value.status_code == 400
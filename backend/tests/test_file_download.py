@@ -0,0 +1,91 @@
+import io
+
+from botocore.exceptions import ClientError
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from app.services.file_download import etag_matches, stored_file_response
+from app.services.storage import S3Storage
+
+DATA = bytes(range(256)) * 40
+
+
+class FakeBody(io.BytesIO):
+    def iter_chunks(self, chunk_size):
+        while chunk := self.read(chunk_size):
+            yield chunk
+
+
+class FakeS3:
+    """get_object with S3's Range and If-None-Match semantics for a single object."""
+
+    def __init__(self):
+        self.requests = []
+
+    def get_object(self, Bucket, Key, Range=None, IfNoneMatch=None):
+        self.requests.append({"Range": Range, "IfNoneMatch": IfNoneMatch})
+        if IfNoneMatch == '"s3-etag"':
+            raise ClientError({"Error": {"Code": "304"}}, "GetObject")
+        if Range:
+            start, end = (int(value) for value in Range.removeprefix("bytes=").split("-"))
+            body = DATA[start:end + 1]
+            return {"Body": FakeBody(body), "ContentLength": len(body), "ETag": '"s3-etag"',
+                    "ContentRange": f"bytes {start}-{end}/{len(DATA)}"}
+        return {"Body": FakeBody(DATA), "ContentLength": len(DATA), "ETag": '"s3-etag"'}
+
+
+def _client(stored_path, s3_client=None, etag=None):
+    app = FastAPI()
+
+    @app.get("/file")
+    def get_file(request: Request):
+        storage = S3Storage(s3_client, "documents") if s3_client else None
+        return stored_file_response(request, stored_path, "application/pdf", "report.pdf", storage=storage, etag=etag)
+
+    return TestClient(app)
+
+
+def test_etag_matching():
+    assert etag_matches('"a", W/"b"', '"b"')
+    assert etag_matches("*", '"a"')
+    assert not etag_matches('"a"', '"b"')
+    assert not etag_matches(None, '"a"')
+
+
+def test_s3_download_is_streamed_with_range_and_etag():
+    s3 = FakeS3()
+    client = _client("s3://documents/project_1/report.pdf", s3)
+
+    full = client.get("/file")
+    partial = client.get("/file", headers={"Range": "bytes=100-199"})
+    not_modified = client.get("/file", headers={"If-None-Match": '"s3-etag"'})
+
+    assert full.status_code == 200 and full.content == DATA
+    assert full.headers["etag"] == '"s3-etag"'
+    assert partial.status_code == 206 and partial.content == DATA[100:200]
+    assert partial.headers["content-range"] == f"bytes 100-199/{len(DATA)}"
+    assert not_modified.status_code == 304
+
+
+def test_content_etag_short_circuits_storage():
+    s3 = FakeS3()
+    client = _client("s3://documents/project_1/report.pdf", s3, etag='"abc"')
+
+    response = client.get("/file", headers={"If-None-Match": '"abc"'})
+
+    assert response.status_code == 304
+    assert s3.requests == []
+
+
+def test_local_download_supports_range_and_etag(tmp_path):
+    path = tmp_path / "report.pdf"
+    path.write_bytes(DATA)
+    client = _client(str(path))
+
+    full = client.get("/file")
+    partial = client.get("/file", headers={"Range": "bytes=0-9"})
+    not_modified = client.get("/file", headers={"If-None-Match": full.headers["etag"]})
+
+    assert full.content == DATA
+    assert partial.status_code == 206 and partial.content == DATA[:10]
+    assert not_modified.status_code == 304
@@ -0,0 +1,36 @@
+import asyncio
+
+from app.config.config import getConfig
+from app.llm_providers.llm_factory import LLMFactory
+
+
+def test_client_is_shared_within_an_event_loop_only(monkeypatch):
+    monkeypatch.setattr(getConfig(), "GEMINI_API_KEY", "test-key")
+    monkeypatch.setattr(getConfig(), "GEMINI_MODEL", "test-model")
+
+    async def two_clients():
+        return LLMFactory.create_async_client("gemini"), LLMFactory.create_async_client("gemini")
+
+    (first, model), (second, _) = asyncio.run(two_clients())
+    (other_loop, _), _ = asyncio.run(two_clients())
+
+    assert model == "test-model"
+    assert first is second
+    assert other_loop is not first
+
+
+def test_close_loop_clients_closes_and_forgets_the_loop_clients(monkeypatch):
+    monkeypatch.setattr(getConfig(), "GEMINI_API_KEY", "test-key")
+
+    async def close_then_reopen():
+        client, _ = LLMFactory.create_async_client("gemini")
+        await LLMFactory.close_loop_clients()
+        reopened, _ = LLMFactory.create_async_client("gemini")
+        await LLMFactory.close_loop_clients()
+        return client, reopened
+
+    client, reopened = asyncio.run(close_then_reopen())
+
+    assert client.is_closed()
+    assert reopened is not client
+    assert reopened.is_closed()
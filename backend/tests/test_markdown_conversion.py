@@ -0,0 +1,85 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.models.models import Base
+from app.services.markdown_conversion import conversion_cache_key, piece_cache_key, refine_markdown_with_llm
+
+engine = create_engine("sqlite://")
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+class FakeCompletions:
+    """Stand-in for client.chat.completions: echoes the piece as a heading, failing for pieces containing `fail_on`."""
+
+    def __init__(self, fail_on=None, error=None):
+        self.fail_on = fail_on
+        self.error = error or RuntimeError("empty choices")
+        self.calls = 0
+
+    async def create(self, messages, **kwargs):
+        self.calls += 1
+        piece = messages[0]["content"]
+        if self.fail_on and self.fail_on in piece:
+            raise self.error
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=f"# {piece[:20]}"))])
+
+
+def fake_client(fail_on=None, error=None):
+    return SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions(fail_on, error)))
+
+
+def test_cache_keys_change_with_prompt_and_model():
+    key = conversion_cache_key("abc", "prompt", "gemini-2.0-flash")
+
+    assert key == conversion_cache_key("abc", "prompt", "gemini-2.0-flash")
+    assert key != conversion_cache_key("abc", "prompt v2", "gemini-2.0-flash")
+    assert key != conversion_cache_key("abc", "prompt", "gpt-4o")
+    assert piece_cache_key("text", "prompt", "m") != piece_cache_key("text", "prompt", "n")
+
+
+def test_refine_resumes_from_piece_cache():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    db = TestingSessionLocal()
+    # Three pieces of 2000 words each
+    content = " ".join(f"Piece {i} " + "word " * 1998 + "end." for i in range(3))
+
+    failing = fake_client(fail_on="Piece 1 ")
+    markdown, complete = asyncio.run(refine_markdown_with_llm(db, content, failing, "m", "prompt", "manual.pdf"))
+    assert not complete
+    assert markdown.count("# Piece") == 2
+    assert failing.chat.completions.calls == 3
+
+    retry = fake_client()
+    markdown, complete = asyncio.run(refine_markdown_with_llm(db, content, retry, "m", "prompt", "manual.pdf"))
+    assert complete
+    assert markdown.split("\n\n") == [f"# Piece {i} word word wo" for i in range(3)]
+    # Only the piece that failed before is sent to the LLM again
+    assert retry.chat.completions.calls == 1
+    db.close()
+
+
+def test_transient_llm_error_is_raised_after_caching_converted_pieces():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    db = TestingSessionLocal()
+    content = " ".join(f"Piece {i} " + "word " * 1998 + "end." for i in range(3))
+    timeout = openai.APITimeoutError(request=httpx.Request("POST", "https://llm.test/v1/chat/completions"))
+
+    failing = fake_client(fail_on="Piece 1 ", error=timeout)
+    with pytest.raises(openai.APITimeoutError):
+        asyncio.run(refine_markdown_with_llm(db, content, failing, "m", "prompt", "manual.pdf"))
+    assert failing.chat.completions.calls == 2
+
+    retry = fake_client()
+    markdown, complete = asyncio.run(refine_markdown_with_llm(db, content, retry, "m", "prompt", "manual.pdf"))
+    assert complete
+    # Piece 0 was cached before the timeout
+    assert retry.chat.completions.calls == 2
+    db.close()
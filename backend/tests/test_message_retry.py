@@ -0,0 +1,78 @@
+import json
+from types import SimpleNamespace
+
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from app.consumers.retry_policy import PermanentProcessingError, is_retryable_error
+from app.services.rabbitmq import (
+    ATTEMPT_HEADER, MAX_ATTEMPTS_HEADER, declare_retry_topology, message_max_attempts,
+    publish_dead_letter, publish_retry, retry_delays_ms
+)
+
+CONFIG = SimpleNamespace(RABBITMQ_MAX_ATTEMPTS=5, RABBITMQ_RETRY_BASE_DELAY_MS=1000, RABBITMQ_RETRY_MAX_DELAY_MS=5000)
+
+
+class FakeChannel:
+    """Records declarations and publishes instead of talking to a broker."""
+
+    def __init__(self):
+        self.queues = {}
+        self.published = []
+
+    def queue_declare(self, queue, durable=False, arguments=None):
+        self.queues[queue] = arguments or {}
+
+    def exchange_declare(self, exchange, exchange_type, durable=False):
+        pass
+
+    def queue_bind(self, queue, exchange, routing_key):
+        pass
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        self.published.append((exchange, routing_key, properties.headers))
+
+
+def test_retry_delays_grow_exponentially_up_to_the_cap():
+    assert retry_delays_ms(CONFIG) == [1000, 2000, 4000, 5000]
+
+
+def test_retry_queues_dead_letter_back_to_the_work_queue():
+    channel = FakeChannel()
+
+    declare_retry_topology(channel, "docs", CONFIG)
+
+    assert channel.queues["docs.retry.4000"] == {
+        "x-message-ttl": 4000, "x-dead-letter-exchange": "", "x-dead-letter-routing-key": "docs"
+    }
+    assert "docs.dead" in channel.queues
+
+
+def test_publish_retry_counts_attempts():
+    channel = FakeChannel()
+    body = json.dumps({"document_upload_id": 1}).encode()
+
+    first = publish_retry(channel, "docs", body, SimpleNamespace(headers=None), "boom", CONFIG)
+    third = publish_retry(channel, "docs", body, SimpleNamespace(headers={ATTEMPT_HEADER: 3}), "boom", CONFIG)
+
+    assert (first, third) == (1000, 4000)
+    assert [routing_key for _, routing_key, _ in channel.published] == ["docs.retry.1000", "docs.retry.4000"]
+    assert [headers[ATTEMPT_HEADER] for _, _, headers in channel.published] == [2, 4]
+
+
+def test_dead_letter_goes_to_the_dlx_and_header_overrides_max_attempts():
+    channel = FakeChannel()
+
+    publish_dead_letter(channel, "docs", b"{}", SimpleNamespace(headers={ATTEMPT_HEADER: 5}), "boom")
+
+    assert channel.published[0][:2] == ("docs.dlx", "docs")
+    assert message_max_attempts(SimpleNamespace(headers={MAX_ATTEMPTS_HEADER: 2}), CONFIG) == 2
+    assert message_max_attempts(SimpleNamespace(headers=None), CONFIG) == 5
+
+
+def test_error_classification():
+    assert is_retryable_error(ConnectionError("refused"))
+    assert is_retryable_error(OperationalError("SELECT 1", {}, Exception("server closed the connection")))
+    assert is_retryable_error(RuntimeError("unknown"))
+    assert not is_retryable_error(FileNotFoundError("gone"))
+    assert not is_retryable_error(PermanentProcessingError("unsupported file"))
+    assert not is_retryable_error(IntegrityError("INSERT", {}, Exception("duplicate key")))
@@ -0,0 +1,87 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from prometheus_client import REGISTRY
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.core import security
+from app.core.metrics import CounterCollector, observe_llm_usage, timed_completion
+from app.services import rabbitmq
+from db import database
+
+
+def _sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class FakeCompletions:
+    def __init__(self, error=None):
+        self.error = error
+
+    async def create(self, **kwargs):
+        if self.error:
+            raise self.error
+        return SimpleNamespace(usage=SimpleNamespace(prompt_tokens=120, completion_tokens=30))
+
+
+def _client(error=None):
+    return SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions(error)))
+
+
+def test_timed_completion_records_duration_outcome_and_tokens():
+    labels = {"call_type": "decision", "model": "test-model"}
+    calls = _sample("rag_llm_request_seconds_count", outcome="ok", **labels)
+    prompt_tokens = _sample("rag_llm_tokens_sum", kind="prompt", **labels)
+
+    asyncio.run(timed_completion(_client(), "decision", model="test-model", messages=[]))
+    with pytest.raises(RuntimeError):
+        asyncio.run(timed_completion(_client(RuntimeError("down")), "decision", model="test-model", messages=[]))
+
+    assert _sample("rag_llm_request_seconds_count", outcome="ok", **labels) == calls + 1
+    assert _sample("rag_llm_request_seconds_count", outcome="error", **labels) >= 1
+    assert _sample("rag_llm_tokens_sum", kind="prompt", **labels) == prompt_tokens + 120
+
+
+def test_stream_usage_dict_skips_missing_counts():
+    labels = {"call_type": "answer", "model": "usage-model"}
+    observe_llm_usage("answer", "usage-model", {"prompt_tokens": 50, "completion_tokens": 0, "total_tokens": 50})
+
+    assert _sample("rag_llm_tokens_count", kind="prompt", **labels) == 1
+    assert _sample("rag_llm_tokens_count", kind="completion", **labels) == 0
+
+
+def test_counter_collector_exports_existing_counters(monkeypatch):
+    monkeypatch.setattr(rabbitmq, "retry_metrics", rabbitmq.Counter({("document_processing", "retried"): 3}))
+    monkeypatch.setattr(security, "password_metrics", security.Counter({"login_failed": 2, "verify_calls": 5, "verify_seconds": 1.5}))
+
+    samples = {
+        (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+        for family in CounterCollector().collect() for sample in family.samples
+    }
+
+    assert samples[("rag_message_retries_total", (("outcome", "retried"), ("queue", "document_processing")))] == 3
+    assert samples[("rag_logins_total", (("outcome", "failed"),))] == 2
+    assert samples[("rag_password_verify_total", ())] == 5
+    assert samples[("rag_password_verify_seconds_total", ())] == 1.5
+
+
+def test_database_sessions_record_pool_wait_only_when_they_connect(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/app.db")
+    session_factory = async_sessionmaker(bind=engine, sync_session_class=database.TimedSession)
+    waits = _sample("rag_db_pool_wait_seconds_count")
+
+    async def use_sessions():
+        async with session_factory():
+            pass # Never queried, so never connected
+        async with session_factory() as session:
+            assert await session.scalar(text("SELECT 1")) == 1
+            assert await session.scalar(text("SELECT 2")) == 2 # Same transaction, same connection
+            await session.commit()
+            assert await session.scalar(text("SELECT 3")) == 3
+        await engine.dispose()
+
+    asyncio.run(use_sessions())
+
+    assert _sample("rag_db_pool_wait_seconds_count") == waits + 2
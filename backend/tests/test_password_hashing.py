@@ -0,0 +1,20 @@
+import asyncio
+
+from app.config.config import getConfig
+from app.core import security
+
+
+def test_hashing_runs_in_pool_and_detects_cost_changes(monkeypatch):
+    monkeypatch.setattr(getConfig(), "BCRYPT_ROUNDS", 4)
+    calls = security.password_metrics["verify_calls"]
+
+    hashed = asyncio.run(security.hash_password_async("s3cret"))
+
+    assert hashed.startswith("$2b$04$")
+    assert asyncio.run(security.verify_password_async("s3cret", hashed))
+    assert not asyncio.run(security.verify_password_async("wrong", hashed))
+    assert security.password_metrics["verify_calls"] == calls + 2
+    assert not security.password_needs_rehash(hashed)
+
+    monkeypatch.setattr(getConfig(), "BCRYPT_ROUNDS", 5)
+    assert security.password_needs_rehash(hashed)
@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from app.core.principal_cache import Principal
+from app.models.models import Base, Permission, Project, ProjectPermission, User
+from app.services import permission as permission_module
+from app.services.permission import PermissionEngine, ScopeSet, require_permission
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    engine = PermissionEngine(ttl_seconds=60)
+    monkeypatch.setattr(permission_module, "permission_engine", engine)
+    return engine
+
+
+def _sessions(tmp_path):
+    """A sync session to change permissions and an async one to load scopes, on the same SQLite file."""
+    db_engine = create_engine(f"sqlite:///{tmp_path}/app.db")
+    Base.metadata.create_all(bind=db_engine)
+    db = sessionmaker(bind=db_engine, expire_on_commit=False)()
+    db.add_all([
+        User(id=1, email="ann@example.com", username="ann", hashed_password="x"),
+        User(id=2, email="bob@example.com", username="bob", hashed_password="x"),
+        Project(id=1, project_name="Reports"),
+        Permission(id=1, name="view_project"),
+        Permission(id=2, name="admin"),
+        ProjectPermission(project_id=1, user_id=1, permission_id=1),
+    ])
+    db.commit()
+    return db, async_sessionmaker(bind=create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/app.db", poolclass=NullPool))
+
+
+def _scope_set(engine, async_session_factory, user_id):
+    async def load():
+        async with async_session_factory() as async_db:
+            return await engine.scope_set(async_db, user_id)
+    return asyncio.run(load())
+
+
+def test_scope_set_checks_alternatives_and_admin():
+    scopes = ScopeSet.from_scopes(["1:view_project", "2:admin"])
+
+    assert scopes.allows(1, frozenset({"edit_project", "view_project"}))
+    assert not scopes.allows(1, frozenset({"edit_project"}))
+    assert scopes.allows(2, frozenset({"anything"}))
+    assert not scopes.allows(3, frozenset({"view_project"}))
+    assert "1:view_project" in scopes
+
+
+def test_committed_permission_changes_bump_versions(engine, tmp_path):
+    db, async_db = _sessions(tmp_path)
+    first = _scope_set(engine, async_db, 1)
+    assert _scope_set(engine, async_db, 1) is first
+    version, other_version = engine.version(1), engine.version(2)
+
+    db.add(ProjectPermission(project_id=1, user_id=1, permission_id=2))
+    db.flush()
+    assert engine.version(1) == version # Not before the commit
+    db.commit()
+
+    assert engine.version(1) > version and engine.version(2) == other_version
+    assert _scope_set(engine, async_db, 1).permissions(1) == {"view_project", "admin"}
+
+
+def test_bulk_delete_bumps_everyone_and_rollback_nothing(engine, tmp_path):
+    db, async_db = _sessions(tmp_path)
+    version = engine.version(2)
+
+    db.add(ProjectPermission(project_id=1, user_id=2, permission_id=1))
+    db.rollback()
+    assert engine.version(2) == version
+
+    db.query(ProjectPermission).filter(ProjectPermission.project_id == 1).delete()
+    db.commit()
+    assert engine.version(2) > version
+    assert _scope_set(engine, async_db, 1).permissions(1) == frozenset()
+
+
+def test_require_permission_uses_principal_scopes_without_a_session(engine, monkeypatch):
+    monkeypatch.setattr(permission_module, "AsyncSessionLocal", None) # Any DB access would fail
+
+    @require_permission(["edit_project", "view_project"])
+    async def endpoint(project_id: int, current_user=None):
+        return "ok"
+
+    principal = Principal(id=1, email="ann@example.com", username="ann", is_active=True, is_superuser=False,
+                          created_at=None, updated_at=None, issued_at=0,
+                          scopes=ScopeSet.from_scopes(["1:view_project"]), permission_version=engine.version(1))
+
+    assert asyncio.run(endpoint(project_id=1, current_user=principal)) == "ok"
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(endpoint(project_id=2, current_user=principal))
+    assert error.value.status_code == 403
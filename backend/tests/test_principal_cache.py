@@ -0,0 +1,78 @@
+import asyncio
+
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.core import security
+from app.core.principal_cache import Principal, PrincipalCache
+from app.models.models import Base, Permission, Project, ProjectPermission, User
+
+
+def _principal(user_id):
+    return Principal(id=user_id, email=f"{user_id}@example.com", username="u", is_active=True, is_superuser=False,
+                     created_at=None, updated_at=None, issued_at=0)
+
+
+def test_cache_expires_evicts_and_invalidates():
+    now = [0.0]
+    cache = PrincipalCache(max_size=2, ttl_seconds=10, clock=lambda: now[0])
+    cache.put(("a", 1), _principal(1))
+    cache.put(("b", 1), _principal(2))
+    cache.get(("a", 1))
+    cache.put(("c", 1), _principal(3)) # Evicts the least recently used entry, ("b", 1)
+
+    assert cache.get(("b", 1)) is None and cache.get(("a", 1)).id == 1
+    cache.invalidate_user(1)
+    assert cache.get(("a", 1)) is None
+    now[0] = 11
+    assert cache.get(("c", 1)) is None and len(cache) == 0
+
+
+def _sessions(tmp_path):
+    """A sync session (as used by the permission endpoints) and an async one on the same SQLite file."""
+    engine = create_engine(f"sqlite:///{tmp_path}/app.db")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine, expire_on_commit=False)()
+    db.add_all([
+        User(id=1, email="ann@example.com", username="ann", hashed_password="x"),
+        Project(id=1, project_name="Reports"),
+        Permission(id=1, name="view_project"),
+        Permission(id=2, name="edit_project"),
+        ProjectPermission(project_id=1, user_id=1, permission_id=1),
+    ])
+    db.commit()
+    async_db = async_sessionmaker(bind=create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/app.db"), expire_on_commit=False)()
+    return db, async_db
+
+
+def test_cached_principal_skips_the_database(monkeypatch, tmp_path):
+    monkeypatch.setattr(security, "principal_cache", PrincipalCache(ttl_seconds=60))
+    db, async_db = _sessions(tmp_path)
+    token = security.createAccessToken({"sub": "ann@example.com", "scopes": ["1:view_project"]})
+
+    async def scenario():
+        principal = await security.get_current_user(token, None, async_db)
+        db.query(User).delete()
+        db.commit()
+        assert await security.get_current_user(token, None, async_db) is principal
+        return principal
+
+    principal = asyncio.run(scenario())
+    assert principal.scopes.permissions(1) == {"view_project"}
+
+
+def test_permission_change_makes_token_scopes_stale(monkeypatch, tmp_path):
+    monkeypatch.setattr(security, "principal_cache", PrincipalCache(ttl_seconds=60))
+    db, async_db = _sessions(tmp_path)
+    token = security.createAccessToken({"sub": "ann@example.com", "scopes": ["1:view_project"]})
+
+    async def scenario():
+        await security.get_current_user(token, None, async_db)
+        db.add(ProjectPermission(project_id=1, user_id=1, permission_id=2))
+        security.invalidate_user_principals(db, [1])
+        db.commit()
+        await async_db.close() # Ends its read transaction
+        return await security.get_current_user(token, None, async_db)
+
+    assert asyncio.run(scenario()).scopes.permissions(1) == {"view_project", "edit_project"}
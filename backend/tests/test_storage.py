@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+from botocore.exceptions import ClientError
+
+from app.services.storage import LocalStorage, S3Storage, Storage
+
+
+class MissingObjectS3:
+    def copy(self, **kwargs):
+        # The managed copy looks up the source's size first
+        raise ClientError({"Error": {"Code": "404"}}, "HeadObject")
+
+    def get_object(self, **kwargs):
+        raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+
+
+def test_local_storage_round_trip(tmp_path):
+    storage = LocalStorage(str(tmp_path / "store"))
+    source = tmp_path / "report.txt"
+    source.write_bytes(b"report")
+
+    stored = storage.copy(str(source), "project_1/abc/report.txt", "text/plain")
+    markdown = storage.save_bytes(b"# Report", "markdowns/project_1/abc/abc.md", "text/markdown")
+    storage.download_file(stored, str(tmp_path / "work" / "report.txt"))
+
+    assert stored == str(tmp_path / "store" / "project_1" / "abc" / "report.txt")
+    assert storage.read_bytes(markdown) == b"# Report"
+    assert (tmp_path / "work" / "report.txt").read_bytes() == b"report"
+    storage.delete(stored)
+    with pytest.raises(FileNotFoundError):
+        storage.read_bytes(stored)
+
+
+def test_local_storage_streams_and_rejects_s3_links(tmp_path):
+    storage = LocalStorage(str(tmp_path))
+
+    async def chunks(*parts):
+        for part in parts:
+            yield part
+
+    assert asyncio.run(storage.save_stream(chunks(), "uploads/empty.txt", "text/plain")) is None
+    path = asyncio.run(storage.save_stream(chunks(b"a", b"b"), "uploads/ab.txt", "text/plain"))
+    assert storage.read_bytes(path) == b"ab"
+    with pytest.raises(FileNotFoundError):
+        storage.read_bytes("s3://documents/report.txt")
+
+
+def test_missing_s3_objects_raise_file_not_found():
+    storage = S3Storage(MissingObjectS3(), "documents")
+
+    with pytest.raises(FileNotFoundError):
+        storage.copy("s3://documents/uploads/x.pdf", "project_1/abc/x.pdf", "application/pdf")
+    with pytest.raises(FileNotFoundError):
+        storage.read_bytes("s3://documents/markdowns/x.md")
+
+
+class RecordingS3:
+    def __init__(self):
+        self.copies = []
+
+    def copy(self, **kwargs):
+        self.copies.append(kwargs)
+
+
+def test_s3_copy_is_a_managed_transfer_with_the_storage_transfer_config():
+    client = RecordingS3()
+    storage = S3Storage(client, "documents")
+
+    stored = storage.copy("s3://uploads/staged/x.pdf", "project_1/abc/x.pdf", "application/pdf")
+
+    assert stored == "s3://documents/project_1/abc/x.pdf"
+    [copy] = client.copies
+    assert copy["CopySource"] == {"Bucket": "uploads", "Key": "staged/x.pdf"}
+    assert copy["ExtraArgs"]["ContentType"] == "application/pdf"
+    assert copy["Config"] is storage.transfer_config
+
+
+def test_s3_storage_is_not_a_local_storage_but_still_reads_local_paths(tmp_path):
+    storage = S3Storage(MissingObjectS3(), "documents")
+    legacy = tmp_path / "legacy.md"
+    legacy.write_bytes(b"# Legacy")
+
+    assert isinstance(storage, Storage) and not isinstance(storage, LocalStorage)
+    assert not hasattr(storage, "root")
+    assert storage.read_bytes(str(legacy)) == b"# Legacy"
+    storage.delete(str(legacy))
+    assert not legacy.exists()
@@ -0,0 +1,72 @@
+import pytest
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+from app.core.tracing import (
+    collect_stage_timings, extract_trace_context, inject_trace_headers, record_stage, stage_span, start_span, trace_id_hex,
+)
+
+# The global tracer provider can only be set once per process
+exporter = InMemorySpanExporter()
+_provider = TracerProvider()
+_provider.add_span_processor(SimpleSpanProcessor(exporter))
+trace.set_tracer_provider(_provider)
+
+
+@pytest.fixture(autouse=True)
+def clear_spans():
+    exporter.clear()
+    yield
+    collect_stage_timings(None)
+
+
+def test_stage_spans_nest_and_fill_stage_timings():
+    timings = {}
+    collect_stage_timings(timings)
+    request_span = start_span("chat.respond")
+    parent = trace.set_span_in_context(request_span)
+
+    with stage_span("chat.retrieval", parent=parent):
+        with stage_span("embedding", **{"embedding.texts": 1}):
+            pass
+    record_stage("llm.answer.ttft", 12.345)
+    request_span.end()
+
+    spans = {span.name: span for span in exporter.get_finished_spans()}
+    assert spans["chat.retrieval"].parent.span_id == request_span.get_span_context().span_id
+    assert spans["embedding"].parent.span_id == spans["chat.retrieval"].context.span_id
+    assert spans["embedding"].attributes["embedding.texts"] == 1
+    assert set(timings) == {"chat.retrieval", "embedding", "llm.answer.ttft"}
+    assert timings["llm.answer.ttft"] == 12.3
+
+
+def test_stage_timings_are_not_collected_by_default():
+    with stage_span("chat.load_history"):
+        pass
+    record_stage("llm.answer.ttft", 5)
+
+    assert [span.name for span in exporter.get_finished_spans()] == ["chat.load_history"]
+
+
+def test_message_headers_carry_the_trace_to_the_consumer():
+    with stage_span("rabbitmq.publish") as publish_span:
+        headers = inject_trace_headers({"x-attempt": 2})
+
+    # pika delivers header values as bytes
+    delivered = {key: value.encode() if isinstance(value, str) else value for key, value in headers.items()}
+    with stage_span("ingest.document", parent=extract_trace_context(delivered)) as ingest_span:
+        pass
+
+    assert headers["x-attempt"] == 2
+    assert trace_id_hex(ingest_span) == trace_id_hex(publish_span)
+    assert ingest_span.parent.span_id == publish_span.get_span_context().span_id
+
+
+def test_message_without_trace_headers_starts_a_new_trace():
+    with stage_span("ingest.document", parent=extract_trace_context(None)) as span:
+        pass
+
+    assert span.parent is None
+    assert trace_id_hex(span) is not None
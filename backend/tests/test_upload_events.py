@@ -0,0 +1,72 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+from app.services.upload_events import UploadStatusBroadcaster, _psycopg_dsn
+
+
+class FakeConnection:
+    """Stands in for psycopg.AsyncConnection: replays notifications, then waits forever."""
+
+    def __init__(self, payloads):
+        self.payloads = payloads
+        self.executed = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def execute(self, statement):
+        self.executed.append(statement)
+
+    async def notifies(self):
+        for payload in self.payloads:
+            yield SimpleNamespace(payload=payload)
+        await asyncio.Event().wait()
+
+
+def _broadcaster(connection, **kwargs):
+    async def connect(dsn, autocommit):
+        return connection
+    return UploadStatusBroadcaster(database_url="postgresql+psycopg://u:p@db/app", connect=connect, **kwargs)
+
+
+def test_notifications_reach_subscribers_of_the_project_only():
+    connection = FakeConnection([
+        json.dumps({"upload_id": 1, "project_id": 7, "upload_status": "processing"}),
+        "not json",
+        json.dumps({"upload_id": 2, "project_id": 8, "upload_status": "processing"}),
+        json.dumps({"upload_id": 1, "project_id": 7, "upload_status": "completed"}),
+    ])
+    broadcaster = _broadcaster(connection)
+
+    async def run():
+        with broadcaster.subscribe(7) as events:
+            received = [await asyncio.wait_for(events.get(), 1) for _ in range(2)]
+        await broadcaster.close()
+        return received
+
+    received = asyncio.run(run())
+    assert [event["upload_status"] for event in received] == ["processing", "completed"]
+    assert connection.executed == ["LISTEN document_upload_status"]
+    assert broadcaster._subscribers == {}
+
+
+def test_slow_subscriber_drops_oldest_events():
+    broadcaster = _broadcaster(FakeConnection([]), queue_size=2)
+
+    async def run():
+        with broadcaster.subscribe(7) as events:
+            for upload_id in (1, 2, 3):
+                broadcaster.publish({"upload_id": upload_id, "project_id": 7})
+            received = [events.get_nowait()["upload_id"] for _ in range(events.qsize())]
+        await broadcaster.close()
+        return received
+
+    assert asyncio.run(run()) == [2, 3]
+
+
+def test_dsn_drops_the_sqlalchemy_driver():
+    assert _psycopg_dsn("postgresql+psycopg://user:secret@db:5432/app") == "postgresql://user:secret@db:5432/app"
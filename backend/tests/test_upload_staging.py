@@ -0,0 +1,170 @@
+import asyncio
+import hashlib
+import io
+import os
+
+import pytest
+from fastapi import UploadFile
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from starlette.datastructures import Headers
+
+from app.models.models import Base, Document, DocumentUpload, Project
+from app.services import document as document_module
+from app.services.document import DocumentService, UploadTooLargeError, discard_staged_upload, stage_upload_file
+from app.services.storage import LocalStorage, S3Storage, set_storage
+
+
+class FakeS3:
+    """Keeps objects and multipart uploads in memory, recording the size of every request body."""
+
+    def __init__(self):
+        self.objects = {}
+        self.multipart = {}
+        self.bodies = []
+
+    def put_object(self, Bucket, Key, Body, ContentType):
+        self.bodies.append(len(Body))
+        self.objects[(Bucket, Key)] = Body
+
+    def create_multipart_upload(self, Bucket, Key, ContentType):
+        self.multipart[Key] = {}
+        return {"UploadId": Key}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.bodies.append(len(Body))
+        self.multipart[UploadId][PartNumber] = Body
+        return {"ETag": f"etag-{PartNumber}"}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.multipart.pop(UploadId)
+        self.objects[(Bucket, Key)] = b"".join(parts[part["PartNumber"]] for part in MultipartUpload["Parts"])
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.multipart.pop(UploadId)
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key))
+
+
+def _upload(data: bytes) -> UploadFile:
+    return UploadFile(file=io.BytesIO(data), filename="report.pdf")
+
+
+def test_large_upload_is_streamed_in_parts_and_hashed():
+    s3 = FakeS3()
+    data = os.urandom(5 * document_module.UPLOAD_READ_SIZE + 123)
+
+    path, size, file_hash = asyncio.run(stage_upload_file(_upload(data), S3Storage(s3, "documents"), "uploads/", 2 * document_module.UPLOAD_READ_SIZE))
+
+    assert path.startswith("s3://documents/uploads/") and path.endswith(".pdf")
+    assert (size, file_hash) == (len(data), hashlib.sha256(data).hexdigest())
+    assert s3.objects[("documents", path[len("s3://documents/"):])] == data
+    assert max(s3.bodies) == 2 * document_module.UPLOAD_READ_SIZE
+    assert len(s3.bodies) == 3
+
+
+def test_small_and_empty_uploads():
+    s3 = FakeS3()
+    storage = S3Storage(s3, "documents")
+
+    path, size, _ = asyncio.run(stage_upload_file(_upload(b"hello"), storage))
+    empty_path, empty_size, _ = asyncio.run(stage_upload_file(_upload(b""), storage))
+
+    assert size == 5 and len(s3.objects) == 1
+    assert (empty_path, empty_size) == ("", 0)
+    discard_staged_upload(storage, path)
+    assert s3.objects == {}
+
+
+def test_too_large_upload_leaves_nothing_behind(monkeypatch, tmp_path):
+    monkeypatch.setattr(document_module, "MAX_FILE_SIZE", 3 * document_module.UPLOAD_READ_SIZE)
+    s3 = FakeS3()
+    data = b"x" * (4 * document_module.UPLOAD_READ_SIZE)
+
+    with pytest.raises(UploadTooLargeError):
+        asyncio.run(stage_upload_file(_upload(data), S3Storage(s3, "documents"), "uploads/", document_module.UPLOAD_READ_SIZE))
+    with pytest.raises(UploadTooLargeError):
+        asyncio.run(stage_upload_file(_upload(data), LocalStorage(str(tmp_path))))
+
+    assert s3.objects == {} and s3.multipart == {}
+    assert os.listdir(tmp_path) == []
+
+
+def test_local_staging_writes_file(tmp_path):
+    path, size, file_hash = asyncio.run(stage_upload_file(_upload(b"local bytes"), LocalStorage(str(tmp_path)), "uploads/"))
+
+    with open(path, "rb") as f:
+        assert f.read() == b"local bytes"
+    assert (size, file_hash) == (11, hashlib.sha256(b"local bytes").hexdigest())
+
+
+class FakeRabbitMQ:
+    def __init__(self, fail_ids=()):
+        self.fail_ids = set(fail_ids)
+        self.batches = []
+
+    def publish_messages(self, queue_name, messages):
+        self.batches.append(messages)
+        return [message["document_upload_id"] not in self.fail_ids for message in messages]
+
+
+def test_batch_upload_checks_duplicates_and_inserts_in_one_go(tmp_path):
+    set_storage(LocalStorage(str(tmp_path)))
+    engine = create_engine(f"sqlite:///{tmp_path}/app.db")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    db.add(Project(id=1, project_name="Reports"))
+    db.add(Document(id=7, file_path="x", file_name="old.txt", file_size=3, file_hash=hashlib.sha256(b"old").hexdigest(), project_id=1, uploaded_by=1))
+    db.commit()
+    rabbitmq = FakeRabbitMQ(fail_ids={2})
+
+    def text_upload(name, data, content_type="text/plain"):
+        return UploadFile(file=io.BytesIO(data), filename=name, headers=Headers({"content-type": content_type}))
+
+    async def upload():
+        async with async_sessionmaker(bind=create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/app.db"))() as async_db:
+            service = DocumentService(db=async_db, rabbitmq_service=rabbitmq)
+            return await service.upload_documents([
+                text_upload("a.txt", b"first"),
+                text_upload("old.txt", b"old"),
+                text_upload("b.txt", b"second"),
+                text_upload("c.exe", b"binary", "application/octet-stream"),
+                text_upload("d.txt", b""),
+                text_upload("e.txt", b"third"),
+            ], project_id=1, user_id=1)
+
+    results = asyncio.run(upload())
+
+    assert [result["status"] for result in results] == ["queued", "exists", "error", "error", "error", "queued"]
+    assert results[1]["document_id"] == 7
+    assert [result["upload_id"] for result in results] == [1, None, 2, None, None, 3]
+    assert rabbitmq.batches == [[{"document_upload_id": 1}, {"document_upload_id": 2}, {"document_upload_id": 3}]]
+    uploads = db.query(DocumentUpload).order_by(DocumentUpload.id).all()
+    assert [(upload.file_name, upload.status) for upload in uploads] == [("a.txt", "queued"), ("b.txt", "error"), ("e.txt", "queued")]
+    assert len(os.listdir(tmp_path / "uploads")) == 3 # The duplicate was discarded, the unqueued upload is kept for a requeue
+    set_storage(None)
+
+
+def test_only_uploads_flagged_as_replacements_name_the_document_they_replace(tmp_path):
+    set_storage(LocalStorage(str(tmp_path)))
+    engine = create_engine(f"sqlite:///{tmp_path}/app.db")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    db.add(Project(id=1, project_name="Reports"))
+    db.add(Document(id=7, file_path="x", file_name="guide.txt", file_size=3, file_hash="old", project_id=1, uploaded_by=1))
+    db.commit()
+
+    async def upload(data, replace_existing):
+        async with async_sessionmaker(bind=create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/app.db"))() as async_db:
+            service = DocumentService(db=async_db, rabbitmq_service=FakeRabbitMQ())
+            files = [UploadFile(file=io.BytesIO(data), filename="guide.txt", headers=Headers({"content-type": "text/plain"}))]
+            return await service.upload_documents(files, project_id=1, user_id=1, replace_existing=replace_existing)
+
+    asyncio.run(upload(b"same name, other file", False))
+    asyncio.run(upload(b"new version", True))
+
+    uploads = db.query(DocumentUpload).order_by(DocumentUpload.id).all()
+    assert [upload.replaces_document_id for upload in uploads] == [None, 7]
+    set_storage(None)